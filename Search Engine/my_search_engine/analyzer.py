@@ -0,0 +1,181 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Text analysis: how documents and queries are turned into index terms. Indexer, IndexUpdater and SearchEngine
+# all take the analyzer from the index's manifest (see segments.py), where Indexer records the configuration it
+# built the index with, so queries are always analyzed the same way as the documents they search.
+#
+# The steps, in order: Unicode normalization (NFKC folds ligatures, full-width letters and the like into
+# their plain forms), lower-casing, splitting into words with one precompiled pattern, dropping stopwords and
+# stemming. Stopwords still take up a position, so phrase and NEAR queries keep their distances.
+
+# Lucene's English stopword list: words so common that their postings cover most of the corpus, making them
+# the biggest lists in the index and the slowest terms to search, while saying nothing about relevance
+ENGLISH_STOPWORDS = frozenset("""
+a an and are as at be but by for if in into is it no not of on or such that the their then there these they
+this to was will with
+""".split())
+STOPWORD_LISTS = {'english': ENGLISH_STOPWORDS}
+STEM_CACHE_SIZE = 100000 # Distinct words whose stems are kept; word frequencies are skewed, so most hit
+
+DEFAULT_CONFIG = {'pattern': r'\b\w+\b', 'normalization': 'NFKC', 'lowercase': True, 'stopwords': 'english', 'stemmer': None}
+# What indexes built before analyzers were configurable used
+LEGACY_CONFIG = {'pattern': r'\b\w+\b', 'normalization': None, 'lowercase': True, 'stopwords': None, 'stemmer': None}
+
+# Porter stemmer (M. F. Porter, "An algorithm for suffix stripping", 1980), for lower-case English words
+
+def _is_consonant(word, i):
+    if word[i] in 'aeiou':
+        return False
+    if word[i] == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+def _measure(stem):
+    """m in [C](VC)^m[V]: how many vowel-consonant sequences stem has."""
+    forms = ''.join('c' if _is_consonant(stem, i) else 'v' for i in range(len(stem)))
+    return forms.count('vc')
+
+def _has_vowel(stem):
+    return any(not _is_consonant(stem, i) for i in range(len(stem)))
+
+def _ends_double_consonant(word):
+    return len(word) >= 2 and word[-1] == word[-2] and _is_consonant(word, len(word) - 1)
+
+def _ends_cvc(word):
+    """Ends consonant-vowel-consonant, the last not w, x or y (as in hop, but not in snow or box)."""
+    return (len(word) >= 3 and _is_consonant(word, len(word) - 3) and not _is_consonant(word, len(word) - 2)
+            and _is_consonant(word, len(word) - 1) and word[-1] not in 'wxy')
+
+def _replace_suffix(word, rules, condition):
+    """Applies the rule for the longest of rules' suffixes that word ends with, if condition(stem) holds."""
+    for suffix, replacement in rules:
+        if word.endswith(suffix):
+            stem = word[:len(word) - len(suffix)]
+            return stem + replacement if condition(stem) else word
+    return word
+
+# Longest suffixes first, so the first match is the longest
+_STEP2_RULES = sorted([
+    ('ational', 'ate'), ('tional', 'tion'), ('enci', 'ence'), ('anci', 'ance'), ('izer', 'ize'), ('abli', 'able'),
+    ('alli', 'al'), ('entli', 'ent'), ('eli', 'e'), ('ousli', 'ous'), ('ization', 'ize'), ('ation', 'ate'),
+    ('ator', 'ate'), ('alism', 'al'), ('iveness', 'ive'), ('fulness', 'ful'), ('ousness', 'ous'), ('aliti', 'al'),
+    ('iviti', 'ive'), ('biliti', 'ble'),
+], key=lambda rule: -len(rule[0]))
+_STEP3_RULES = sorted([
+    ('icate', 'ic'), ('ative', ''), ('alize', 'al'), ('iciti', 'ic'), ('ical', 'ic'), ('ful', ''), ('ness', ''),
+], key=lambda rule: -len(rule[0]))
+_STEP4_SUFFIXES = sorted([
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent', 'ion', 'ou', 'ism', 'ate',
+    'iti', 'ous', 'ive', 'ize',
+], key=lambda suffix: -len(suffix))
+
+def porter_stem(word):
+    """The Porter stem of a lower-case word: connected, connecting and connection all become connect."""
+    if len(word) <= 2 or not word.isascii() or not word.isalpha():
+        return word
+
+    # Step 1a: plurals
+    if word.endswith('sses') or word.endswith('ies'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+
+    # Step 1b: -ed and -ing
+    if word.endswith('eed'):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ('ed', 'ing'):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith(('at', 'bl', 'iz')):
+                    word += 'e'
+                elif _ends_double_consonant(word) and word[-1] not in 'lsz':
+                    word = word[:-1]
+                elif _measure(word) == 1 and _ends_cvc(word):
+                    word += 'e'
+                break
+
+    # Step 1c: y -> i
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+
+    # Steps 2 and 3: double and single suffixes
+    word = _replace_suffix(word, _STEP2_RULES, lambda stem: _measure(stem) > 0)
+    word = _replace_suffix(word, _STEP3_RULES, lambda stem: _measure(stem) > 0)
+
+    # Step 4: remove suffixes from long enough stems
+    for suffix in _STEP4_SUFFIXES:
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            if _measure(stem) > 1 and (suffix != 'ion' or stem.endswith(('s', 't'))):
+                word = stem
+            break
+
+    # Step 5: tidy up a final e and ll
+    if word.endswith('e'):
+        stem = word[:-1]
+        if _measure(stem) > 1 or (_measure(stem) == 1 and not _ends_cvc(stem)):
+            word = stem
+    if _measure(word) > 1 and _ends_double_consonant(word) and word.endswith('l'):
+        word = word[:-1]
+    return word
+
+# Module level, so that every Analyzer in a process shares one memo, and analyzers can be pickled
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def cached_porter_stem(word):
+    return porter_stem(word)
+
+STEMMERS = {'porter': cached_porter_stem}
+
+class Analyzer:
+    """
+    Turns text into index terms. pattern finds the words (after normalization, a Unicode normal form or None,
+    and lower-casing); stopwords names a list in STOPWORD_LISTS (or None to keep every word), and stemmer one
+    in STEMMERS (or None).
+    """
+    def __init__(self, pattern=r'\b\w+\b', normalization='NFKC', lowercase=True, stopwords='english', stemmer=None):
+        self.pattern = re.compile(pattern)
+        self.normalization = normalization
+        self.lowercase = lowercase
+        self.stopword_list = stopwords
+        self.stopwords = STOPWORD_LISTS[stopwords] if stopwords else frozenset()
+        self.stemmer = stemmer
+        self.stem = STEMMERS[stemmer] if stemmer else None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+    def config(self):
+        """What the manifest records, so that the index is always searched with the analyzer it was built with."""
+        return {'pattern': self.pattern.pattern, 'normalization': self.normalization, 'lowercase': self.lowercase,
+                'stopwords': self.stopword_list, 'stemmer': self.stemmer}
+
+    def positions(self, text):
+        """[(term, position), ...] for text's words, leaving out stopwords (which still count as positions)."""
+        if self.normalization:
+            text = unicodedata.normalize(self.normalization, text)
+        if self.lowercase:
+            text = text.lower()
+        stopwords, stem = self.stopwords, self.stem
+        return [(stem(word) if stem else word, position)
+                for position, word in enumerate(self.pattern.findall(text)) if word not in stopwords]
+
+    def analyze(self, text):
+        """text's terms, in order."""
+        return [term for term, _ in self.positions(text)]
+
+    def term(self, word):
+        """The term a single word is indexed as, or None if it is a stopword."""
+        terms = self.analyze(word)
+        return terms[0] if len(terms) == 1 else None
+
+def manifest_analyzer(manifest):
+    """The analyzer of the index manifest describes: the one it records, else what it was built with before analyzers were recorded."""
+    config = manifest.get('analyzer')
+    if config is None:
+        config = LEGACY_CONFIG if manifest['segments'] else DEFAULT_CONFIG
+    return Analyzer.from_config(config)
@@ -1,21 +1,49 @@
-from flask import Flask, request, render_template_string, url_for
+from flask import Flask, jsonify, make_response, request, render_template, url_for
+import gzip
+import hashlib
 import os
 import sys
 import json
 import re
-import random # <--- NEW: Import the random module
+
+try:
+    import brotli # Optional: without it, responses are only gzip-compressed
+except ImportError:
+    brotli = None
 
 # Add the parent directory to the Python path to allow importing searcher.py
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from searcher import SearchEngine
+from searcher import MAX_PREFIX_TERMS
+from shards import open_search_engine
 
 app = Flask(__name__)
+app.json.compact = True # API responses without indentation, even when running with debug=True
 
 # Initialize the search engine
-search_engine_instance = SearchEngine()
-
-# --- NEW: Define LOCAL background images in Python ---
+search_engine_instance = open_search_engine() # Sharded or not, as output/ was built
+
+# Results are ranked and rendered one page at a time
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+MAX_PAGE = 100 # Deeper pages would make every request rank MAX_PAGE * page_size documents
+# The filter tabs: filter=... -> SearchEngine media filter
+MEDIA_FILTERS = {'all': None, 'images': 'images', 'videos': 'videos'}
+MAX_BATCH_QUERIES = 100 # Most queries accepted by one /api/search/batch request
+MAX_SUGGESTIONS = 8 # Completions /suggest returns
+SUGGEST_CACHE_CONTROL = 'public, max-age=60' # Lets browsers reuse suggestions, e.g. after a backspace
+
+# Response compression: only text formats, and only bodies big enough to be worth it
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json'}
+MIN_COMPRESS_BYTES = 500
+COMPRESSED_CACHE_SIZE = 64 # Compressed bodies of static files and the homepage kept in memory
+# Endpoints whose compressed bodies are cached: few and unchanging. Search pages also have ETags, but every
+# query has its own, so caching them would only evict these.
+CACHED_COMPRESSION_ENDPOINTS = {'static', 'home'}
+# Static URLs made by static_url() carry a hash of the file, so browsers may keep them for good
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Background images, one picked at random by the page itself (see templates/index.html)
 # Make sure these filenames exist in your 'static' folder!
 LOCAL_BACKGROUND_IMAGES = [
     "istockphoto-1455772765-640x640.jpg",
@@ -27,342 +55,146 @@ LOCAL_BACKGROUND_IMAGES = [
     # "third_image.jpeg",
 ]
 
-# HTML template for the search interface and results
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Mini Search Engine</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap" rel="stylesheet">
-    <style>
-        /* Global styles */
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Inter', sans-serif;
-        }
-
-        body {
-            margin: 0;
-            background-color: #1a1a2e; /* Darker base color */
-            color: #fff;
-            transition: background-image 1s ease-in-out; /* Smooth transition for background */
-            background-size: cover;
-            background-position: center;
-            background-repeat: no-repeat;
-            display: flex; /* Use flexbox for body to center content */
-            justify-content: center; /* Center horizontally */
-            align-items: center; /* Center vertically */
-            min-height: 100vh; /* Full viewport height */
-            /* --- KEY CHANGE: background image set directly by Flask via background_url --- */
-            background-image: url('{{ background_url }}');
-        }
-
-        .container {
-            width: 100%;
-            max-width: 800px; /* Increased max-width for content */
-            padding: 20px;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            gap: 20px; /* Reduced gap as elements are less distinct */
-        }
-
-        .search-bar {
-            width: 100%;
-            max-width: 600px; /* Max width for the search bar */
-            background: rgba(255, 255, 255, 0.1); /* More subtle background */
-            display: flex;
-            align-items: center;
-            border-radius: 60px;
-            padding: 8px 18px; /* Slightly smaller padding */
-            backdrop-filter: blur(8px) saturate(180%); /* Stronger blur for glass effect */
-            -webkit-backdrop-filter: blur(8px) saturate(180%); /* For Safari */
-            border: 1px solid rgba(255, 255, 255, 0.15); /* Subtle border */
-            box-shadow: 0 4px 20px rgba(0, 0, 0, 0.2); /* Softer shadow */
-        }
-
-        .search-bar input {
-            background: transparent;
-            flex: 1;
-            border: 0;
-            outline: none;
-            padding: 18px 15px; /* Adjusted padding */
-            font-size: 18px;
-            color: #e0e0e0; /* Lighter text color */
-        }
-
-        .search-bar input::placeholder {
-            color: #b0b0b0; /* Lighter placeholder */
-        }
-
-        .search-bar button {
-            border: 0;
-            border-radius: 50%;
-            width: 50px; /* Smaller button */
-            height: 50px; /* Smaller button */
-            background: #6a05ad; /* Purple shade */
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: background 0.3s ease;
-        }
-
-        .search-bar button:hover {
-            background: #8e2de2; /* Lighter purple on hover */
-        }
-
-        .search-bar button svg {
-            width: 22px;
-            height: 22px;
-            fill: #fff;
-        }
-
-        .filter-nav {
-            width: 100%;
-            max-width: 600px; /* Match search bar width */
-            display: flex;
-            justify-content: center;
-            gap: 20px;
-            margin-bottom: 20px;
-        }
-
-        .filter-nav a {
-            color: #cac7ff;
-            text-decoration: none;
-            padding: 8px 15px;
-            border-radius: 20px;
-            transition: background 0.3s ease, color 0.3s ease;
-            font-weight: 600;
-        }
-
-        .filter-nav a:hover {
-            background: rgba(255, 255, 255, 0.15);
-        }
-
-        .filter-nav a.active {
-            background: #a0c4ff;
-            color: #1a1a2e; /* Darker text for active tab */
-        }
-
-        .results-container {
-            width: 100%;
-            max-width: 700px;
-            background: rgba(255, 255, 255, 0.05); /* Very subtle background */
-            border-radius: 15px; /* Slightly smaller radius */
-            padding: 25px; /* Adjusted padding */
-            box-shadow: 0 4px 20px rgba(0, 0, 0, 0.1);
-            backdrop-filter: blur(6px) saturate(150%);
-            -webkit-backdrop-filter: blur(6px) saturate(150%);
-            max-height: 65vh; /* Allow more height for scrollability */
-            overflow-y: auto;
-            border: 1px solid rgba(255, 255, 255, 0.08); /* Subtle border */
-        }
-
-        .results-container h2 {
-            color: #a0c4ff;
-            margin-bottom: 15px;
-            text-align: center;
-            font-size: 1.8em;
-        }
-
-        .results-list {
-            list-style: none;
-            padding: 0;
-        }
-
-        .results-list li {
-            background: rgba(255, 255, 255, 0.03); /* Even more subtle item background */
-            border-radius: 8px;
-            padding: 12px 18px;
-            margin-bottom: 12px;
-            border: 1px solid rgba(255, 255, 255, 0.05); /* Very light border */
-            transition: background 0.2s ease;
-        }
-
-        .results-list li:hover {
-            background: rgba(255, 255, 255, 0.06);
-        }
-
-        .results-list li a {
-            color: #a0c4ff;
-            text-decoration: none;
-            font-size: 1.05em;
-            word-wrap: break-word;
-        }
-
-        .results-list li a:hover {
-            text-decoration: underline;
-        }
-
-        .results-list li strong {
-            color: #a0c4ff;
-            font-size: 1.05em;
-        }
-
-        .results-list li p {
-            font-size: 0.85em;
-            color: #c0c0c0;
-            margin-top: 4px;
-        }
-
-        .no-results {
-            text-align: center;
-            color: #e0e0e0;
-            font-style: italic;
-            padding: 20px;
-        }
-
-        /* Styles for images and videos */
-        .media-container {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 8px; /* Slightly smaller gap */
-            margin-top: 10px;
-            justify-content: center;
-        }
-
-        .media-container img {
-            max-width: 100%;
-            height: auto;
-            max-height: 120px; /* Slightly smaller max height for images */
-            border-radius: 4px;
-            object-fit: contain;
-            background-color: rgba(0, 0, 0, 0.1); /* More subtle media background */
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1); /* Subtle shadow */
-        }
-
-        .media-container video {
-            max-width: 100%;
-            height: auto;
-            max-height: 180px; /* Slightly smaller max height for videos */
-            border-radius: 4px;
-            object-fit: contain;
-            background-color: rgba(0, 0, 0, 0.1);
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        }
-
-        .media-container iframe {
-            max-width: 100%;
-            width: 300px; /* Adjusted width for embeds */
-            height: 170px; /* Adjusted height for embeds */
-            border-radius: 4px;
-            border: none;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        }
-
-    </style>
-</head>
-<body>
-    <div class="container">
-        <form action="{{ url_for('search_results') }}" method="get" class="search-bar">
-            <input type="text" placeholder="Search anything" name="query" value="{{ query if query }}">
-            <button type="submit">
-                <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round" class="lucide lucide-search">
-                    <circle cx="11" cy="11" r="8"/>
-                    <path d="m21 21-4.3-4.3"/>
-                </svg>
-            </button>
-        </form>
-
-        {% if results is not none %}
-        <div class="filter-nav">
-            <a href="{{ url_for('search_results', query=query, filter='all', bg=background_url) }}" class="{{ 'active' if current_filter == 'all' }}">All</a>
-            <a href="{{ url_for('search_results', query=query, filter='images', bg=background_url) }}" class="{{ 'active' if current_filter == 'images' }}">Images</a>
-            <a href="{{ url_for('search_results', query=query, filter='videos', bg=background_url) }}" class="{{ 'active' if current_filter == 'videos' }}">Videos</a>
-        </div>
-
-        <div class="results-container">
-            <h2>Search Results for "{{ query }}"</h2>
-            {% if results %}
-            <ul class="results-list">
-                {% for score, doc_info in results %}
-                {% set show_item = false %}
-                {% if current_filter == 'all' %}
-                    {% set show_item = true %}
-                {% elif current_filter == 'images' and doc_info.images %}
-                    {% set show_item = true %}
-                {% elif current_filter == 'videos' and doc_info.videos %}
-                    {% set show_item = true %}
-                {% endif %}
-
-                {% if show_item %}
-                <li>
-                    <strong>{{ loop.index }}. <a href="{{ doc_info.url }}" target="_blank" rel="noopener noreferrer">{{ doc_info.url }}</a></strong>
-                    <p>Relevance Score: {{ '%.2f' | format(score) }}</p>
-
-                    {% if (current_filter == 'all' or current_filter == 'images') and doc_info.images %}
-                        <div class="media-container">
-                        {% for image in doc_info.images %}
-                            <img src="{{ image.src }}" alt="{{ image.alt }}" loading="lazy">
-                        {% endfor %}
-                        </div>
-                    {% endif %}
-
-                    {% if (current_filter == 'all' or current_filter == 'videos') and doc_info.videos %}
-                        <div class="media-container">
-                        {% for video in doc_info.videos %}
-                            {% if video.type == 'direct' %}
-                                <video controls preload="none">
-                                    <source src="{{ video.src }}" type="video/mp4">
-                                    Your browser does not support the video tag.
-                                </video>
-                            {% elif video.type == 'embed' %}
-                                <iframe src="{{ video.src }}" frameborder="0" allowfullscreen></iframe>
-                            {% endif %}
-                        {% endfor %}
-                        </div>
-                    {% endif %}
-                </li>
-                {% endif %}
-                {% endfor %}
-            </ul>
-            {% else %}
-            <p class="no-results">No results found for your query.</p>
-            {% endif %}
-        </div>
-        {% endif %}
-    </div>
-
-    </body>
-</html>
-"""
+_static_versions = {} # static filename -> hash of its contents
+_compressed_bodies = {} # (ETag, encoding) -> compressed body of a static file or the homepage
+
+def static_url(filename):
+    """URL of a static file, fingerprinted with a hash of its contents so it can be cached indefinitely."""
+    version = _static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = hashlib.md5(f.read()).hexdigest()[:12]
+        _static_versions[filename] = version
+    return url_for('static', filename=filename, v=version)
+
+@app.context_processor
+def template_helpers():
+    return {'static_url': static_url, 'background_urls': [static_url(name) for name in LOCAL_BACKGROUND_IMAGES]}
+
+def render_page(**context):
+    """Renders templates/index.html with a weak ETag, answering 304 Not Modified if the browser already has it."""
+    response = make_response(render_template('index.html', **context))
+    response.add_etag(weak=True) # Weak: the same page compressed differently is still the same page
+    response.headers['Cache-Control'] = 'no-cache' # May be stored, but must be revalidated with the ETag
+    return response.make_conditional(request)
+
+@app.after_request
+def cache_static_files(response):
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        filename = request.view_args.get('filename')
+        if filename in _static_versions and request.args.get('v') == _static_versions[filename]:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Brotli- (if installed) or gzip-compresses text responses for clients that accept it."""
+    if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if brotli is not None and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.direct_passthrough = False # Static files are streamed from disk unless their body is needed
+    etag, weak = response.get_etag()
+    cached = etag is not None and request.endpoint in CACHED_COMPRESSION_ENDPOINTS
+    body = _compressed_bodies.get((etag, encoding)) if cached else None
+    if body is None:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_BYTES:
+            return response
+        body = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+        if cached:
+            # A static file or the homepage: the same ETag always means the same body
+            if len(_compressed_bodies) >= COMPRESSED_CACHE_SIZE:
+                _compressed_bodies.clear()
+            _compressed_bodies[(etag, encoding)] = body
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag and not weak:
+        response.set_etag(etag, weak=True) # The compressed bytes differ from those the strong ETag named
+    return response
+
+def _int_arg(value, default, lowest, highest):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = default
+    return min(max(value, lowest), highest)
+
+def page_args(args):
+    """(filter, page, page_size) from request args or an API request object, clamped to what we serve."""
+    current_filter = args.get('filter', 'all')
+    if current_filter not in MEDIA_FILTERS:
+        current_filter = 'all'
+    page = _int_arg(args.get('page'), 1, 1, MAX_PAGE)
+    page_size = _int_arg(args.get('page_size'), DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    return current_filter, page, page_size
+
+def api_results(query, current_filter, page, page_size, results, total_hits):
+    """
+    The JSON body for one search: document ids, URLs and scores, with how many images and videos each page has,
+    a spelling correction of the query if some of its words match nothing, and the prefixes (pyth*) that stood
+    for too many terms to search for them all.
+    """
+    hits = []
+    documents = search_engine_instance.get_documents([doc_id for _, doc_id in results])
+    for (score, doc_id), doc_info in zip(results, documents):
+        if doc_info is None:
+            continue # Deleted since it was ranked
+        hits.append({
+            'doc_id': doc_id,
+            'url': doc_info['url'],
+            'score': round(score, 4),
+            'images': len(doc_info.get('images', [])),
+            'videos': len(doc_info.get('videos', [])),
+        })
+    return {'query': query, 'filter': current_filter, 'page': page, 'page_size': page_size, 'total_hits': total_hits,
+            'did_you_mean': search_engine_instance.correct(query) if query else None,
+            'truncated_prefixes': search_engine_instance.truncated_prefixes(query) if '*' in query else [],
+            'results': hits}
 
 @app.route('/')
 def home():
-    """Renders the initial search page."""
-    # Select a random background image URL from your LOCAL_BACKGROUND_IMAGES
-    selected_bg_filename = random.choice(LOCAL_BACKGROUND_IMAGES)
-    background_url = url_for('static', filename=selected_bg_filename)
-
-    return render_template_string(HTML_TEMPLATE, results=None, query="", current_filter="all", background_url=background_url)
+    """Renders the initial search page. It is the same for everyone, so browsers revalidate it with its ETag."""
+    return render_page(results=None, query="", current_filter="all")
 
 @app.route('/search')
 def search_results():
     """Handles search queries and displays results with media, filtered by type."""
     user_query = request.args.get('query', '').strip()
-    current_filter = request.args.get('filter', 'all')
-
-    # --- KEY CHANGE: Get the background URL from the request arguments if present ---
-    # This keeps the background image consistent across filters/searches
-    background_url = request.args.get('bg')
-
-    # If no background URL is in the arguments (e.g., initial search or direct /search access)
-    # or if it's somehow not a valid static URL, pick a new random one
-    if not background_url or not background_url.startswith('/static/'):
-        selected_bg_filename = random.choice(LOCAL_BACKGROUND_IMAGES)
-        background_url = url_for('static', filename=selected_bg_filename)
+    current_filter, page, page_size = page_args(request.args)
 
     results_to_display = []
+    total_hits = 0
+    has_next_page = False
+    suggestion = None
+    corrected_query = None
+    truncated_prefixes = []
 
     if user_query:
-        raw_results = search_engine_instance.search(user_query)
-
-        for score, doc_id in raw_results:
-            doc_info = search_engine_instance.document_map.get(str(doc_id))
+        # The media filter runs inside the search, and only this page's documents are looked up and rendered
+        raw_results, total_hits = search_engine_instance.search_page(user_query, page=page, page_size=page_size,
+                                                                     media=MEDIA_FILTERS[current_filter])
+        suggestion = search_engine_instance.correct(user_query)
+        if '*' in user_query:
+            truncated_prefixes = search_engine_instance.truncated_prefixes(user_query)
+        if suggestion and not total_hits:
+            # Nothing matches the query as typed: show what the correction finds instead
+            raw_results, total_hits = search_engine_instance.search_page(suggestion, page=page, page_size=page_size,
+                                                                         media=MEDIA_FILTERS[current_filter])
+            if total_hits:
+                corrected_query = suggestion
+        # total_hits can be an estimate; a short page means there are no more
+        has_next_page = page < MAX_PAGE and len(raw_results) == page_size and total_hits > page * page_size
+
+        documents = search_engine_instance.get_documents([doc_id for _, doc_id in raw_results])
+        for (score, doc_id), doc_info in zip(raw_results, documents):
 
             if doc_info:
                 try:
@@ -375,8 +207,82 @@ def search_results():
     else:
         results_to_display = []
 
-    # Pass the determined background_url to the template
-    return render_template_string(HTML_TEMPLATE, results=results_to_display, query=user_query, current_filter=current_filter, background_url=background_url)
+    return render_page(results=results_to_display, query=user_query, current_filter=current_filter, page=page,
+                       page_size=page_size, total_hits=total_hits, first_rank=(page - 1) * page_size + 1,
+                       has_next_page=has_next_page, suggestion=suggestion, corrected_query=corrected_query,
+                       truncated_prefixes=truncated_prefixes, max_prefix_terms=MAX_PREFIX_TERMS)
+
+@app.route('/suggest')
+def suggest():
+    """
+    Search-box completions for q, the query typed so far: the most frequent words in the index that start with
+    its last word, each with the rest of q in front. The search box asks on every keystroke, so this only does
+    a few binary searches in the completion indexes.
+    """
+    text = request.args.get('q', '')
+    last_word = re.search(r'\w+$', text)
+    suggestions = []
+    if last_word:
+        suggestions = [text[:last_word.start()] + word
+                       for word, _ in search_engine_instance.complete(last_word.group(0), MAX_SUGGESTIONS)]
+    response = jsonify(query=text, suggestions=suggestions)
+    response.headers['Cache-Control'] = SUGGEST_CACHE_CONTROL
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and answering."""
+    return jsonify(status='ok')
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: an index is loaded, so searches return results. Load balancers should wait for 200."""
+    status = search_engine_instance.status()
+    if not status['segments']:
+        return jsonify(status='no index', generation=status['generation']), 503
+    return jsonify(status='ready', pid=os.getpid(), **status)
+
+@app.route('/api/search')
+def api_search():
+    """JSON version of /search, for programmatic clients: takes the same query, filter, page and page_size."""
+    user_query = request.args.get('query', '').strip()
+    current_filter, page, page_size = page_args(request.args)
+    results, total_hits = search_engine_instance.search_page(user_query, page=page, page_size=page_size,
+                                                             media=MEDIA_FILTERS[current_filter])
+    return jsonify(api_results(user_query, current_filter, page, page_size, results, total_hits))
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """
+    Runs many searches in one request. The body is {"queries": [...]}, where each query is a string or an
+    object with "query" and optionally "filter", "page" and "page_size"; top-level "filter", "page" and
+    "page_size" are the defaults. Responds with {"responses": [...]}, one /api/search body per query, in order.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+        return jsonify(error='Expected a JSON object with a "queries" list'), 400
+    if len(body['queries']) > MAX_BATCH_QUERIES:
+        return jsonify(error=f'At most {MAX_BATCH_QUERIES} queries per batch'), 400
+
+    requests = []
+    for item in body['queries']:
+        if isinstance(item, str):
+            item = {'query': item}
+        if not isinstance(item, dict) or not isinstance(item.get('query'), str):
+            return jsonify(error='Each query must be a string or an object with a "query" string'), 400
+        current_filter, page, page_size = page_args({**body, **item})
+        requests.append((item['query'].strip(), current_filter, page, page_size))
+
+    # One search_batch() call, so terms the queries share are looked up once
+    pages = search_engine_instance.search_batch([
+        {'query': query, 'page': page, 'page_size': page_size, 'media': MEDIA_FILTERS[current_filter]}
+        for query, current_filter, page, page_size in requests])
+    return jsonify(responses=[api_results(query, current_filter, page, page_size, results, total_hits)
+                              for (query, current_filter, page, page_size), (results, total_hits) in zip(requests, pages)])
+
+# Compile the template now rather than on the first request; Jinja keeps the compiled form
+app.jinja_env.get_template('index.html')
 
 if __name__ == '__main__':
+    # Development server; for production use serve.py
     app.run(debug=True)
\ No newline at end of file
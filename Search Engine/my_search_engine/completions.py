@@ -0,0 +1,130 @@
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+# Completion index: one segment's words in sorted order with their document frequencies, written next to its
+# index file (completions_path()) by IndexWriter, for search-box suggestions. (Prefix queries, pyth*, read
+# the index's term dictionary instead, which has every term rather than the few most frequent.)
+#
+# The words starting with a prefix sit next to each other in sorted order, so two binary searches find them.
+# For every prefix that more than TOP_COMPLETIONS words start with, the most frequent ones are precomputed;
+# any other prefix has at most TOP_COMPLETIONS words, read straight from the sorted list. Either way a lookup
+# costs a couple of binary searches and a few reads, however many words share the prefix.
+#
+# Layout (all integers little-endian):
+#   header          HEADER
+#   words           the words as UTF-8, back to back
+#   word offsets    uint32 per word and one for the end of the last
+#   dfs             uint32 document frequency per word
+#   prefixes        the prefixes with precomputed completions as UTF-8, back to back, sorted
+#   prefix offsets  uint32 per prefix and one for the end of the last
+#   top words       TOP_COMPLETIONS uint32 word numbers per prefix, most frequent first, padded with NO_WORD
+MAGIC = b'MSECMP\x00\x01'
+VERSION = 1
+TOP_COMPLETIONS = 10
+NO_WORD = 0xFFFFFFFF
+# magic, version, completions per prefix, word count, prefix count, then the offsets of the word offsets,
+# dfs, prefix offsets and top words (word and prefix offsets are from the start of the file)
+HEADER = struct.Struct('<8sIIIIQQQQ')
+
+def completions_path(index_path):
+    """The completion index that goes with index_path, e.g. output/index.cmp for output/index.bin."""
+    return os.path.splitext(index_path)[0] + '.cmp'
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8)) # Keep the arrays aligned for memoryview.cast()
+
+def write_completion_index(path, words):
+    """Writes the completion index of words: [(word, document frequency), ...] in sorted order."""
+    terms = [word for word, _ in words]
+    dfs = array('I', (df for _, df in words))
+    prefixes = sorted({term[:length] for term in terms for length in range(1, len(term) + 1)})
+    top_prefixes = []
+    top_words = array('I')
+    for prefix in prefixes:
+        # Code point order is UTF-8 byte order, the order of the index's terms
+        start = bisect_left(terms, prefix)
+        end = bisect_left(terms, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        if end - start > TOP_COMPLETIONS:
+            top_prefixes.append(prefix.encode('utf-8'))
+            top = heapq.nlargest(TOP_COMPLETIONS, range(start, end), key=dfs.__getitem__)
+            top_words.extend(top + [NO_WORD] * (TOP_COMPLETIONS - len(top)))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size) # Filled in at the end
+        offsets = {}
+        for name, strings in (('word', [term.encode('utf-8') for term in terms]), ('prefix', top_prefixes)):
+            start = f.tell()
+            string_offsets = array('I', [0])
+            for string in strings:
+                f.write(string)
+                string_offsets.append(string_offsets[-1] + len(string))
+            _pad(f)
+            offsets[name] = f.tell()
+            f.write(struct.pack(f'<{len(string_offsets)}I', *(start + offset for offset in string_offsets)))
+            _pad(f)
+            if name == 'word':
+                offsets['df'] = f.tell()
+                f.write(struct.pack(f'<{len(dfs)}I', *dfs))
+                _pad(f)
+        top_words_offset = f.tell()
+        f.write(struct.pack(f'<{len(top_words)}I', *top_words))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, TOP_COMPLETIONS, len(terms), len(top_prefixes), offsets['word'],
+                            offsets['df'], offsets['prefix'], top_words_offset))
+    os.replace(tmp_path, path)
+
+class CompletionIndex:
+    """Read-only view of a completion index file."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.top, self.word_count, self.prefix_count, word_offsets_offset, dfs_offset,
+         prefix_offsets_offset, top_words_offset) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} completion index; rebuild the index with indexer.py")
+        view = memoryview(self.buf)
+        self.word_offsets = view[word_offsets_offset:word_offsets_offset + 4 * (self.word_count + 1)].cast('I')
+        self.dfs = view[dfs_offset:dfs_offset + 4 * self.word_count].cast('I')
+        self.prefix_offsets = view[prefix_offsets_offset:prefix_offsets_offset + 4 * (self.prefix_count + 1)].cast('I')
+        self.top_words = view[top_words_offset:top_words_offset + 4 * self.top * self.prefix_count].cast('I')
+        view.release()
+
+    def _word(self, i):
+        return self.buf[self.word_offsets[i]:self.word_offsets[i + 1]]
+
+    def _first(self, count, below):
+        """The first i in range(count) for which below(i) is false (below must be true, then false)."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if below(mid):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def complete(self, prefix):
+        """[(word, document frequency), ...] for the most frequent words starting with prefix, most frequent first."""
+        key = prefix.encode('utf-8')
+        if not key:
+            return []
+        i = self._first(self.prefix_count, lambda i: self.buf[self.prefix_offsets[i]:self.prefix_offsets[i + 1]] < key)
+        if i < self.prefix_count and self.buf[self.prefix_offsets[i]:self.prefix_offsets[i + 1]] == key:
+            word_ids = [word_id for word_id in self.top_words[i * self.top:(i + 1) * self.top] if word_id != NO_WORD]
+        else:
+            # Not a prefix with precomputed completions, so at most self.top words start with it
+            start = self._first(self.word_count, lambda i: self._word(i) < key)
+            end = self._first(self.word_count, lambda i: self._word(i)[:len(key)] <= key)
+            word_ids = sorted(range(start, end), key=lambda word_id: -self.dfs[word_id])
+        return [(self._word(word_id).decode('utf-8'), self.dfs[word_id]) for word_id in word_ids]
+
+    def close(self):
+        for view in (self.word_offsets, self.dfs, self.prefix_offsets, self.top_words):
+            view.release()
+        self.buf.close()
@@ -1,52 +1,46 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import os
 import time
-from urllib.robotparser import RobotFileParser
+from frontier import Frontier
+from crawl_state import CrawlStateStore
+from extractor import extract_page
+from robots import RobotsCache
 
 class MiniCrawler:
-    def __init__(self, start_urls, output_dir="crawled_pages", max_depth=2, crawl_limit=50):
+    def __init__(self, start_urls, output_dir="crawled_pages", max_depth=2, crawl_limit=50, prioritized_frontier=False, checkpoint_every=10):
         self.start_urls = start_urls
         self.output_dir = output_dir
         self.max_depth = max_depth
         self.crawl_limit = crawl_limit # Max number of pages to crawl
-        self.visited = set()
-        self.queue = [] # (url, depth)
-        self.robot_parsers = {} # Cache for RobotFileParser objects
+        self.frontier = Frontier(prioritized=prioritized_frontier) # (url, depth) queue that never holds a URL twice
+        self.robots = RobotsCache(lambda robots_url: requests.get(robots_url, timeout=5)) # Compiled robots.txt rules per host
         self.crawled_count = 0
+        self.checkpoint_every = checkpoint_every # Save crawl state every this many pages so crawl(resume=True) can continue
+        self.state = None
 
         # Initialize queue with start URLs at depth 0
         for url in start_urls:
-            self.queue.append((url, 0))
+            self.frontier.add(url, 0)
 
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
 
     def _can_fetch(self, url):
         """Checks robots.txt for the given URL."""
-        parsed_url = urlparse(url)
-        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-        robots_txt_url = urljoin(base_url, "/robots.txt")
+        # "*" represents any user-agent; rules are fetched once per host and compiled
+        return self.robots.can_fetch(url)
 
-        if base_url not in self.robot_parsers:
-            rp = RobotFileParser()
-            try:
-                rp.set_url(robots_txt_url)
-                rp.read()
-                self.robot_parsers[base_url] = rp
-                print(f"Fetched robots.txt for {base_url}")
-            except Exception as e:
-                print(f"Could not fetch or parse robots.txt for {base_url}: {e}")
-                self.robot_parsers[base_url] = None # Mark as failed
-                return True # Assume we can fetch if robots.txt is unavailable
+    def _checkpoint(self):
+        self.state.save(self.frontier, self.robots.export(), {'crawled_count': str(self.crawled_count)})
 
-        rp = self.robot_parsers[base_url]
-        if rp:
-            # Check if our "user agent" is allowed to fetch this URL
-            # A good practice for a real crawler would be to define a specific user agent
-            return rp.can_fetch("*", url) # "*" represents any user-agent
-        return True # If no robots.txt or failed to parse, assume allowed
+    def _restore_checkpoint(self):
+        seen, items = self.state.load_frontier()
+        self.frontier.restore(seen, items)
+        for base_url, (robots_txt, fetched_at) in self.state.load_robots().items():
+            self.robots.add(base_url, robots_txt, fetched_at)
+        self.crawled_count = int(self.state.get_meta('crawled_count', 0))
+        print(f"Resuming crawl: {self.crawled_count} pages already crawled, {len(items)} URLs waiting")
 
     def _save_content(self, url, content):
         """Saves the content of a page to a file."""
@@ -65,38 +59,51 @@ class MiniCrawler:
         except Exception as e:
             print(f"Error saving {url}: {e}")
 
-    def crawl(self):
-        """Starts the crawling process."""
-        while self.queue and self.crawled_count < self.crawl_limit:
-            current_url, depth = self.queue.pop(0) # Get URL and depth from queue
+    def crawl(self, resume=False):
+        """Starts the crawling process, or with resume=True continues from the last checkpoint."""
+        # Not WebCrawler's crawl_state.sqlite: both may use crawled_data, and neither must resume the other's crawl
+        self.state = CrawlStateStore(os.path.join(self.output_dir, "mini_crawl_state.sqlite"))
+        if resume and self.state.has_checkpoint():
+            self._restore_checkpoint()
+        else:
+            self.state.clear()
+
+        try:
+            self._crawl_loop()
+        finally:
+            self._checkpoint()
+            self.state.close()
+
+        print("\nCrawl finished.")
+        print(f"Total pages crawled: {self.crawled_count}")
+        print(f"Pages stored in: {self.output_dir}")
 
-            if current_url in self.visited:
-                continue # Skip if already visited
+    def _crawl_loop(self):
+        while self.frontier and self.crawled_count < self.crawl_limit:
+            current_url, depth = self.frontier.pop() # Get URL and depth from the frontier
 
             if depth > self.max_depth:
                 print(f"Skipping {current_url} (max depth reached)")
                 continue
 
-            # Basic politeness delay
-            time.sleep(0.1) # Be nice to servers
-
             print(f"Crawling ({self.crawled_count+1}/{self.crawl_limit}, Depth: {depth}): {current_url}")
 
+            # Fetches the host's robots.txt the first time, so its Crawl-delay is known before the delay below
             if not self._can_fetch(current_url):
                 print(f"Skipping {current_url} due to robots.txt")
-                self.visited.add(current_url)
                 continue
 
+            # Basic politeness delay, or the site's robots.txt Crawl-delay if that is longer
+            time.sleep(max(0.1, self.robots.crawl_delay(current_url) or 0)) # Be nice to servers
+
             try:
                 response = requests.get(current_url, timeout=5)
                 response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
                 self.crawled_count += 1
-                self.visited.add(current_url)
                 self._save_content(current_url, response.text)
 
-                soup = BeautifulSoup(response.text, 'html.parser')
-                for link in soup.find_all('a', href=True):
-                    href = link['href']
+                _, _, _, links = extract_page(current_url, response.text)
+                for href in links:
                     absolute_url = urljoin(current_url, href)
                     parsed_link = urlparse(absolute_url)
 
@@ -105,19 +112,16 @@ class MiniCrawler:
                         # Normalize URL (remove fragments like #section)
                         normalized_url = parsed_link._replace(fragment="").geturl()
 
-                        if normalized_url not in self.visited:
-                            self.queue.append((normalized_url, depth + 1))
+                        # The frontier skips URLs that were already queued or crawled
+                        self.frontier.add(normalized_url, depth + 1)
+
+                if self.crawled_count % self.checkpoint_every == 0:
+                    self._checkpoint()
 
             except requests.exceptions.RequestException as e:
-                print(f"Error crawling {current_url}: {e}")
-                self.visited.add(current_url) # Mark as visited even on error to avoid retrying immediately
+                print(f"Error crawling {current_url}: {e}") # Not retried: the frontier never re-queues a URL
             except Exception as e:
                 print(f"An unexpected error occurred with {current_url}: {e}")
-                self.visited.add(current_url)
-
-        print("\nCrawl finished.")
-        print(f"Total pages crawled: {self.crawled_count}")
-        print(f"Pages stored in: {self.output_dir}")
 
 
 if __name__ == "__main__":
@@ -144,4 +148,4 @@ if __name__ == "__main__":
         max_depth=1,         # Go 1 level deep from initial links
         crawl_limit=20       # Crawl a maximum of 20 pages
     )
-    crawler.crawl()
\ No newline at end of file
+    crawler.crawl(resume=True) # Continues the previous run if it left a checkpoint
\ No newline at end of file
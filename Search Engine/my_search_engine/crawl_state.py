@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+def _to_signed(key):
+    # SQLite integers are signed 64-bit; url_key() hashes are unsigned
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+def _to_unsigned(key):
+    return key + (1 << 64) if key < 0 else key
+
+class CrawlStateStore:
+    """
+    SQLite checkpoint of a crawl: the frontier, the seen-set, the robots.txt cache and a few counters.
+    save() replaces the previous checkpoint in a single transaction, so a crash never leaves half of one.
+
+    It also remembers, across crawls, each page's ETag, Last-Modified, content hash and links, which is what
+    an incremental re-crawl needs to skip unchanged pages.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (key INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS frontier (seq INTEGER PRIMARY KEY, url TEXT NOT NULL, depth INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS robots (base_url TEXT PRIMARY KEY, body TEXT, fetched_at REAL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,
+                                              content_hash TEXT, links BLOB, fetched_at REAL);
+        """)
+
+    def has_checkpoint(self):
+        return self.get_meta('checkpointed_at') is not None
+
+    def clear(self):
+        """Forgets the checkpoint. Stored pages are kept, since they are what makes the next crawl incremental."""
+        with self.conn:
+            for table in ('seen', 'frontier', 'robots', 'meta'):
+                self.conn.execute(f"DELETE FROM {table}")
+
+    def save(self, frontier, robots, meta, extra_items=()):
+        """
+        Checkpoints frontier (plus extra_items, e.g. URLs still being fetched),
+        robots ({base_url: (robots.txt text, fetched_at)}) and meta (str -> str) in one transaction.
+        """
+        with self.conn:
+            # The seen-set only grows, so each checkpoint just appends the keys added since the previous one
+            self.conn.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)",
+                                  ((_to_signed(key),) for key in frontier.take_unsaved_seen()))
+
+            self.conn.execute("DELETE FROM frontier")
+            items = list(extra_items) + frontier.snapshot()
+            self.conn.executemany("INSERT INTO frontier (seq, url, depth) VALUES (?, ?, ?)",
+                                  ((seq, url, depth) for seq, (url, depth) in enumerate(items)))
+
+            self.conn.executemany("INSERT OR REPLACE INTO robots (base_url, body, fetched_at) VALUES (?, ?, ?)",
+                                  ((base_url, body, fetched_at) for base_url, (body, fetched_at) in robots.items()))
+
+            meta = dict(meta, checkpointed_at=str(time.time()))
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+
+    def load_frontier(self):
+        """Returns (seen keys, [(url, depth), ...]) from the last checkpoint, ready for Frontier.restore()."""
+        seen = {_to_unsigned(key) for (key,) in self.conn.execute("SELECT key FROM seen")}
+        items = self.conn.execute("SELECT url, depth FROM frontier ORDER BY seq").fetchall()
+        return seen, items
+
+    def load_robots(self):
+        """{base_url: (robots.txt text, fetched_at)}; fetched_at lets the cache expire entries after a resume too."""
+        return {base_url: (body, fetched_at) for base_url, body, fetched_at in self.conn.execute("SELECT base_url, body, fetched_at FROM robots")}
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def get_page(self, url):
+        """Returns {'etag', 'last_modified', 'content_hash', 'links'} stored for url, or None."""
+        row = self.conn.execute("SELECT etag, last_modified, content_hash, links FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_hash, links = row
+        links = json.loads(zlib.decompress(links)) if links else []
+        return {'etag': etag, 'last_modified': last_modified, 'content_hash': content_hash, 'links': links}
+
+    def put_page(self, url, page):
+        # Links are stored compressed; they are only needed to keep traversing past unchanged pages
+        links = zlib.compress(json.dumps(page['links']).encode('utf-8')) if page['links'] else None
+        # Committed together with the next checkpoint rather than one transaction per page
+        self.conn.execute("INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, links, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                          (url, page['etag'], page['last_modified'], page['content_hash'], links, time.time()))
+
+    def delete_page(self, url):
+        self.conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+
+    def close(self):
+        self.conn.close()
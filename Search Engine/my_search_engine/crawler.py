@@ -1,183 +1,398 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-import json
+import hashlib
 import os
-import re
+import shutil
+import threading
 import time # Import the time module
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from frontier import Frontier, url_key
+from document_sink import JsonlDocumentSink, read_documents
+from crawl_state import CrawlStateStore
+from extractor import extract_page
+from robots import RobotsCache
+
+def parse_page(extractor, url, html):
+    """Turns a downloaded page into (document, links). Module-level so a process pool can run it."""
+    text_content, images, videos, links = extractor(url, html)
+    document = {
+        'url': url,
+        'text_content': text_content,
+        'images': images,
+        'videos': videos
+    }
+    return document, links
+
+class HostScheduler:
+    """Tracks when each host may be requested again, so concurrent fetches stay polite per host."""
+    def __init__(self, delay_seconds):
+        self.delay_seconds = delay_seconds
+        self.next_fetch_time = {} # host -> earliest time.monotonic() for the next request
+        self.in_flight = set() # Hosts with a request currently running
+
+    def ready_in(self, host, now):
+        """Returns how many seconds until host can be fetched (0 if now, inf while a request to it is running)."""
+        if host in self.in_flight:
+            return float('inf')
+        return max(0.0, self.next_fetch_time.get(host, 0.0) - now)
+
+    def acquire(self, host):
+        self.in_flight.add(host)
+
+    def release(self, host, now, crawl_delay=None):
+        # The delay starts once the request finishes, matching the sequential crawler.
+        # A robots.txt Crawl-delay longer than delay_seconds takes precedence for that host.
+        self.in_flight.discard(host)
+        self.next_fetch_time[host] = now + max(self.delay_seconds, crawl_delay or 0)
 
 class WebCrawler:
-    def __init__(self, start_urls, max_pages=50, max_depth=1, delay_seconds=1): # Added delay_seconds parameter
+    def __init__(self, start_urls, max_pages=50, max_depth=1, delay_seconds=1, concurrency=1, prioritized_frontier=False, compress_output=False, checkpoint_every=50, extractor=extract_page, parse_workers=0, parse_queue_size=None): # Added delay_seconds parameter
         self.start_urls = start_urls
         self.max_pages = max_pages
         self.max_depth = max_depth
         self.delay_seconds = delay_seconds # Store the delay
-        self.visited_urls = set()
-        self.documents = []
-        self.session = requests.Session()
+        self.concurrency = concurrency # Max requests in flight at once; delay_seconds then applies per host
+        self.frontier = Frontier(prioritized=prioritized_frontier) # Queue of (url, depth) plus the set of every URL seen
+        self.pages_crawled = 0 # Pages fetched (including unchanged ones in an incremental crawl)
+        self.documents_written = 0 # Documents are streamed to the sink as they are parsed rather than kept in memory
+        self.incremental = False
+        self.sink = None
+        self.checkpoint_every = checkpoint_every # Save crawl state every this many pages so crawl(resume=True) can continue
+        self.state = None
+        self._in_flight = {} # future -> (url, depth, host) while the concurrent crawler is running
+        self._parsing = {} # future -> (url, depth, page) for pages handed to the parser processes
+        self.parse_workers = parse_workers # Parser processes; 0 parses on the fetching thread
+        self.parse_queue_size = parse_queue_size or 2 * max(parse_workers, 1) # Fetching pauses while this many pages wait to be parsed
+        self._thread_local = threading.local() # Holds one requests.Session per thread
+        self.extractor = extractor # (url, html) -> (text_content, images, videos, links); extractor.soup_extract_page is the BeautifulSoup version
         # Updated User-Agent to a more recent Chrome version
         self.headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'}
         self.output_dir = "crawled_data"
         os.makedirs(self.output_dir, exist_ok=True)
-        self.documents_file = os.path.join(self.output_dir, "documents.json")
-        self.robots_txt_cache = {} # Cache for robots.txt rules
+        self.documents_file = os.path.join(self.output_dir, "documents.jsonl.gz" if compress_output else "documents.jsonl")
+        self.changes_file = os.path.join(self.output_dir, "documents.changes.jsonl.gz" if compress_output else "documents.changes.jsonl")
+        # The link graph for pagerank.py: one {'url', 'links'} record per page written, the last for a URL winning
+        self.links_file = os.path.join(self.output_dir, "links.jsonl.gz" if compress_output else "links.jsonl")
+        self.links_sink = None
+        self.state_file = os.path.join(self.output_dir, "crawl_state.sqlite")
+        # robots.txt rules, compiled once per host; groups are matched against the short form of our User-Agent
+        user_agent_short = self.headers['User-Agent'].split('/')[0].lower() # e.g., 'mozilla' or 'chrome'
+        self.robots = RobotsCache(self._fetch_robots_txt, user_agent=user_agent_short)
 
-    def _get_robots_txt(self, base_url):
-        if base_url in self.robots_txt_cache:
-            return self.robots_txt_cache[base_url]
+    def _fetch_robots_txt(self, robots_url):
+        return self._get_session().get(robots_url, headers=self.headers, timeout=5)
 
-        robots_url = urljoin(base_url, "/robots.txt")
+    def _can_fetch(self, url):
+        if self.robots.can_fetch(url):
+            return True
+        print(f"Skipping {url} due to robots.txt")
+        return False
+
+    def _get_session(self):
+        # requests.Session is not guaranteed to be thread-safe, so every worker thread gets its own
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._thread_local.session = session
+        return session
+
+    def _fetch_and_parse(self, current_url, known_page=None):
+        """
+        Fetches one page and returns (document, links, page).
+        document is the record to write (None if the page was skipped or is unchanged), links are the hrefs to
+        follow and page holds the validators to remember for the URL (None if there is nothing to update).
+        Passing the page stored by a previous crawl as known_page makes the request conditional.
+        """
+        html, result = self._fetch(current_url, known_page)
+        if html is None:
+            return result
         try:
-            response = self.session.get(robots_url, headers=self.headers, timeout=5)
-            if response.status_code == 200:
-                self.robots_txt_cache[base_url] = response.text
-                return response.text
-        except requests.exceptions.RequestException:
-            pass # Ignore if robots.txt cannot be fetched
-        self.robots_txt_cache[base_url] = "" # Cache empty string if not found or error
-        return ""
+            document, links = parse_page(self.extractor, current_url, html)
+        except Exception as e:
+            print(f"An unexpected error occurred with {current_url}: {e}")
+            return None, [], None
+        page = result[2]
+        page['links'] = links
+        return document, links, page
 
-    def _can_fetch(self, url):
-        parsed_url = urlparse(url)
-        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-        
-        robots_content = self._get_robots_txt(base_url)
-        if not robots_content:
-            return True # No robots.txt or couldn't fetch, assume allowed
-
-        # Simple robots.txt parsing: check for Disallow rules for any user-agent or our user-agent
-        # Note: self.headers['User-Agent'] might include full string, we need to handle this
-        # For simplicity, let's just check for '*' or a substring match
-        user_agent_short = self.headers['User-Agent'].split('/')[0].lower() # e.g., 'mozilla' or 'chrome'
+    def _fetch(self, current_url, known_page=None):
+        """
+        Downloads current_url. Returns (html, (None, [], page)) when the page still has to be parsed,
+        otherwise (None, result) with the finished _fetch_and_parse() result.
+        """
+        try:
+            headers = self.headers
+            if known_page is not None:
+                headers = dict(self.headers)
+                if known_page['etag']:
+                    headers['If-None-Match'] = known_page['etag']
+                if known_page['last_modified']:
+                    headers['If-Modified-Since'] = known_page['last_modified']
 
-        disallow_rules = []
-        user_agent_block = False
-
-        for line in robots_content.splitlines():
-            line = line.strip()
-            if line.lower().startswith("user-agent:"):
-                current_agent = line.split(':')[1].strip().lower()
-                # Check if the current user-agent block applies to us
-                if current_agent == '*' or user_agent_short in current_agent:
-                    user_agent_block = True
-                else:
-                    user_agent_block = False
-                disallow_rules = [] # Reset rules for new user-agent block
-            elif user_agent_block and line.lower().startswith("disallow:"):
-                disallowed_path = line.split(':')[1].strip()
-                disallow_rules.append(disallowed_path)
-            elif user_agent_block and line.lower().startswith("allow:"): # Handle allow rules, which override disallow
-                allowed_path = line.split(':')[1].strip()
-                # If an allow rule specifically allows a path that was previously disallowed, it overrides
-                # This simple parsing doesn't fully implement specificity, but it's a start
-                if allowed_path in disallow_rules:
-                    disallow_rules.remove(allowed_path) # Remove from disallow if explicitly allowed
-
-        path = urlparse(url).path
-        for disallowed_path in disallow_rules:
-            if disallowed_path and path.startswith(disallowed_path):
-                print(f"Skipping {url} due to robots.txt Disallow: {disallowed_path}")
-                return False
-        return True
-
-
-    def crawl(self):
-        queue = [(url, 0) for url in self.start_urls] # (url, depth)
-
-        while queue and len(self.documents) < self.max_pages:
-            current_url, depth = queue.pop(0)
-
-            if current_url in self.visited_urls:
+            response = self._get_session().get(current_url, headers=headers, timeout=10)
+            if known_page is not None:
+                if response.status_code == 304:
+                    return None, (None, known_page['links'], known_page) # Not modified: nothing to download or parse
+                if response.status_code in (404, 410):
+                    # Tell the indexer the page is gone
+                    return None, ({'url': current_url, 'deleted': True}, [], None)
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+            # Check for content type before parsing
+            if 'content-type' not in response.headers or 'text/html' not in response.headers['content-type']:
+                # print(f"Skipping {current_url}: Not HTML content")
+                return None, (None, [], None)
+
+            page = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': hashlib.sha1(response.content).hexdigest()
+            }
+            if known_page is not None and known_page['content_hash'] == page['content_hash']:
+                # Server ignored the conditional headers but the body is identical; skip parsing
+                page['links'] = known_page['links']
+                return None, (None, page['links'], page)
+
+            return response.text, (None, [], page)
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error crawling {current_url}: {e}")
+        except Exception as e:
+            print(f"An unexpected error occurred with {current_url}: {e}")
+        return None, (None, [], None)
+
+    def _resolve_link(self, current_url, href):
+        """The absolute http(s) URL an href on current_url points to, without fragment, or None."""
+        new_url = urljoin(current_url, href)
+
+        # Basic URL cleaning and validation
+        parsed_new_url = urlparse(new_url)
+        if parsed_new_url.scheme not in ['http', 'https']:
+            return None
+
+        # Avoid fragment identifiers
+        return parsed_new_url._replace(fragment="").geturl()
+
+    def _enqueue_links(self, links, current_url, depth, pending=0):
+        """Adds same-host links found on current_url to the frontier at depth + 1."""
+        if depth >= self.max_depth:
+            return
+        current_netloc = urlparse(current_url).netloc
+        for href in links:
+            new_url = self._resolve_link(current_url, href)
+            if new_url is None:
                 continue
 
+            # Only add within same domain (optional, depends on crawl scope); the frontier drops URLs it has already seen
+            if self.pages_crawled + pending + len(self.frontier) < self.max_pages * 2: # Heuristic to limit queue size
+                # Add simple domain check to stay somewhat focused
+                if urlparse(new_url).netloc == current_netloc:
+                    self.frontier.add(new_url, depth + 1)
+
+    def _write_links(self, document, links):
+        """Records the outlinks of a written document (every host's, not just the ones the crawl follows)."""
+        if document.get('deleted'):
+            self.links_sink.write({'url': document['url'], 'deleted': True})
+            return
+        outlinks = (self._resolve_link(document['url'], href) for href in links)
+        self.links_sink.write({'url': document['url'], 'links': list(dict.fromkeys(url for url in outlinks if url))})
+
+    def crawl(self, resume=False, incremental=False):
+        """
+        Crawls from start_urls, or with resume=True continues from the last checkpoint in state_file.
+
+        With incremental=True, pages fetched by earlier crawls are requested conditionally (ETag / Last-Modified)
+        and only new, changed or deleted pages are written, to changes_file. When the crawl finishes they are
+        also appended to documents_file, where a later record for a URL replaces earlier ones.
+        """
+        self.incremental = incremental
+        self.state = CrawlStateStore(self.state_file)
+        output_file = self.changes_file if incremental else self.documents_file
+        resume = resume and self.state.has_checkpoint() and os.path.exists(output_file)
+        if resume:
+            self._restore_checkpoint(output_file)
+        else:
+            self.state.clear()
+            for url in self.start_urls:
+                self.frontier.add(url, 0)
+
+        self.sink = JsonlDocumentSink(output_file, append=resume)
+        # Incremental crawls only write the pages that changed, so their links are added to the earlier ones
+        self.links_sink = JsonlDocumentSink(self.links_file, append=resume or incremental)
+        try:
+            if self.concurrency > 1 or self.parse_workers:
+                self._crawl_concurrent()
+            else:
+                self._crawl_sequential()
+        finally:
+            # Also runs on Ctrl-C or a crash, so everything parsed so far ends up on disk
+            self._checkpoint()
+            self.sink.close()
+            self.links_sink.close()
+            self.state.close()
+            print(f"Saved {self.sink.count} structured documents to {output_file}")
+            print(f"Saved the links of {self.links_sink.count} pages to {self.links_file}")
+
+        if incremental:
+            # Both files use the same format (and gzip members can be concatenated), so a byte copy is enough
+            with open(self.changes_file, 'rb') as src, open(self.documents_file, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+            print(f"Appended {self.documents_written} new or changed documents to {self.documents_file}")
+
+        print(f"\nCrawl finished.")
+        print(f"Total pages crawled: {self.pages_crawled}")
+
+    def _crawl_sequential(self):
+        while self.frontier and self.pages_crawled < self.max_pages:
+            current_url, depth = self.frontier.pop()
+
             # Ensure we respect robots.txt
             if not self._can_fetch(current_url):
                 continue
 
-            self.visited_urls.add(current_url)
-            print(f"Crawling ({len(self.documents) + 1}/{self.max_pages}, Depth: {depth}): {current_url}")
+            print(f"Crawling ({self.pages_crawled + 1}/{self.max_pages}, Depth: {depth}): {current_url}")
+
+            result = self._fetch_and_parse(current_url, self._known_page(current_url))
+            self._handle_result(current_url, depth, result)
+
+            # Introduce a delay after each request (whether successful or not), or the site's Crawl-delay if longer
+            time.sleep(max(self.delay_seconds, self.robots.crawl_delay(current_url) or 0))
 
+    def _crawl_concurrent(self):
+        """
+        Crawls up to `concurrency` pages at once while keeping delay_seconds between requests to the same host.
+
+        With parse_workers, the fetch threads only download: pages are parsed by a pool of processes so parsing
+        no longer holds up fetching, and no new fetches start while parse_queue_size pages wait to be parsed.
+        """
+        scheduler = HostScheduler(self.delay_seconds)
+        in_flight = self._in_flight # future -> (url, depth, host)
+        parsing = self._parsing # future -> (url, depth, page)
+        parser_pool = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers else None
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
             try:
-                response = self.session.get(current_url, headers=self.headers, timeout=10)
-                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                
-                # Check for content type before parsing
-                if 'content-type' not in response.headers or 'text/html' not in response.headers['content-type']:
-                    # print(f"Skipping {current_url}: Not HTML content")
-                    continue
-
-                soup = BeautifulSoup(response.text, 'html.parser')
-
-                # Extract text content
-                text_content = ' '.join(soup.stripped_strings)
-
-                # Extract images
-                images = []
-                for img in soup.find_all('img', src=True):
-                    img_src = urljoin(current_url, img['src'])
-                    if img_src and urlparse(img_src).scheme in ['http', 'https']:
-                        images.append({'src': img_src, 'alt': img.get('alt', '')})
-
-                # Extract videos (simple approach for <video> and YouTube/Vimeo iframes)
-                videos = []
-                for video_tag in soup.find_all('video', src=True):
-                    video_src = urljoin(current_url, video_tag['src'])
-                    if video_src and urlparse(video_src).scheme in ['http', 'https']:
-                        videos.append({'src': video_src, 'type': 'direct'})
-                
-                for iframe in soup.find_all('iframe', src=True):
-                    iframe_src = iframe['src']
-                    # Simplified check for common video embeds. More robust regex might be needed for full coverage.
-                    if 'youtube.com/embed/' in iframe_src or 'player.vimeo.com/video/' in iframe_src:
-                        if urlparse(iframe_src).scheme in ['http', 'https']:
-                            videos.append({'src': iframe_src, 'type': 'embed'})
-
-                self.documents.append({
-                    'url': current_url,
-                    'text_content': text_content,
-                    'images': images,
-                    'videos': videos
-                })
-
-                if len(self.documents) >= self.max_pages:
-                    break # Stop if max pages reached
-
-                # Find new links to crawl
-                if depth < self.max_depth:
-                    for link in soup.find_all('a', href=True):
-                        href = link['href']
-                        new_url = urljoin(current_url, href)
-                        
-                        # Basic URL cleaning and validation
-                        parsed_new_url = urlparse(new_url)
-                        if parsed_new_url.scheme not in ['http', 'https']:
-                            continue
-                        
-                        # Avoid fragment identifiers
-                        new_url = parsed_new_url._replace(fragment="").geturl()
-
-                        # Only add to queue if not visited and within same domain (optional, depends on crawl scope)
-                        if new_url not in self.visited_urls and len(self.documents) + len(queue) < self.max_pages * 2: # Heuristic to limit queue size
-                            # Add simple domain check to stay somewhat focused
-                            if parsed_new_url.netloc == urlparse(current_url).netloc:
-                                queue.append((new_url, depth + 1))
-
-            except requests.exceptions.RequestException as e:
-                print(f"Error crawling {current_url}: {e}")
-            except Exception as e:
-                print(f"An unexpected error occurred with {current_url}: {e}")
+                while (self.frontier or in_flight or parsing) and self.pages_crawled < self.max_pages:
+                    now = time.monotonic()
+
+                    # Hand out as many queued URLs as the concurrency limit, the parse backlog and the per-host delays allow
+                    while (len(in_flight) < self.concurrency and len(parsing) < self.parse_queue_size
+                           and self.pages_crawled + len(in_flight) + len(parsing) < self.max_pages):
+                        item = self.frontier.pop_ready(lambda host: scheduler.ready_in(host, now) == 0)
+                        if item is None:
+                            break
+                        current_url, depth = item
+                        host = urlparse(current_url).netloc
+                        scheduler.acquire(host)
+                        print(f"Crawling ({self.pages_crawled + len(in_flight) + len(parsing) + 1}/{self.max_pages}, Depth: {depth}): {current_url}")
+                        # Stored validators are looked up here because the SQLite connection belongs to this thread
+                        future = executor.submit(self._fetch_if_allowed, current_url, self._known_page(current_url), parser_pool is None)
+                        in_flight[future] = (current_url, depth, host)
+
+                    # Seconds until the earliest waiting host becomes fetchable again
+                    waits = [scheduler.ready_in(host, now) for host in self.frontier.parked_hosts()]
+                    waits = [w for w in waits if w != float('inf')]
+                    wait_time = min(waits) if waits else None
+
+                    if not in_flight and not parsing:
+                        if wait_time is None:
+                            break # Nothing running and nothing left that could ever become ready
+                        time.sleep(wait_time)
+                        continue
+
+                    done, _ = wait(list(in_flight) + list(parsing), timeout=wait_time, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in parsing:
+                            current_url, depth, page = parsing.pop(future)
+                            result = self._parsed_result(future, current_url, page)
+                        else:
+                            current_url, depth, host = in_flight.pop(future)
+                            scheduler.release(host, time.monotonic(), self.robots.crawl_delay(current_url))
+                            result = future.result()
+                            if parser_pool is not None:
+                                html, result = result
+                                if html is not None:
+                                    parse_future = parser_pool.submit(parse_page, self.extractor, current_url, html)
+                                    parsing[parse_future] = (current_url, depth, result[2])
+                                    continue
+                        if self.pages_crawled < self.max_pages:
+                            self._handle_result(current_url, depth, result, pending=len(in_flight) + len(parsing))
             finally:
-                # --- NEW: Introduce a delay after each request (whether successful or not) ---
-                time.sleep(self.delay_seconds) 
+                # Don't wait on pages we no longer have room for; they stay in the checkpoint for a later resume
+                for future in list(in_flight) + list(parsing):
+                    future.cancel()
+                if parser_pool is not None:
+                    parser_pool.shutdown(cancel_futures=True)
 
-        self._save_documents()
-        print(f"\nCrawl finished.")
-        print(f"Total pages crawled: {len(self.documents)}")
+    def _parsed_result(self, future, current_url, page):
+        try:
+            document, links = future.result()
+        except Exception as e:
+            print(f"An unexpected error occurred with {current_url}: {e}")
+            return None, [], None
+        page['links'] = links
+        return document, links, page
+
+    def _fetch_if_allowed(self, current_url, known_page=None, parse=True):
+        # robots.txt is checked on the worker so that fetching it never stalls the dispatcher
+        if not self._can_fetch(current_url):
+            return (None, [], None) if parse else (None, (None, [], None))
+        if parse:
+            return self._fetch_and_parse(current_url, known_page)
+        return self._fetch(current_url, known_page)
+
+    def _known_page(self, url):
+        # Conditional requests are only worth it when re-crawling incrementally
+        return self.state.get_page(url) if self.incremental else None
+
+    def _handle_result(self, current_url, depth, result, pending=0):
+        """Records the outcome of _fetch_and_parse() for current_url and queues its links."""
+        document, links, page = result
+        if page is not None:
+            self.state.put_page(current_url, page)
+        if document is not None:
+            if document.get('deleted'):
+                self.state.delete_page(current_url)
+            self.sink.write(document)
+            self._write_links(document, links)
+            self.documents_written += 1
+        elif page is None:
+            return # Skipped or failed: doesn't count as a crawled page
+
+        self.pages_crawled += 1
+        if self.pages_crawled < self.max_pages:
+            # Find new links to crawl
+            self._enqueue_links(links, current_url, depth, pending=pending)
+        # Checkpoint only once the page's links are in the frontier, so a checkpoint never loses them
+        if self.pages_crawled % self.checkpoint_every == 0:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # Flush documents first so the checkpoint never claims pages that are not on disk yet
+        self.sink.flush()
+        self.links_sink.flush()
+        in_flight = [(url, depth) for url, depth, _ in self._in_flight.values()]
+        in_flight += [(url, depth) for url, depth, _ in self._parsing.values()]
+        meta = {'pages_crawled': str(self.pages_crawled), 'documents_written': str(self.documents_written)}
+        self.state.save(self.frontier, self.robots.export(), meta, extra_items=in_flight)
+
+    def _restore_checkpoint(self, output_file):
+        seen, items = self.state.load_frontier()
+        for base_url, (robots_txt, fetched_at) in self.state.load_robots().items():
+            self.robots.add(base_url, robots_txt, fetched_at)
+        self.pages_crawled = int(self.state.get_meta('pages_crawled', 0))
+        self.documents_written = int(self.state.get_meta('documents_written', 0))
 
-    def _save_documents(self):
-        with open(self.documents_file, 'w', encoding='utf-8') as f:
-            json.dump(self.documents, f, ensure_ascii=False, indent=2)
-        print(f"Saved {len(self.documents)} structured documents to {self.documents_file}")
+        # Pages written after the last checkpoint are already in output_file; don't fetch them again
+        crawled = set()
+        for record_number, document in enumerate(read_documents(output_file)):
+            if record_number >= self.documents_written:
+                crawled.add(url_key(document['url']))
+        self.pages_crawled += len(crawled)
+        self.documents_written += len(crawled)
+        items = [(url, depth) for url, depth in items if url_key(url) not in crawled]
+        self.frontier.restore(seen | crawled, items)
+        print(f"Resuming crawl: {self.pages_crawled} pages already crawled, {len(items)} URLs waiting")
 
 if __name__ == "__main__":
     # You can customize these starting URLs
@@ -204,5 +419,7 @@ if __name__ == "__main__":
     ]
     # Increased max_pages and max_depth as per previous discussions
     # Added delay_seconds to make the crawler more polite and potentially avoid 403 errors
-    crawler = WebCrawler(start_urls=start_urls, max_pages=1000, max_depth=5, delay_seconds=2) # Increased delay to 2 seconds
-    crawler.crawl()
\ No newline at end of file
+    # concurrency lets several hosts be crawled in parallel; each host still waits delay_seconds between requests
+    # parse_workers moves HTML parsing into separate processes so it runs on all cores alongside fetching
+    crawler = WebCrawler(start_urls=start_urls, max_pages=1000, max_depth=5, delay_seconds=2, concurrency=8, parse_workers=os.cpu_count()) # Increased delay to 2 seconds
+    crawler.crawl(resume=True) # Picks up where the previous run stopped, if there is a checkpoint
\ No newline at end of file
@@ -0,0 +1,95 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+
+# Document store: what the results page shows about each document ({url, images, videos}), one file per segment,
+# read through mmap so a lookup touches only the record it needs and nothing is loaded up front.
+#
+# Layout (all integers little-endian):
+#   header    HEADER
+#   records   one zlib-compressed JSON object per document, back to back in doc id order
+#   offsets   uint64 per doc id from 0 to max doc id + 1: doc id i's record is the bytes from offsets[i] to
+#             offsets[i + 1], and an empty record means there is no document with that id
+MAGIC = b'MSEDOC\x00\x01'
+VERSION = 1
+# magic, version, max doc id, offsets offset
+HEADER = struct.Struct('<8sIIQ')
+
+class DocStoreWriter:
+    """Writes a document store. Documents must be added in ascending doc id order; ids never added have no record."""
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, 'wb', buffering=1 << 20)
+        self.file.write(b'\0' * HEADER.size) # Filled in by close()
+        self.offsets = [HEADER.size] # offsets[i]: where doc id i's record starts
+        self.count = 0
+
+    def add(self, doc_id, document):
+        self.add_record(doc_id, zlib.compress(json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+
+    def add_record(self, doc_id, record):
+        """Adds an already compressed record, e.g. one copied from another store with DocStore.records()."""
+        if doc_id < len(self.offsets) - 1:
+            raise ValueError(f"Documents must be added in ascending doc id order: {doc_id}")
+        end = self.offsets[-1]
+        # Doc ids skipped over get empty records
+        self.offsets.extend([end] * (doc_id - len(self.offsets) + 1))
+        self.file.write(record)
+        self.offsets.append(end + len(record))
+        self.count += 1
+
+    def close(self):
+        if len(self.offsets) == 1:
+            self.offsets.append(self.offsets[0]) # No documents: a store holding just an empty doc id 0
+        offsets_offset = self.offsets[-1]
+        self.file.write(struct.pack(f'<{len(self.offsets)}Q', *self.offsets))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.offsets) - 2, offsets_offset))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discards the store being written."""
+        self.file.close()
+        os.remove(self.tmp_path)
+
+class DocStore:
+    """Read-only view of a document store file."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_doc_id, offsets_offset = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} document store; rebuild the index with indexer.py")
+        self.offsets = memoryview(self.buf)[offsets_offset:offsets_offset + 8 * (self.max_doc_id + 2)].cast('Q')
+
+    def record(self, doc_id):
+        """Compressed record of doc_id (empty if there is none)."""
+        if not 0 <= doc_id <= self.max_doc_id:
+            return b''
+        return self.buf[self.offsets[doc_id]:self.offsets[doc_id + 1]]
+
+    def get(self, doc_id):
+        """{url, images, videos} of doc_id, or None."""
+        record = self.record(doc_id)
+        return json.loads(zlib.decompress(record)) if record else None
+
+    def records(self):
+        """(doc id, compressed record) for every document, in doc id order."""
+        for doc_id in range(self.max_doc_id + 1):
+            record = self.record(doc_id)
+            if record:
+                yield doc_id, record
+
+    def items(self):
+        """(doc id, document) for every document, in doc id order."""
+        for doc_id, record in self.records():
+            yield doc_id, json.loads(zlib.decompress(record))
+
+    def close(self):
+        self.offsets.release()
+        self.buf.close()
@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+
+def _open_text(path, mode):
+    # .gz files are gzip-compressed; appending adds a new gzip member, which readers handle transparently
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+class JsonlDocumentSink:
+    """
+    Append-only JSON Lines writer for crawled documents: one JSON object per line.
+    Documents are buffered and written every batch_size documents, so a crash loses at most one batch.
+    Paths ending in .gz are gzip-compressed.
+    """
+    def __init__(self, path, batch_size=20, append=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0 # Documents written by this sink (not counting ones already in the file when appending)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = _open_text(path, 'a' if append else 'w')
+
+    def write(self, document):
+        self.buffer.append(json.dumps(document, ensure_ascii=False))
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_documents(path):
+    """
+    Yields documents one at a time from a .jsonl / .jsonl.gz file written by JsonlDocumentSink,
+    or from a legacy documents.json array.
+    A partially written last line (e.g. after a crash) is ignored.
+    """
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+
+    with _open_text(path, 'r') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping truncated line in {path}")
+        except EOFError:
+            print(f"{path} ends with a truncated gzip block; stopping there")
@@ -0,0 +1,203 @@
+import glob
+import os
+import re
+import sys
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from bs4 import BeautifulSoup
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+
+# Text inside these tags is not part of BeautifulSoup's stripped_strings, so it is skipped here too
+HIDDEN_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+# Numeric character references html.parser could not read as a number: the leading digits are the reference
+# and the rest is text, as BeautifulSoup reads them
+DECIMAL_REFERENCE = re.compile(r'^([0-9]+)(.*)', re.DOTALL)
+HEX_REFERENCE = re.compile(r'^([0-9a-f]+)(.*)', re.DOTALL)
+# HTML pages the parity check compares both extractions on: entities, hidden text, media, odd attributes
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extractor_fixtures")
+
+def _is_web_url(url):
+    return urlparse(url).scheme in ['http', 'https']
+
+def _is_video_embed(src):
+    # Simplified check for common video embeds. More robust regex might be needed for full coverage.
+    return 'youtube.com/embed/' in src or 'player.vimeo.com/video/' in src
+
+class PageParser(HTMLParser):
+    """Collects text, images, videos and links in a single pass over the HTML, without building a tree."""
+    def __init__(self, url):
+        # Character references are resolved by handle_charref() and handle_entityref(), the way BeautifulSoup
+        # does it, rather than by html.parser (which leaves unknown ones like &unknown; untouched)
+        super().__init__(convert_charrefs=False)
+        self.url = url
+        self.strings = []
+        self.images = []
+        self.direct_videos = []
+        self.embedded_videos = []
+        self.links = []
+        self._data = [] # Consecutive data chunks; BeautifulSoup joins these into one string
+        self._hidden = [] # Open HIDDEN_TEXT_TAGS, innermost last
+
+    def _flush_data(self):
+        if self._data:
+            if not self._hidden:
+                text = ''.join(self._data).strip()
+                if text:
+                    self.strings.append(text)
+            self._data = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_data()
+        self._handle_element(tag, attrs)
+        if tag in HIDDEN_TEXT_TAGS:
+            self._hidden.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> never has content, so it doesn't open a hidden-text section
+        self._flush_data()
+        self._handle_element(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._flush_data()
+        if tag in self._hidden:
+            # Closing a tag also closes anything still open inside it
+            while self._hidden.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_entityref(self, name):
+        # An unknown name is taken as literal text: &unknown; becomes "&unknown"
+        self._data.append(EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name, '&' + name))
+
+    def handle_charref(self, name):
+        base, pattern = (16, HEX_REFERENCE) if name[:1] in ('x', 'X') else (10, DECIMAL_REFERENCE)
+        digits = name[1:] if base == 16 else name
+        rest = ''
+        try:
+            number = int(digits, base)
+        except ValueError:
+            match = pattern.search(digits)
+            if match is None:
+                self._data.append(digits)
+                return
+            number, rest = int(match.group(1), base), match.group(2)
+        # Per the HTML spec: Windows-1252 codes for C1 controls, U+FFFD for what is not a character
+        self._data.append(UnicodeDammit.numeric_character_reference(number)[0] + rest)
+
+    def handle_comment(self, data):
+        self._flush_data()
+
+    def handle_decl(self, decl):
+        self._flush_data()
+
+    def handle_pi(self, data):
+        self._flush_data()
+
+    def unknown_decl(self, data):
+        self._flush_data()
+        if data.upper().startswith('CDATA['): # BeautifulSoup keeps CDATA sections as text
+            self._data.append(data[len('CDATA['):])
+            self._flush_data()
+
+    def close(self):
+        super().close()
+        self._flush_data()
+
+    def _handle_element(self, tag, attrs):
+        if tag not in ('img', 'video', 'iframe', 'a'):
+            return
+        attrs = {name: value or '' for name, value in attrs} # <img src> has the value None
+
+        if tag == 'a':
+            if 'href' in attrs:
+                self.links.append(attrs['href'])
+        elif 'src' not in attrs:
+            return
+        elif tag == 'img':
+            img_src = urljoin(self.url, attrs['src'])
+            if img_src and _is_web_url(img_src):
+                self.images.append({'src': img_src, 'alt': attrs.get('alt', '')})
+        elif tag == 'video':
+            video_src = urljoin(self.url, attrs['src'])
+            if video_src and _is_web_url(video_src):
+                self.direct_videos.append({'src': video_src, 'type': 'direct'})
+        elif _is_video_embed(attrs['src']) and _is_web_url(attrs['src']):
+            self.embedded_videos.append({'src': attrs['src'], 'type': 'embed'})
+
+def extract_page(url, html):
+    """Single-pass extraction. Returns (text_content, images, videos, links) exactly like soup_extract_page()."""
+    parser = PageParser(url)
+    parser.feed(html)
+    parser.close()
+    # <video> tags are listed before embeds, the same order soup_extract_page() produces
+    return ' '.join(parser.strings), parser.images, parser.direct_videos + parser.embedded_videos, parser.links
+
+def soup_extract_page(url, html):
+    """The original BeautifulSoup extraction: builds a tree, then walks it once per kind of content."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract text content
+    text_content = ' '.join(soup.stripped_strings)
+
+    # Extract images
+    images = []
+    for img in soup.find_all('img', src=True):
+        img_src = urljoin(url, img['src'])
+        if img_src and _is_web_url(img_src):
+            images.append({'src': img_src, 'alt': img.get('alt', '')})
+
+    # Extract videos (simple approach for <video> and YouTube/Vimeo iframes)
+    videos = []
+    for video_tag in soup.find_all('video', src=True):
+        video_src = urljoin(url, video_tag['src'])
+        if video_src and _is_web_url(video_src):
+            videos.append({'src': video_src, 'type': 'direct'})
+
+    for iframe in soup.find_all('iframe', src=True):
+        iframe_src = iframe['src']
+        if _is_video_embed(iframe_src) and _is_web_url(iframe_src):
+            videos.append({'src': iframe_src, 'type': 'embed'})
+
+    links = [link['href'] for link in soup.find_all('a', href=True)]
+    return text_content, images, videos, links
+
+def read_pages(paths):
+    """[(url, html), ...] for HTML files and directories of them, each given a URL under https://example.com/."""
+    pages = []
+    for path in paths:
+        for filename in sorted(glob.glob(os.path.join(path, "*.html"))) if os.path.isdir(path) else [path]:
+            with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append(("https://example.com/" + os.path.basename(filename), f.read()))
+    return pages
+
+def check_parity(pages):
+    """The URLs of pages whose extract_page() output differs from soup_extract_page()'s."""
+    return [url for url, html in pages if extract_page(url, html) != soup_extract_page(url, html)]
+
+if __name__ == "__main__":
+    # Parity check and benchmark: python extractor.py [html files or directories, default extractor_fixtures]
+    # (MiniCrawler saves the raw HTML of every page it crawls in crawled_data, which makes a good larger sample.)
+    pages = read_pages(sys.argv[1:] or [FIXTURES_DIR])
+    if not pages:
+        print("No HTML files found.")
+        sys.exit(1)
+
+    mismatches = check_parity(pages)
+    for url in mismatches:
+        print(f"Output differs for {url}")
+    print(f"Parity: {len(pages) - len(mismatches)}/{len(pages)} pages identical")
+
+    repeats = 5
+    timings = {}
+    for name, extract in (("BeautifulSoup", soup_extract_page), ("single-pass", extract_page)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for url, html in pages:
+                extract(url, html)
+        timings[name] = (time.perf_counter() - start) / (repeats * len(pages))
+        print(f"{name}: {timings[name] * 1000:.2f} ms per page")
+    print(f"Speedup: {timings['BeautifulSoup'] / timings['single-pass']:.1f}x")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,150 @@
+import hashlib
+import heapq
+from collections import deque
+from urllib.parse import urlparse
+
+def normalize_url(url):
+    """Returns a canonical form of url so trivially different spellings hash the same."""
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    # Drop default ports, e.g. http://example.com:80/ -> http://example.com/
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parsed.path or '/'
+    return parsed._replace(scheme=scheme, netloc=netloc, path=path, fragment="").geturl()
+
+def url_key(url):
+    """64-bit hash of the normalized URL. Storing these instead of full URL strings keeps the seen-set small."""
+    digest = hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+class Frontier:
+    """
+    Crawl frontier of (url, depth) pairs.
+
+    By default it is a FIFO deque (breadth-first, O(1) enqueue and dequeue). With prioritized=True it is a heap
+    ordered by depth, how many URLs were already queued for the same host (host fairness) and how many pages
+    linked to the URL while it was waiting (in-degree). Every URL is only ever queued once: all URLs that have
+    been added are remembered as 64-bit hashes.
+    """
+    def __init__(self, prioritized=False, depth_weight=1.0, host_weight=0.1, inlink_weight=0.5):
+        self.prioritized = prioritized
+        self.depth_weight = depth_weight
+        self.host_weight = host_weight
+        self.inlink_weight = inlink_weight
+        self.seen = set() # url_key() of every URL ever added, whether still queued or already crawled
+        self._unsaved_seen = [] # Keys added to seen since the last take_unsaved_seen() (for checkpointing)
+        self._queue = deque() # FIFO mode: (url, depth)
+        self._heap = [] # Priority mode: (priority, seq, key, url, depth)
+        self._queued = {} # Priority mode: key -> (seq of its live heap entry, url, depth, host rank, in-degree)
+        self._host_counts = {} # Priority mode: host -> URLs queued for it so far
+        self._seq = 0
+        self._parked = {} # host -> deque of (url, depth) popped while that host was not ready
+        self._parked_count = 0
+
+    def __len__(self):
+        queued = len(self._queued) if self.prioritized else len(self._queue)
+        return queued + self._parked_count
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def _priority(self, depth, host_rank, inlinks):
+        # Lower is better
+        return depth * self.depth_weight + host_rank * self.host_weight - inlinks * self.inlink_weight
+
+    def add(self, url, depth):
+        """Queues url unless it has been added before. Returns True if it was queued."""
+        key = url_key(url)
+        if key in self.seen:
+            if self.prioritized and key in self._queued:
+                # Another page links here: bump its in-degree by pushing a fresher entry (the old one goes stale)
+                _, queued_url, queued_depth, host_rank, inlinks = self._queued[key]
+                self._push(key, queued_url, queued_depth, host_rank, inlinks + 1)
+            return False
+        self.seen.add(key)
+        self._unsaved_seen.append(key)
+
+        if not self.prioritized:
+            self._queue.append((url, depth))
+            return True
+
+        host = urlparse(url).netloc
+        host_rank = self._host_counts.get(host, 0)
+        self._host_counts[host] = host_rank + 1
+        self._push(key, url, depth, host_rank, 1)
+        return True
+
+    def _push(self, key, url, depth, host_rank, inlinks):
+        self._seq += 1
+        self._queued[key] = (self._seq, url, depth, host_rank, inlinks)
+        heapq.heappush(self._heap, (self._priority(depth, host_rank, inlinks), self._seq, key, url, depth))
+
+    def _pop_queued(self):
+        if not self.prioritized:
+            return self._queue.popleft() if self._queue else None
+        while self._heap:
+            _, seq, key, url, depth = heapq.heappop(self._heap)
+            if self._queued.get(key, (None,))[0] == seq: # Skip entries superseded by an in-degree bump
+                del self._queued[key]
+                return url, depth
+        return None
+
+    def pop(self):
+        """Returns the next (url, depth), or None if the frontier is empty."""
+        return self.pop_ready(lambda host: True)
+
+    def pop_ready(self, is_ready):
+        """
+        Returns the next (url, depth) whose host passes is_ready(host), or None.
+        URLs for hosts that are not ready are parked per host and handed out first once their host is ready.
+        """
+        for host in list(self._parked):
+            if is_ready(host):
+                return self._unpark(host)
+
+        while True:
+            item = self._pop_queued()
+            if item is None:
+                return None
+            host = urlparse(item[0]).netloc
+            if host not in self._parked and is_ready(host):
+                return item
+            self._parked.setdefault(host, deque()).append(item)
+            self._parked_count += 1
+
+    def _unpark(self, host):
+        parked = self._parked[host]
+        item = parked.popleft()
+        if not parked:
+            del self._parked[host]
+        self._parked_count -= 1
+        return item
+
+    def parked_hosts(self):
+        """Hosts that have URLs waiting for them to become ready."""
+        return list(self._parked)
+
+    def snapshot(self):
+        """Every waiting (url, depth) in roughly the order it would be popped, parked URLs first."""
+        items = [item for parked in self._parked.values() for item in parked]
+        if self.prioritized:
+            live = sorted(self._queued.values(), key=lambda entry: (self._priority(entry[2], entry[3], entry[4]), entry[0]))
+            items.extend((url, depth) for _, url, depth, _, _ in live)
+        else:
+            items.extend(self._queue)
+        return items
+
+    def take_unsaved_seen(self):
+        """Returns the seen keys added since the previous call."""
+        keys, self._unsaved_seen = self._unsaved_seen, []
+        return keys
+
+    def restore(self, seen, items):
+        """Replaces the frontier's contents with a checkpoint: the seen-set and the waiting (url, depth) items."""
+        self.__init__(self.prioritized, self.depth_weight, self.host_weight, self.inlink_weight)
+        for url, depth in items:
+            self.add(url, depth)
+        self.seen.update(seen)
+        self._unsaved_seen = []
@@ -0,0 +1,459 @@
+import heapq
+import math
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from completions import completions_path, write_completion_index
+from spelling import is_correctable, spelling_path, write_spelling_index
+
+# On-disk inverted index, read through mmap so loading is instant and every process shares the same pages.
+#
+# Layout (all integers little-endian):
+#   header       HEADER, including the corpus statistics BM25 needs
+#   postings     per term: a skip table with one SKIP_ENTRY per block, then the blocks. A block holds up to
+#                BLOCK_SIZE (doc id gap, term frequency) varint pairs; gaps restart from the previous block's
+#                last doc id, so a block can be decoded without touching the ones before it
+#   terms        all terms as UTF-8, back to back
+#   dictionary   one DICT_ENTRY per term, sorted by the term's UTF-8 bytes, so lookups are a binary search
+#   doc lengths  uint32 token count per doc id (0 to max doc id)
+#   doc flags    one byte per doc id: DOC_HAS_IMAGES | DOC_HAS_VIDEOS, so media filters run during retrieval
+#   doc ranks    one byte per doc id: the document's static score (see pagerank.py) from 0 to MAX_DOC_RANK
+#
+# Word positions live in a separate file (positions_path()), so queries that don't need them never read them.
+# For every posting it holds the term's positions in the document as varint-encoded gaps, in postings order;
+# each skip entry records where its block's position lists end.
+#
+# A spelling index (spelling_path(), see spelling.py) and a completion index (completions_path(), see
+# completions.py) over the terms that are words are written alongside as well.
+MAGIC = b'MSEIDX\x00\x06'
+VERSION = 6
+FLAG_POSITIONS = 1 # A positions file was written alongside the index
+DOC_HAS_IMAGES = 1
+DOC_HAS_VIDEOS = 2
+MAX_DOC_RANK = 255
+# magic, version, term count, terms offset, dictionary offset, doc lengths offset, doc count, max doc id,
+# total tokens, flags, doc flags offset, number of docs with images, number of docs with videos,
+# doc ranks offset, highest doc rank (for score upper bounds)
+HEADER = struct.Struct('<8sIIQQQIIQIQIIQI')
+# term offset, term length, postings offset, postings length, document frequency, idf,
+# highest term frequency and shortest document length among the term's postings (for score upper bounds),
+# offset of the term's positions in the positions file
+DICT_ENTRY = struct.Struct('<QIQIIdIIQ')
+# first and last doc id in the block, end of the block relative to the first block,
+# highest term frequency and shortest document length in the block (for per-block score upper bounds),
+# end of the block's positions relative to the term's positions
+SKIP_ENTRY = struct.Struct('<IIIIIQ')
+BLOCK_SIZE = 128
+END = float('inf') # PostingsCursor.doc once the cursor is exhausted
+
+def bm25_idf(doc_count, df):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+def encode_varint(value, out):
+    """Appends value to the bytearray out, 7 bits per byte, high bit set on all but the last byte."""
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varints(buf, start, end):
+    """Decodes all varints in buf[start:end]."""
+    values = []
+    value = shift = 0
+    for byte in buf[start:end]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+def decode_postings(buf, start, end, previous=0):
+    """Returns (doc_ids, term_frequencies) as two parallel lists; previous is the doc id the first gap is from."""
+    values = decode_varints(buf, start, end)
+    doc_ids = values[0::2]
+    for i in range(len(doc_ids)):
+        previous = doc_ids[i] = doc_ids[i] + previous
+    return doc_ids, values[1::2]
+
+def encode_blocks(postings, doc_lengths, positions=None):
+    """
+    Skip table followed by BLOCK_SIZE-posting blocks, as described at the top of this file.
+    Returns (postings bytes, positions bytes); positions is a position list per posting, or None.
+    """
+    skip_table = bytearray()
+    blocks = bytearray()
+    encoded_positions = bytearray()
+    previous = 0
+    for start in range(0, len(postings), BLOCK_SIZE):
+        block = postings[start:start + BLOCK_SIZE]
+        for doc_id, tf in block:
+            # Most gaps and frequencies fit in one byte, so that case skips the function call
+            gap = doc_id - previous
+            if gap < 0x80:
+                blocks.append(gap)
+            else:
+                encode_varint(gap, blocks)
+            if tf < 0x80:
+                blocks.append(tf)
+            else:
+                encode_varint(tf, blocks)
+            previous = doc_id
+        if positions is not None:
+            for position_list in positions[start:start + BLOCK_SIZE]:
+                previous_position = 0
+                for position in position_list:
+                    gap = position - previous_position
+                    if gap < 0x80:
+                        encoded_positions.append(gap)
+                    else:
+                        encode_varint(gap, encoded_positions)
+                    previous_position = position
+        skip_table += SKIP_ENTRY.pack(block[0][0], previous, len(blocks), max(tf for _, tf in block),
+                                      min(doc_lengths[doc_id] for doc_id, _ in block), len(encoded_positions))
+    return skip_table + blocks, encoded_positions
+
+def encode_term(postings, doc_lengths, positions=None):
+    """
+    Everything IndexWriter stores for one term, ready for add_encoded_term(). Separate from the writer so that
+    encoding, the expensive part of writing an index, can run in other processes.
+    """
+    encoded, encoded_positions = encode_blocks(postings, doc_lengths, positions)
+    max_tf = max(tf for _, tf in postings)
+    min_doc_length = min(doc_lengths[doc_id] for doc_id, _ in postings)
+    return encoded, encoded_positions, len(postings), max_tf, min_doc_length
+
+def positions_path(index_path):
+    """The positions file that goes with index_path, e.g. output/index.pos for output/index.bin."""
+    return os.path.splitext(index_path)[0] + '.pos'
+
+class IndexWriter:
+    """
+    Writes an index file term by term. Terms must be added in sorted order (see term_sort_key).
+    doc_lengths maps doc id -> number of tokens (a list or array indexed by doc id; unused ids are 0), and
+    doc_flags likewise maps doc id -> DOC_HAS_IMAGES | DOC_HAS_VIDEOS (all 0 if not given), and doc_ranks
+    doc id -> static score from 0 to MAX_DOC_RANK (all 0 if not given).
+    With store_positions, add_term() also takes each posting's word positions and writes them to positions_path().
+    close() also writes the spelling and completion indexes of the terms to spelling_path() and completions_path().
+    """
+    def __init__(self, path, doc_lengths, store_positions=False, doc_flags=None, doc_ranks=None):
+        self.path = path
+        self.doc_lengths = array('I', doc_lengths)
+        self.doc_flags = bytes(doc_flags) if doc_flags is not None else bytes(len(self.doc_lengths))
+        if len(self.doc_flags) != len(self.doc_lengths):
+            raise ValueError("doc_flags must have one entry per doc id, like doc_lengths")
+        self.doc_ranks = bytes(doc_ranks) if doc_ranks is not None else bytes(len(self.doc_lengths))
+        if len(self.doc_ranks) != len(self.doc_lengths):
+            raise ValueError("doc_ranks must have one entry per doc id, like doc_lengths")
+        self.doc_count = sum(1 for length in self.doc_lengths if length)
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, 'wb')
+        self.positions_file = open(positions_path(path) + '.tmp', 'wb') if store_positions else None
+        self.file.write(b'\0' * HEADER.size) # Filled in by close()
+        self.terms = bytearray()
+        self.entries = []
+        self.last_term = None
+        self.words = [] # (term, df) for the terms the spelling and completion indexes cover
+
+    def add_term(self, term, postings, positions=None):
+        """
+        postings: [(doc id, term frequency), ...] with unique doc ids in ascending order.
+        positions: for each posting, the ascending positions of term in that document (when storing positions).
+        """
+        if (self.positions_file is not None) != (positions is not None):
+            raise ValueError("positions must be given exactly when the writer stores positions")
+        self.add_encoded_term(term, encode_term(postings, self.doc_lengths, positions))
+
+    def add_encoded_term(self, term, encoded_term):
+        """Adds a term whose postings were already encoded by encode_term() (with the same doc lengths)."""
+        term_bytes = term.encode('utf-8')
+        if self.last_term is not None and term_bytes <= self.last_term:
+            raise ValueError(f"Terms must be added in sorted order: {term!r}")
+        self.last_term = term_bytes
+
+        encoded, encoded_positions, df, max_tf, min_doc_length = encoded_term
+        positions_offset = 0
+        if self.positions_file is not None:
+            positions_offset = self.positions_file.tell()
+            self.positions_file.write(encoded_positions)
+        self.entries.append((len(self.terms), len(term_bytes), self.file.tell(), len(encoded), df,
+                             max_tf, min_doc_length, positions_offset))
+        self.terms += term_bytes
+        self.file.write(encoded)
+        if is_correctable(term):
+            self.words.append((term, df))
+
+    def close(self):
+        terms_offset = self.file.tell()
+        self.file.write(self.terms)
+        dict_offset = self.file.tell()
+        for term_offset, term_len, postings_offset, postings_len, df, max_tf, min_doc_length, positions_offset in self.entries:
+            # IDF is fixed once the index is written, so it is computed here rather than per query
+            idf = bm25_idf(self.doc_count, df)
+            self.file.write(DICT_ENTRY.pack(terms_offset + term_offset, term_len, postings_offset, postings_len, df, idf,
+                                            max_tf, min_doc_length, positions_offset))
+        doc_lengths_offset = self.file.tell()
+        self.file.write(struct.pack(f'<{len(self.doc_lengths)}I', *self.doc_lengths))
+        doc_flags_offset = self.file.tell()
+        self.file.write(self.doc_flags)
+        doc_ranks_offset = self.file.tell()
+        self.file.write(self.doc_ranks)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.entries), terms_offset, dict_offset, doc_lengths_offset,
+                                    self.doc_count, max(len(self.doc_lengths) - 1, 0), sum(self.doc_lengths),
+                                    FLAG_POSITIONS if self.positions_file is not None else 0, doc_flags_offset,
+                                    sum(1 for flags in self.doc_flags if flags & DOC_HAS_IMAGES),
+                                    sum(1 for flags in self.doc_flags if flags & DOC_HAS_VIDEOS), doc_ranks_offset,
+                                    max(self.doc_ranks, default=0)))
+        self.file.close()
+        if self.positions_file is not None:
+            self.positions_file.close()
+            # Positions first: a reader that sees the new index must also find its positions
+            os.replace(self.positions_file.name, positions_path(self.path))
+        write_spelling_index(spelling_path(self.path), (term for term, _ in self.words))
+        write_completion_index(completions_path(self.path), self.words)
+        os.replace(self.tmp_path, self.path) # Readers never see a half-written index
+
+def term_sort_key(term):
+    return term.encode('utf-8')
+
+class IndexReader:
+    """Read-only view of an index file. Nothing is decoded up front; postings are decoded per looked-up term."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.term_count, self.terms_offset, self.dict_offset, doc_lengths_offset,
+         self.doc_count, self.max_doc_id, self.total_tokens, flags, doc_flags_offset, self.image_doc_count,
+         self.video_doc_count, doc_ranks_offset, self.max_doc_rank) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} index file; rebuild it with indexer.py")
+        self.has_positions = bool(flags & FLAG_POSITIONS)
+        self.positions_buf = None # Mapped on first use, so bag-of-words queries never touch the file
+        self.avg_doc_length = self.total_tokens / self.doc_count if self.doc_count else 0.0
+        # Zero-copy uint32 view of the doc lengths (the file is little-endian, like the machines we run on)
+        self.doc_lengths = memoryview(self.buf)[doc_lengths_offset:doc_lengths_offset + 4 * (self.max_doc_id + 1)].cast('I')
+        self.doc_flags = memoryview(self.buf)[doc_flags_offset:doc_flags_offset + self.max_doc_id + 1]
+        self.doc_ranks = memoryview(self.buf)[doc_ranks_offset:doc_ranks_offset + self.max_doc_id + 1]
+
+    def __len__(self):
+        return self.term_count
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def _entry(self, i):
+        return DICT_ENTRY.unpack_from(self.buf, self.dict_offset + i * DICT_ENTRY.size)
+
+    def _term_at(self, i):
+        term_offset, term_len = self._entry(i)[:2]
+        return self.buf[term_offset:term_offset + term_len]
+
+    def _find(self, term):
+        """Binary search of the dictionary. Returns the term's DICT_ENTRY tuple or None."""
+        target = term.encode('utf-8')
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.term_count and self._term_at(lo) == target:
+            return self._entry(lo)
+        return None
+
+    def _first(self, below):
+        """The first i for which below(term i) is false (below must be true, then false, over the sorted terms)."""
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if below(self._term_at(mid)):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_terms(self, prefix, limit):
+        """
+        ([(term, document frequency), ...], count): the (up to limit) most frequent of the count terms starting
+        with prefix. They sit next to each other in the sorted dictionary, so two binary searches find them.
+        """
+        key = prefix.encode('utf-8')
+        start = self._first(lambda term: term < key)
+        end = self._first(lambda term: term[:len(key)] <= key)
+        if end - start > limit:
+            found = heapq.nlargest(limit, range(start, end), key=lambda i: self._entry(i)[4])
+        else:
+            found = range(start, end)
+        return [(self._term_at(i).decode('utf-8'), self._entry(i)[4]) for i in found], end - start
+
+    def doc_frequency(self, term):
+        entry = self._find(term)
+        return entry[4] if entry else 0
+
+    def idf(self, term):
+        entry = self._find(term)
+        return entry[5] if entry else 0.0
+
+    def postings(self, term):
+        """(doc_ids, term_frequencies) for term, sorted by doc id; two empty lists if the term is unknown."""
+        entry = self._find(term)
+        if entry is None:
+            return [], []
+        postings_offset, df = entry[2], entry[4]
+        blocks_offset = postings_offset + SKIP_ENTRY.size * -(-df // BLOCK_SIZE)
+        blocks_len = SKIP_ENTRY.unpack_from(self.buf, blocks_offset - SKIP_ENTRY.size)[2]
+        return decode_postings(self.buf, blocks_offset, blocks_offset + blocks_len)
+
+    def cursor(self, term):
+        """A PostingsCursor over term's postings, or None if the term is unknown."""
+        entry = self._find(term)
+        return PostingsCursor(self, entry) if entry else None
+
+    def _positions(self):
+        if self.positions_buf is None:
+            if not self.has_positions:
+                raise ValueError(f"{self.path} was built without word positions")
+            with open(positions_path(self.path), 'rb') as f:
+                # mmap cannot map an empty file, which is what an index without any terms has
+                self.positions_buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        return self.positions_buf
+
+    def terms(self):
+        for i in range(self.term_count):
+            yield self._term_at(i).decode('utf-8')
+
+    def term_cursors(self):
+        """(term, PostingsCursor) for every term in sorted order, without a dictionary search per term."""
+        for i in range(self.term_count):
+            entry = self._entry(i)
+            yield self.buf[entry[0]:entry[0] + entry[1]].decode('utf-8'), PostingsCursor(self, entry)
+
+    def close(self):
+        self.doc_lengths.release()
+        self.doc_flags.release()
+        self.doc_ranks.release()
+        self.buf.close()
+        if isinstance(self.positions_buf, mmap.mmap):
+            self.positions_buf.close()
+
+class PostingsCursor:
+    """
+    Document-at-a-time iterator over one term's postings. A block is only decoded once its postings are
+    actually needed, so next_geq() can jump over long runs of postings using the skip table alone.
+    """
+    def __init__(self, reader, entry):
+        self.reader = reader
+        self.buf = reader.buf
+        _, _, postings_offset, _, self.df, self.idf, self.max_tf, self.min_doc_length, self.positions_offset = entry
+        block_count = -(-self.df // BLOCK_SIZE)
+        self.blocks_offset = postings_offset + SKIP_ENTRY.size * block_count
+        skip_table = list(SKIP_ENTRY.iter_unpack(self.buf[postings_offset:self.blocks_offset]))
+        self.block_first = [entry[0] for entry in skip_table]
+        self.block_last = [entry[1] for entry in skip_table]
+        self.block_end = [entry[2] for entry in skip_table]
+        self.block_max_tf = [entry[3] for entry in skip_table]
+        self.block_min_doc_length = [entry[4] for entry in skip_table]
+        self.block_positions_end = [entry[5] for entry in skip_table]
+        self.doc_ids = self.term_frequencies = None # The current block, once decoded
+        self.block_position_lists = None # Position lists of the current block, once decoded
+        self.decoded_blocks = None # block -> (doc ids, term frequencies), shared with fresh() copies
+        self.pos = 0
+        self._move_to_block(0)
+
+    def fresh(self):
+        """
+        A new cursor at the start of the same postings. It shares this one's skip table, and from then on the
+        blocks any of them decodes, instead of decoding them again.
+        """
+        if self.decoded_blocks is None:
+            self.decoded_blocks = {}
+        cursor = PostingsCursor.__new__(PostingsCursor)
+        cursor.__dict__.update(self.__dict__)
+        cursor._move_to_block(0)
+        return cursor
+
+    def _move_to_block(self, block):
+        # The block's first doc id is in the skip table, so landing on a block decodes nothing
+        self.block = block
+        self.doc_ids = self.block_position_lists = None
+        self.pos = 0
+        self.doc = self.block_first[block] if block < len(self.block_first) else END
+
+    def _decode(self):
+        if self.doc_ids is None:
+            block = self.block
+            if self.decoded_blocks is not None and block in self.decoded_blocks:
+                self.doc_ids, self.term_frequencies = self.decoded_blocks[block]
+                return
+            start = self.block_end[block - 1] if block else 0
+            previous = self.block_last[block - 1] if block else 0
+            self.doc_ids, self.term_frequencies = decode_postings(self.buf, self.blocks_offset + start,
+                                                                  self.blocks_offset + self.block_end[block], previous)
+            if self.decoded_blocks is not None:
+                self.decoded_blocks[block] = (self.doc_ids, self.term_frequencies)
+
+    @property
+    def tf(self):
+        self._decode()
+        return self.term_frequencies[self.pos]
+
+    def positions(self):
+        """Ascending word positions of the term in the current document (needs an index built with positions)."""
+        if self.block_position_lists is None:
+            self._decode()
+            block = self.block
+            start = self.positions_offset + (self.block_positions_end[block - 1] if block else 0)
+            # A block's position lists are back to back; each one's length is the posting's tf
+            values = decode_varints(self.reader._positions(), start, self.positions_offset + self.block_positions_end[block])
+            lists = []
+            i = 0
+            for tf in self.term_frequencies:
+                position_list = values[i:i + tf]
+                for j in range(1, tf):
+                    position_list[j] += position_list[j - 1]
+                lists.append(position_list)
+                i += tf
+            self.block_position_lists = lists
+        return self.block_position_lists[self.pos]
+
+    def next(self):
+        """Moves to the next posting; doc becomes END after the last one."""
+        self._decode()
+        self.pos += 1
+        if self.pos < len(self.doc_ids):
+            self.doc = self.doc_ids[self.pos]
+        else:
+            self._move_to_block(self.block + 1)
+
+    def next_geq(self, target):
+        """Moves to the first posting with doc id >= target (never backwards)."""
+        if self.doc >= target:
+            return
+        if target > self.block_last[self.block]:
+            # Only the skip table is consulted for the blocks in between
+            self._move_to_block(bisect_left(self.block_last, target, self.block + 1))
+            if self.doc >= target:
+                return
+        self._decode()
+        # Gallop: targets are usually close to the current posting, so probe 1, 2, 4, ... ahead before bisecting
+        doc_ids = self.doc_ids
+        lo, step = self.pos, 1
+        hi = lo + 1
+        while hi < len(doc_ids) and doc_ids[hi] < target:
+            lo = hi
+            step *= 2
+            hi = lo + step
+        self.pos = bisect_left(doc_ids, target, lo, min(hi + 1, len(doc_ids)))
+        self.doc = doc_ids[self.pos]
+
+    def block_at(self, doc_id):
+        """Index of the first block, from the current one on, whose last doc id is >= doc_id; None past the end."""
+        block = self.block
+        if block < len(self.block_last) and doc_id > self.block_last[block]:
+            block = bisect_left(self.block_last, doc_id, block + 1)
+        return block if block < len(self.block_last) else None
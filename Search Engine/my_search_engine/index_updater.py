@@ -0,0 +1,347 @@
+import copy
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import groupby
+from analyzer import manifest_analyzer
+from index_format import END, IndexReader, IndexWriter, term_sort_key
+from indexer import document_flags, document_info, tokenize_batch
+from pagerank import doc_rank, ranks_path, read_doc_ranks
+from segments import (documents_writer, load_deleted, new_segment_info, new_segment_name, open_documents, read_manifest,
+                      remove_segment_files, segment_file, source_state, write_deleted, write_manifest)
+from shards import read_shards
+
+def _tagged_cursors(reader, i):
+    for term, cursor in reader.term_cursors():
+        yield term, i, cursor
+
+class IndexUpdater:
+    """
+    Applies new, changed and deleted documents to a segmented index (see segments.py) without rebuilding it.
+
+    Every add_documents() call writes one small segment and tombstones the earlier versions of the pages it
+    replaces, then commits, so a SearchEngine sees the change on its next reload check. A background thread
+    keeps the number of segments down by merging adjacent ones, which also drops deleted documents for good.
+    Only one IndexUpdater (or Indexer) may write to an index directory at a time.
+
+    New documents get their static scores from ranks_file (see pagerank.py), if given; merges keep the
+    scores segments already have.
+    """
+    def __init__(self, index_dir="output", store_positions=True, merge_factor=10, max_deleted_ratio=0.3, background_merge=True,
+                 ranks_file=None):
+        if read_shards(index_dir) is not None:
+            raise ValueError(f"{index_dir} is a sharded index, which is only rebuilt, with Indexer(shards=N)")
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        self.store_positions = store_positions
+        self.merge_factor = merge_factor # Once there are this many segments, merge this many adjacent ones
+        self.max_deleted_ratio = max_deleted_ratio # Rewrite a segment on its own once this share of it is deleted
+        self.doc_ranks = read_doc_ranks(ranks_file) # {normalized URL: static score}
+        self.lock = threading.Lock() # Held while reading or committing the manifest
+        self.manifest = read_manifest(index_dir)
+        # New segments are analyzed like the rest of the index; a new index records the default analyzer
+        self.analyzer = manifest_analyzer(self.manifest)
+        self.manifest['analyzer'] = self.analyzer.config()
+        self.live = {} # url -> global doc id of the current version of every page
+        for info in self.manifest['segments']:
+            deleted = load_deleted(index_dir, info)
+            store = open_documents(index_dir, info['name'])
+            for local_id, document in store.items():
+                if info['doc_base'] + local_id not in deleted:
+                    self.live[document['url']] = info['doc_base'] + local_id
+            store.close()
+
+        self.merge_needed = threading.Event()
+        self.closed = False
+        self.merge_thread = None
+        if background_merge:
+            self.merge_thread = threading.Thread(target=self._merge_loop, daemon=True)
+            self.merge_thread.start()
+
+    def add_documents(self, documents, source=None):
+        """
+        Indexes documents (crawler records, where {'url': ..., 'deleted': True} removes a page) as one new
+        segment and commits it. source=(path, state) records in the same commit how far a followed documents
+        file has been indexed. Returns the index generation that includes the documents.
+        """
+        latest = {}
+        for document in documents:
+            latest[document['url']] = document # Within a batch too, the last record for a URL wins
+
+        with self.lock:
+            manifest = copy.deepcopy(self.manifest)
+            generation = manifest['generation'] + 1
+            replaced = [self.live[url] for url in latest if url in self.live]
+            new_documents = [document for document in latest.values() if not document.get('deleted')]
+            if not replaced and not new_documents and source is None:
+                return manifest['generation']
+
+            info = None
+            if new_documents:
+                info = self._write_segment(manifest, new_documents)
+                manifest['segments'].append(info)
+            self._tombstone(manifest, replaced, generation)
+            if source is not None:
+                path, state = source
+                manifest['sources'][path] = state
+            manifest['generation'] = generation
+            write_manifest(self.index_dir, manifest, self.manifest)
+            self.manifest = manifest
+
+            for url in latest:
+                self.live.pop(url, None)
+            if info is not None:
+                for doc_id, document in enumerate(new_documents, info['doc_base'] + 1):
+                    self.live[document['url']] = doc_id
+
+        if new_documents or replaced:
+            print(f"Generation {generation}: indexed {len(new_documents)} documents, removed {len(replaced)} old versions")
+        self.merge_needed.set()
+        return generation
+
+    def _write_segment(self, manifest, documents):
+        name = new_segment_name(manifest)
+        doc_base = manifest['next_doc_id'] - 1
+        lengths, postings = tokenize_batch([(i, document.get('text_content', '')) for i, document in enumerate(documents, 1)],
+                                           self.store_positions, self.analyzer)
+        doc_lengths = array('I', [0]) * (len(documents) + 1)
+        for i, length in lengths:
+            doc_lengths[i] = length
+
+        doc_flags = bytes([0] + [document_flags(document) for document in documents])
+        doc_ranks = bytes([0] + [doc_rank(self.doc_ranks, document['url']) for document in documents])
+        writer = IndexWriter(segment_file(self.index_dir, name, '.bin'), doc_lengths, store_positions=self.store_positions,
+                             doc_flags=doc_flags, doc_ranks=doc_ranks)
+        for term in sorted(postings, key=term_sort_key):
+            entries = postings[term]
+            writer.add_term(term, [(doc_id, tf) for doc_id, tf, _ in entries],
+                            [positions for _, _, positions in entries] if self.store_positions else None)
+        writer.close()
+        store = documents_writer(self.index_dir, name)
+        for i, document in enumerate(documents, 1):
+            store.add(i, document_info(document))
+        store.close()
+        manifest['next_doc_id'] += len(documents)
+        return new_segment_info(name, doc_base, doc_base + len(documents), len(documents))
+
+    def _tombstone(self, manifest, doc_ids, generation):
+        """Marks global doc_ids as deleted in whichever segments of manifest hold them."""
+        segments = manifest['segments']
+        max_doc_ids = [info['max_doc_id'] for info in segments]
+        by_segment = defaultdict(set)
+        for doc_id in doc_ids:
+            by_segment[bisect_left(max_doc_ids, doc_id)].add(doc_id)
+        for i, doc_ids in by_segment.items():
+            info = segments[i]
+            write_deleted(self.index_dir, info, load_deleted(self.index_dir, info) | doc_ids, generation)
+
+    def _pick_merge(self):
+        """The adjacent segments to merge next, or None if the index is in good enough shape."""
+        segments = self.manifest['segments']
+        for info in segments:
+            if info['deleted_count'] and info['deleted_count'] >= self.max_deleted_ratio * info['doc_count']:
+                return [copy.deepcopy(info)]
+        if len(segments) < self.merge_factor:
+            return None
+        # The run of merge_factor adjacent segments with the fewest live documents: new, small segments get
+        # merged often and big ones rarely, so each document is rewritten only a logarithmic number of times
+        live = [info['doc_count'] - info['deleted_count'] for info in segments]
+        start = min(range(len(segments) - self.merge_factor + 1), key=lambda i: sum(live[i:i + self.merge_factor]))
+        return copy.deepcopy(segments[start:start + self.merge_factor])
+
+    def _merge_loop(self):
+        while not self.closed:
+            self.merge_needed.wait()
+            self.merge_needed.clear()
+            try:
+                self.merge()
+            except Exception as e:
+                print(f"Segment merge failed: {e}")
+
+    def merge(self):
+        """Runs merges until the merge policy is satisfied (called by the background thread, or directly)."""
+        while not self.closed:
+            with self.lock:
+                infos = self._pick_merge()
+                if not infos:
+                    return
+                name = new_segment_name(self.manifest)
+                # Read now: a later commit replaces these tombstone files
+                deleted_before = [load_deleted(self.index_dir, info) for info in infos]
+            self._merge(infos, name, deleted_before)
+
+    def _merge(self, infos, name, deleted_before):
+        readers = []
+        try:
+            for info in infos:
+                readers.append(IndexReader(segment_file(self.index_dir, info['name'], '.bin')))
+            new_info, doc_count = self._write_merged(infos, readers, name, deleted_before)
+        except BaseException:
+            remove_segment_files(self.index_dir, name) # Nothing half-written is left behind
+            raise
+        finally:
+            for reader in readers:
+                reader.close()
+
+        with self.lock:
+            manifest = copy.deepcopy(self.manifest)
+            names = [info['name'] for info in infos]
+            current_names = [info['name'] for info in manifest['segments']]
+            if names[0] not in current_names or current_names[current_names.index(names[0]):][:len(names)] != names:
+                # The index was rebuilt while merging
+                remove_segment_files(self.index_dir, name)
+                return
+            start = current_names.index(names[0])
+            generation = manifest['generation'] + 1
+            # Documents deleted while the merge ran are still in the new segment: carry their tombstones over
+            deleted_since = set()
+            for info, deleted in zip(manifest['segments'][start:start + len(names)], deleted_before):
+                deleted_since |= load_deleted(self.index_dir, info) - deleted
+            if new_info is not None and deleted_since:
+                write_deleted(self.index_dir, new_info, deleted_since, generation)
+            manifest['segments'][start:start + len(names)] = [new_info] if new_info is not None else []
+            manifest['generation'] = generation
+            write_manifest(self.index_dir, manifest, self.manifest)
+            self.manifest = manifest
+        print(f"Generation {generation}: merged {', '.join(names)} into {name if new_info else 'nothing'} ({doc_count} documents)")
+
+    def _write_merged(self, infos, readers, name, deleted_before):
+        """Writes segment name from the live documents of infos; returns (its segment info, doc count), or (None, 0) if there are none."""
+        doc_base = infos[0]['doc_base']
+        max_doc_id = infos[-1]['max_doc_id']
+        doc_lengths = array('I', [0]) * (max_doc_id - doc_base + 1)
+        doc_flags = bytearray(max_doc_id - doc_base + 1)
+        doc_ranks = bytearray(max_doc_id - doc_base + 1)
+        doc_count = 0
+        documents = documents_writer(self.index_dir, name)
+        for info, reader, deleted in zip(infos, readers, deleted_before):
+            store = open_documents(self.index_dir, info['name'])
+            try:
+                for local_id, record in store.records():
+                    doc_id = info['doc_base'] + local_id
+                    if doc_id not in deleted:
+                        documents.add_record(doc_id - doc_base, record) # Copied as is, without decompressing
+                        doc_lengths[doc_id - doc_base] = reader.doc_lengths[local_id]
+                        doc_flags[doc_id - doc_base] = reader.doc_flags[local_id]
+                        doc_ranks[doc_id - doc_base] = reader.doc_ranks[local_id]
+                        doc_count += 1
+            finally:
+                store.close()
+
+        if not doc_count:
+            # Every document was deleted: the merge just drops the segments
+            documents.abort()
+            return None, 0
+        documents.close()
+
+        store_positions = self.store_positions and all(reader.has_positions for reader in readers)
+        writer = IndexWriter(segment_file(self.index_dir, name, '.bin'), doc_lengths, store_positions=store_positions,
+                             doc_flags=doc_flags, doc_ranks=doc_ranks)
+        # Segments are in doc id order, so for each term their postings (minus deleted documents) just concatenate
+        streams = [_tagged_cursors(reader, i) for i, reader in enumerate(readers)]
+        for term, group in groupby(heapq.merge(*streams, key=lambda item: term_sort_key(item[0])), key=lambda item: item[0]):
+            postings, positions = [], []
+            for _, i, cursor in group:
+                base, deleted = infos[i]['doc_base'], deleted_before[i]
+                while cursor.doc != END:
+                    doc_id = base + cursor.doc
+                    if doc_id not in deleted:
+                        postings.append((doc_id - doc_base, cursor.tf))
+                        if store_positions:
+                            positions.append(cursor.positions())
+                    cursor.next()
+            if postings:
+                writer.add_term(term, postings, positions if store_positions else None)
+        writer.close()
+        return new_segment_info(name, doc_base, max_doc_id, doc_count), doc_count
+
+    def poll(self, path, max_documents=500):
+        """
+        Indexes up to max_documents complete records appended to the .jsonl file path since the last call
+        (or since the Indexer build that covered it). Returns how many records were read.
+        """
+        key = os.path.abspath(path)
+        if not os.path.exists(path):
+            return 0
+        state = self.manifest['sources'].get(key)
+        offset = 0
+        with open(path, 'rb') as f:
+            if state is not None:
+                head = bytes.fromhex(state['head'])
+                if os.fstat(f.fileno()).st_size >= state['offset'] and f.read(len(head)) == head:
+                    offset = state['offset']
+                else:
+                    print(f"{path} was rewritten; indexing it from the start")
+            f.seek(offset)
+            documents = []
+            end = offset
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # Still being written
+                end += len(line)
+                line = line.strip()
+                if line:
+                    try:
+                        documents.append(json.loads(line))
+                    except ValueError:
+                        print(f"Skipping unreadable line in {path}")
+                if len(documents) >= max_documents:
+                    break
+        if end == offset:
+            return 0
+        self.add_documents(documents, source=(key, source_state(path, end)))
+        return len(documents)
+
+    def follow(self, path, interval=2.0):
+        """
+        Tails a .jsonl documents file, e.g. the crawler's documents.jsonl while it crawls, indexing new records
+        as they arrive, so fresh pages are searchable within seconds. Runs until interrupted.
+        """
+        print(f"Following {path} into {self.index_dir} (Ctrl+C to stop)")
+        while True:
+            if not self.poll(path):
+                time.sleep(interval)
+
+    def close(self):
+        self.closed = True
+        self.merge_needed.set()
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+def check_deleted_segment_merge():
+    """Merging a segment whose documents have all been replaced drops it, leaving no files behind."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as index_dir:
+        updater = IndexUpdater(index_dir, merge_factor=3, background_merge=False)
+        for i in range(3):
+            updater.add_documents([{'url': f'https://example.com/{i}', 'text_content': f'page {i}'}])
+        # Replacing the only document of the first segment deletes all of it
+        updater.add_documents([{'url': 'https://example.com/0', 'text_content': 'page 0 again'}])
+        updater.merge()
+        updater.close()
+        names = [info['name'] for info in updater.manifest['segments']]
+        leftovers = [filename for filename in os.listdir(index_dir) if filename.endswith('.tmp')]
+        assert 'seg_000001' not in names and not leftovers, (names, leftovers)
+        assert sorted(updater.live) == [f'https://example.com/{i}' for i in range(3)]
+    print(f"Fully deleted segment merged away; segments left: {names}")
+
+if __name__ == "__main__":
+    # python index_updater.py [documents file] [index dir], or python index_updater.py check
+    if sys.argv[1:] == ['check']:
+        check_deleted_segment_merge()
+        sys.exit(0)
+    documents_file = sys.argv[1] if len(sys.argv) > 1 else "crawled_data/documents.jsonl"
+    index_dir = sys.argv[2] if len(sys.argv) > 2 else "output"
+    updater = IndexUpdater(index_dir, ranks_file=ranks_path(documents_file))
+    try:
+        updater.follow(documents_file)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        updater.close()
@@ -1,71 +1,358 @@
-import json
+import heapq
 import os
-import re
-from collections import defaultdict
+import pickle
+import shutil
+import tempfile
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+from analyzer import Analyzer
+from completions import completions_path
+from document_sink import read_documents
+from index_format import DOC_HAS_IMAGES, DOC_HAS_VIDEOS, IndexWriter, encode_term, positions_path, term_sort_key
+from pagerank import doc_rank, ranks_path, read_doc_ranks
+from segments import (documents_writer, new_segment_info, new_segment_name, read_manifest, segment_file,
+                      source_state, write_manifest)
+from shards import remove_shards, shard_name, shard_of, write_shards
+from spelling import spelling_path
+
+# Rough in-memory size of one buffered posting and of one buffered word position, used to decide when the
+# buffer has reached the memory budget and must be spilled to disk
+POSTING_BYTES = 150
+POSITION_BYTES = 36
+ENCODE_CHUNK_POSTINGS = 20000 # Roughly how many postings each task sent to an encoder process holds
+
+def document_info(doc):
+    """What the document map keeps about a crawled document: everything the results page shows."""
+    return {
+        'url': doc['url'],
+        'images': doc.get('images', []),
+        'videos': doc.get('videos', [])
+    }
+
+def document_flags(doc):
+    """The doc flags the index stores for a crawled document (see index_format.py)."""
+    return (DOC_HAS_IMAGES if doc.get('images') else 0) | (DOC_HAS_VIDEOS if doc.get('videos') else 0)
+
+def tokenize_batch(batch, store_positions, analyzer):
+    """
+    Runs in a tokenizer process. batch is [(doc_id, text), ...] in doc_id order, analyzed with analyzer.
+    Returns ([(doc_id, term count), ...], {term: [(doc_id, tf, positions or None), ...]}).
+    """
+    lengths = []
+    postings = defaultdict(list)
+    for doc_id, text in batch:
+        terms = analyzer.positions(text)
+        lengths.append((doc_id, len(terms)))
+        word_positions = defaultdict(list)
+        for word, position in terms:
+            word_positions[word].append(position)
+        for word, positions in word_positions.items():
+            postings[word].append((doc_id, len(positions), positions if store_positions else None))
+    return lengths, dict(postings)
+
+_encoder_doc_lengths = None # Set in each encoder process by _init_encoder()
+_encoder_store_positions = False
+
+def _init_encoder(doc_lengths, store_positions):
+    global _encoder_doc_lengths, _encoder_store_positions
+    _encoder_doc_lengths = doc_lengths
+    _encoder_store_positions = store_positions
+
+def encode_terms(terms):
+    """Runs in an encoder process. terms is [(term, [(doc_id, tf, positions), ...]), ...]; returns [(term, encode_term() result), ...]."""
+    encoded = []
+    for term, entries in terms:
+        postings = [(doc_id, tf) for doc_id, tf, _ in entries]
+        positions = [positions for _, _, positions in entries] if _encoder_store_positions else None
+        encoded.append((term, encode_term(postings, _encoder_doc_lengths, positions)))
+    return encoded
+
+def _chunk_terms(terms):
+    chunk = []
+    postings = 0
+    for term, entries in terms:
+        chunk.append((term, entries))
+        postings += len(entries)
+        if postings >= ENCODE_CHUNK_POSTINGS:
+            yield chunk
+            chunk = []
+            postings = 0
+    if chunk:
+        yield chunk
+
+def _map_in_order(pool, function, items, window):
+    """
+    Like pool.map(function, items), but results come back in order while at most window items are in flight,
+    so items (a generator) is consumed only as fast as the pool keeps up. Without a pool, runs in this process.
+    """
+    if pool is None:
+        for item in items:
+            yield function(item)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _write_run(path, postings):
+    """Writes buffered postings to path as one pickled (term, postings) record per term, in term order."""
+    with open(path, 'wb', buffering=1 << 20) as f:
+        for term in sorted(postings, key=term_sort_key):
+            pickle.dump((term, postings[term]), f, pickle.HIGHEST_PROTOCOL)
+
+def _read_run(path):
+    with open(path, 'rb', buffering=1 << 20) as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
 
 class Indexer:
-    def __init__(self, documents_file="crawled_data/documents.json", output_dir="output"):
+    """
+    Builds the index without holding the corpus in memory: documents are streamed from documents_file and
+    tokenized in batches by a pool of processes. Their postings are buffered until the buffer reaches
+    memory_budget_mb, then written out as a sorted run; at the end the runs are merged term by term into
+    the index file.
+
+    This is a full rebuild: the result replaces every segment in output_dir (see segments.py). To add or
+    update documents afterwards without rebuilding, use IndexUpdater (index_updater.py).
+
+    With shards > 1 the documents are partitioned by URL into that many shards, each indexed like this into a
+    subdirectory of output_dir, to be searched in parallel by a ShardedSearchEngine (see shards.py).
+
+    Text is turned into terms by analyzer (an Analyzer, see analyzer.py; by default one with the default
+    configuration), which is recorded in the manifest for IndexUpdater and SearchEngine to use as well.
+
+    Every document's static score is taken from ranks_file, written by pagerank.py (by default the
+    pagerank.json next to documents_file); documents it does not cover, or all if there is none, score 0.
+    """
+    def __init__(self, documents_file="crawled_data/documents.jsonl", output_dir="output", store_positions=True,
+                 workers=None, memory_budget_mb=256, batch_size=200, shards=1, analyzer=None, ranks_file=None):
         self.documents_file = documents_file
+        self.store_positions = store_positions # Needed for phrase and NEAR queries
+        # Processes that tokenize and encode; with 0 or 1 that work happens in this process instead
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.batch_size = batch_size # Documents per task sent to a tokenizer process
+        self.shards = shards
+        self.analyzer = Analyzer() if analyzer is None else analyzer
+        self.ranks_file = ranks_path(documents_file) if ranks_file is None else ranks_file
+        self.doc_ranks = None # {normalized URL: static score}, read when the build starts
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
-        self.inverted_index = defaultdict(list)
-        self.document_map = {} # Maps doc_id to {url, images, videos}
+        self.buffer = defaultdict(list) # term -> [(doc_id, tf, positions), ...] in doc_id order, not yet spilled
+        self.buffer_bytes = 0
+        self.runs = [] # Paths of spilled runs, in doc_id order
+        self.doc_lengths = [0] # Tokens per doc_id; doc_id 0 is unused
+        self.doc_flags = bytearray(1) # Media flags per doc_id
+        self.doc_rank_bytes = bytearray(1) # Static score per doc_id (see pagerank.py)
+        self.documents_tokenized = 0
+        self.documents = None # DocStoreWriter receiving {url, images, videos} per doc_id as documents are read
+        self.manifest = read_manifest(self.output_dir)
+        self.segment_name = new_segment_name(self.manifest)
+        self.index_file = segment_file(self.output_dir, self.segment_name, '.bin')
 
-    def build_index(self):
-        documents = self._load_documents()
-        if not documents:
-            print("No documents to index. Exiting.")
+    def build_index(self, records=None):
+        """Indexes the latest version of every document in documents_file, or only those at the record positions in records."""
+        # A plain .jsonl file can be followed afterwards by IndexUpdater, starting from what this build covers
+        # (not when only some of its records are indexed, as for a shard)
+        source_offset = os.path.getsize(self.documents_file) if records is None and self.documents_file.endswith('.jsonl') and os.path.exists(self.documents_file) else None
+        if records is None:
+            records = self._latest_records()
+            if records is None:
+                return # No documents file
+        if self.shards > 1:
+            self._build_shards(records)
+            return
+        if not records:
+            # Every page may have been deleted since the last build: an index of nothing replaces it, as for a
+            # shard without documents
+            self._commit_empty(source_offset)
+            remove_shards(self.output_dir)
+            print(f"No documents to index. Committed empty index generation {self.manifest['generation']}")
             return
 
-        print(f"Loaded {len(documents)} documents from {self.documents_file}")
-
-        for doc_id, doc in enumerate(documents):
-            url = doc['url']
-            text_content = doc.get('text_content', '')
-            images = doc.get('images', [])
-            videos = doc.get('videos', [])
-
-            # Store document info in document_map
-            self.document_map[str(doc_id + 1)] = { # Use 1-based indexing for doc_id
-                'url': url,
-                'images': images,
-                'videos': videos
-            }
-
-            # Process text content for inverted index
-            words = self._tokenize(text_content)
-            for word in words:
-                self.inverted_index[word].append(str(doc_id + 1)) # Store doc_id as string
-
-        self._save_index()
-        print("Inverted index and document map built.")
-        print(f"Saved inverted index to {os.path.join(self.output_dir, 'inverted_index.json')}")
-        print(f"Saved document map (with media info) to {os.path.join(self.output_dir, 'inverted_index_doc_map.json')}")
+        print(f"Indexing {len(records)} documents from {self.documents_file} with {max(self.workers, 1)} tokenizer process(es)")
+        self.doc_ranks = read_doc_ranks(self.ranks_file)
+        if self.doc_ranks:
+            print(f"Using the static scores of {len(self.doc_ranks)} pages from {self.ranks_file}")
+        self.run_dir = tempfile.mkdtemp(prefix="runs-", dir=self.output_dir)
+        self.documents = documents_writer(self.output_dir, self.segment_name)
+        try:
+            self._tokenize_documents(records)
+            self._save_index()
+        finally:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        self._commit(source_offset)
+        remove_shards(self.output_dir) # Replaces a sharded index built here before
+        print("Inverted index and document store built.")
+        print(f"Saved inverted index to {self.index_file}")
+        if self.store_positions:
+            print(f"Saved word positions to {positions_path(self.index_file)}")
+        print(f"Saved spelling index to {spelling_path(self.index_file)}")
+        print(f"Saved completion index to {completions_path(self.index_file)}")
+        print(f"Saved documents (with media info) to {segment_file(self.output_dir, self.segment_name, '.docs')}")
+        print(f"Committed index generation {self.manifest['generation']}")
         print("Indexing complete.")
 
-    def _load_documents(self):
+    def _commit(self, source_offset):
+        """Makes the new segment the whole index; running SearchEngines switch to it on their next reload check."""
+        previous = read_manifest(self.output_dir)
+        doc_count = self.documents.count
+        self.manifest.update({
+            'generation': previous['generation'] + 1,
+            'next_doc_id': doc_count + 1,
+            'segments': [new_segment_info(self.segment_name, 0, doc_count, doc_count)],
+            'sources': {},
+            'analyzer': self.analyzer.config(),
+        })
+        if source_offset is not None:
+            self.manifest['sources'][os.path.abspath(self.documents_file)] = source_state(self.documents_file, source_offset)
+        write_manifest(self.output_dir, self.manifest, previous)
+
+    def _commit_empty(self, source_offset=None):
+        """Commits an index without documents, replacing whatever output_dir held."""
+        previous = read_manifest(self.output_dir)
+        self.manifest.update({
+            'generation': previous['generation'] + 1,
+            'segments': [],
+            'sources': {},
+            'analyzer': self.analyzer.config(),
+        })
+        if source_offset is not None:
+            self.manifest['sources'][os.path.abspath(self.documents_file)] = source_state(self.documents_file, source_offset)
+        write_manifest(self.output_dir, self.manifest, previous)
+
+    def _build_shards(self, records):
+        """
+        Indexes each shard's documents into its own directory, then commits them all together. Every shard
+        reads documents_file once, keeping only its own records.
+        """
+        parts = [{} for _ in range(self.shards)]
+        for i, url in records.items():
+            parts[shard_of(url, self.shards)][i] = url
+        names = [shard_name(shard) for shard in range(self.shards)]
+        for shard, (name, part) in enumerate(zip(names, parts)):
+            print(f"Shard {shard + 1} of {self.shards}: {len(part)} documents")
+            indexer = Indexer(self.documents_file, os.path.join(self.output_dir, name), self.store_positions, self.workers,
+                              self.memory_budget_mb, self.batch_size, analyzer=self.analyzer, ranks_file=self.ranks_file)
+            if part:
+                indexer.build_index(part)
+            else:
+                indexer._commit_empty() # Otherwise the shard would keep serving what an earlier build left in it
+        write_shards(self.output_dir, names)
+        print(f"Committed {self.shards} shards in {self.output_dir}")
+
+    def _latest_records(self):
+        """
+        Positions (in documents_file) of the records to index, mapped to their URLs. Accepts the crawler's
+        documents.jsonl(.gz) as well as an older documents.json. Incremental crawls append new versions of pages,
+        so the last record for a URL wins and a {'url': ..., 'deleted': True} record removes the page. Only URLs
+        are held, not documents.
+        """
         if not os.path.exists(self.documents_file):
             print(f"Error: {self.documents_file} not found.")
             return None
-        with open(self.documents_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        latest = {}
+        for i, document in enumerate(read_documents(self.documents_file)):
+            latest[document['url']] = None if document.get('deleted') else i
+        return {i: url for url, i in latest.items() if i is not None}
 
-    def _tokenize(self, text):
-        # Convert to lowercase and remove non-alphanumeric characters, then split
-        text = text.lower()
-        words = re.findall(r'\b\w+\b', text)
-        return words
+    def _batches(self, records):
+        """Streams the documents at the given record positions, numbering them and adding them to the document store."""
+        batch = []
+        doc_id = 0
+        for i, doc in enumerate(read_documents(self.documents_file)):
+            if i not in records:
+                continue
+            doc_id += 1
+            # Store document info in the document store
+            self.documents.add(doc_id, document_info(doc)) # Use 1-based indexing for doc_id
+            self.doc_lengths.append(0) # Set once the document is tokenized
+            self.doc_flags.append(document_flags(doc))
+            self.doc_rank_bytes.append(doc_rank(self.doc_ranks, doc['url']))
+            batch.append((doc_id, doc.get('text_content', '')))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _pool(self, **kwargs):
+        return ProcessPoolExecutor(max_workers=self.workers, **kwargs) if self.workers > 1 else None
+
+    def _tokenize_documents(self, records):
+        pool = self._pool()
+        try:
+            # Batches come back in doc_id order, so each term's postings are appended in doc_id order
+            tokenize = partial(tokenize_batch, store_positions=self.store_positions, analyzer=self.analyzer)
+            for lengths, postings in _map_in_order(pool, tokenize, self._batches(records), 2 * max(self.workers, 1)):
+                self._add_batch(lengths, postings)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _add_batch(self, lengths, postings):
+        for doc_id, length in lengths:
+            self.doc_lengths[doc_id] = length
+        self.documents_tokenized += len(lengths)
+        for term, entries in postings.items():
+            self.buffer[term].extend(entries)
+            self.buffer_bytes += POSTING_BYTES * len(entries)
+            if self.store_positions:
+                self.buffer_bytes += POSITION_BYTES * sum(tf for _, tf, _ in entries)
+        if self.buffer_bytes >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        path = os.path.join(self.run_dir, f"run{len(self.runs):05d}")
+        _write_run(path, self.buffer)
+        self.runs.append(path)
+        print(f"Wrote run {len(self.runs)} ({len(self.buffer)} terms) after {self.documents_tokenized} documents")
+        self.buffer = defaultdict(list)
+        self.buffer_bytes = 0
 
     def _save_index(self):
-        # Convert defaultdict to dict for JSON serialization
-        inverted_index_dict = {k: sorted(list(set(v))) for k, v in self.inverted_index.items()}
-        
-        with open(os.path.join(self.output_dir, "inverted_index.json"), 'w', encoding='utf-8') as f:
-            json.dump(inverted_index_dict, f, ensure_ascii=False, indent=2)
+        # Every run is sorted by term and covers a later range of doc ids than the one before it, so a k-way
+        # merge by term (stable, so earlier runs come first) yields each term's postings already in doc_id order
+        runs = [_read_run(path) for path in self.runs]
+        if self.buffer:
+            buffered = self.buffer
+            runs.append((term, buffered[term]) for term in sorted(buffered, key=term_sort_key))
+        merged = heapq.merge(*runs, key=lambda record: term_sort_key(record[0]))
+
+        terms = ((term, [entry for _, run_entries in records for entry in run_entries])
+                 for term, records in groupby(merged, key=lambda record: record[0]))
+
+        # Binary index (see index_format.py): sorted term dictionary, varint-encoded (doc id gap, tf) postings,
+        # doc lengths and the corpus statistics BM25 needs. The merge runs here; encoding the postings, which
+        # costs far more, runs in the pool, and the encoded terms are written in order as they come back.
+        doc_lengths = array('I', self.doc_lengths)
+        writer = IndexWriter(self.index_file, doc_lengths, store_positions=self.store_positions, doc_flags=self.doc_flags,
+                             doc_ranks=self.doc_rank_bytes)
+        pool = self._pool(initializer=_init_encoder, initargs=(doc_lengths, self.store_positions))
+        if pool is None:
+            _init_encoder(doc_lengths, self.store_positions)
+        try:
+            for encoded_terms in _map_in_order(pool, encode_terms, _chunk_terms(terms), 2 * max(self.workers, 1)):
+                for term, encoded_term in encoded_terms:
+                    writer.add_encoded_term(term, encoded_term)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        writer.close()
+        self.buffer = defaultdict(list)
 
-        with open(os.path.join(self.output_dir, "inverted_index_doc_map.json"), 'w', encoding='utf-8') as f:
-            json.dump(self.document_map, f, ensure_ascii=False, indent=2)
+        self.documents.close()
 
 if __name__ == "__main__":
     indexer = Indexer()
-    indexer.build_index()
\ No newline at end of file
+    indexer.build_index()
@@ -0,0 +1,152 @@
+import json
+import os
+import sys
+import time
+from document_sink import read_documents
+from frontier import normalize_url
+from index_format import MAX_DOC_RANK
+
+try:
+    import numpy as np
+except ImportError: # Only computing PageRank needs NumPy; reading the result (as Indexer does) does not
+    np = None
+
+# Offline PageRank over the link graph the crawler records (crawled_data/links.jsonl, or links.jsonl.gz with
+# compress_output, one {'url', 'links'} record per page written). Run it after a crawl and before indexing:
+#   python pagerank.py [links file, default whichever of those exists] [ranks file]
+# It writes a static score per page to pagerank.json next to the links; Indexer and IndexUpdater store that
+# score with every document (a byte per document in the index file, see index_format.py), and SearchEngine
+# adds it to the text score of each match, so ranking by it costs a lookup per scored document.
+#
+# Only links between crawled pages count: the graph holds the pages we can return as results. Links to a
+# page count once per linking page, and links to itself not at all. The link matrix is kept in CSR form
+# (compressed sparse rows, here one row per page listing the pages that link to it), so that every power
+# iteration is a handful of vectorized NumPy operations over all links at once.
+RANKS_FILE = "pagerank.json"
+LINKS_FILE = "crawled_data/links.jsonl"
+DAMPING = 0.85 # Probability that the random surfer follows a link rather than jumping to a random page
+TOLERANCE = 1e-6 # Stop once an iteration changes the ranks by less than this in total (L1 norm)
+MAX_ITERATIONS = 100
+
+def ranks_path(documents_file):
+    """Where pagerank.py writes the ranks for the pages in documents_file: next to it, e.g. crawled_data/pagerank.json."""
+    return os.path.join(os.path.dirname(documents_file), RANKS_FILE)
+
+def default_links_file():
+    """The crawler's links file: LINKS_FILE, or its .gz version if only that exists (a crawl with compress_output)."""
+    if not os.path.exists(LINKS_FILE) and os.path.exists(LINKS_FILE + '.gz'):
+        return LINKS_FILE + '.gz'
+    return LINKS_FILE
+
+def read_link_graph(links_file):
+    """
+    (urls, sources, targets): the crawled pages, and one (source, target) pair of indexes into urls per
+    distinct link between two of them. The last record for a URL wins; a deleted record removes the page.
+    """
+    latest = {} # Normalized URL -> (URL as crawled, its links)
+    for record in read_documents(links_file):
+        key = normalize_url(record['url'])
+        latest.pop(key, None) # Keep pages in the order of their latest record
+        if not record.get('deleted'):
+            latest[key] = (record['url'], record.get('links', []))
+    page_ids = {key: i for i, key in enumerate(latest)}
+    urls = []
+    sources, targets = [], []
+    for source, (url, links) in enumerate(latest.values()):
+        urls.append(url)
+        linked = {page_ids.get(normalize_url(link)) for link in links}
+        linked.discard(None)
+        linked.discard(source)
+        sources.extend([source] * len(linked))
+        targets.extend(sorted(linked))
+    return urls, np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+
+def link_matrix(page_count, sources, targets):
+    """
+    The link graph in CSR form, row by target page: (indptr, indices, out_degrees), where the pages linking
+    to page t are indices[indptr[t]:indptr[t + 1]].
+    """
+    order = np.lexsort((sources, targets))
+    indices = sources[order]
+    indptr = np.zeros(page_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=page_count), out=indptr[1:])
+    out_degrees = np.bincount(sources, minlength=page_count)
+    return indptr, indices, out_degrees
+
+def pagerank(indptr, indices, out_degrees, damping=DAMPING, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """
+    PageRank by power iteration: (ranks summing to 1, iterations run, change in the last iteration). Pages
+    without outlinks spread their rank over every page, as if the surfer jumped.
+    """
+    page_count = len(out_degrees)
+    if not page_count:
+        return np.zeros(0), 0, 0.0
+    ranks = np.full(page_count, 1.0 / page_count)
+    dangling = out_degrees == 0
+    inverse_out_degrees = np.where(dangling, 0.0, 1.0 / np.maximum(out_degrees, 1))
+    rows = np.repeat(np.arange(page_count), np.diff(indptr)) # The target of each entry of indices
+    iterations, change = 0, 0.0
+    for iterations in range(1, max_iterations + 1):
+        # Each page passes its rank on in equal shares over its links; summing the shares arriving at each
+        # page is the sparse matrix-vector product
+        shares = (ranks * inverse_out_degrees)[indices]
+        new_ranks = np.bincount(rows, weights=shares, minlength=page_count)
+        new_ranks = damping * (new_ranks + ranks[dangling].sum() / page_count) + (1 - damping) / page_count
+        change = float(np.abs(new_ranks - ranks).sum())
+        ranks = new_ranks
+        if change < tolerance:
+            break
+    return ranks, iterations, change
+
+def static_scores(ranks):
+    """
+    Ranks as scores from 0 to 1. PageRank is heavy-tailed, so it is compared on a log scale relative to the
+    average page; otherwise a handful of hub pages would get all the weight.
+    """
+    if not len(ranks):
+        return ranks
+    scores = np.log1p(ranks * len(ranks))
+    return scores / scores.max()
+
+def write_ranks(path, urls, scores, iterations, change):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'damping': DAMPING,
+            'iterations': iterations,
+            'change': change,
+            'scores': {url: round(float(score), 6) for url, score in zip(urls, scores)},
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def read_doc_ranks(path):
+    """{normalized URL: static score from 0 to 1} from a ranks file, or {} if there is none."""
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {normalize_url(url): score for url, score in json.load(f)['scores'].items()}
+
+def doc_rank(doc_ranks, url):
+    """The byte the index stores for url's static score (0 for pages without one)."""
+    score = doc_ranks.get(normalize_url(url)) if doc_ranks else None
+    return min(max(round(score * MAX_DOC_RANK), 0), MAX_DOC_RANK) if score is not None else 0
+
+if __name__ == "__main__":
+    links_file = sys.argv[1] if len(sys.argv) > 1 else default_links_file()
+    output = sys.argv[2] if len(sys.argv) > 2 else ranks_path(links_file)
+    if np is None:
+        print("pagerank.py needs NumPy: pip install numpy")
+        sys.exit(1)
+    if not os.path.exists(links_file):
+        print(f"Error: {links_file} not found. Crawl with crawler.py first.")
+        sys.exit(1)
+    start = time.perf_counter()
+    urls, sources, targets = read_link_graph(links_file)
+    indptr, indices, out_degrees = link_matrix(len(urls), sources, targets)
+    ranks, iterations, change = pagerank(indptr, indices, out_degrees)
+    write_ranks(output, urls, static_scores(ranks), iterations, change)
+    print(f"PageRank of {len(urls)} pages over {len(indices)} links: {iterations} iterations, "
+          f"last change {change:.2e}, {time.perf_counter() - start:.2f}s")
+    for i in np.argsort(-ranks)[:10]:
+        print(f"  {ranks[i] * len(urls):8.2f}x average  {urls[i]}")
+    print(f"Saved static scores to {output}; rebuild the index with indexer.py to use them")
@@ -0,0 +1,445 @@
+import re
+from index_format import END
+
+# Query syntax:
+#   rust cargo            either word (ranked; the same as before)
+#   rust AND cargo        both words
+#   rust NOT java         rust, but not pages that also mention java
+#   "borrow checker"      the exact phrase
+#   unsafe NEAR/3 block   both words, at most 3 words apart in either order
+#   (rust OR go) AND "memory safety"
+#   pyth*                 words starting with pyth (see expand_prefixes())
+# AND, OR, NOT and NEAR/n are only operators in upper case. NEAR binds tightest, then AND/NOT, then OR.
+TOKEN_PATTERN = re.compile(r'"([^"]*)"?|\(|\)|NEAR/(\d+)|[^\s()"]+')
+PREFIX_PATTERN = re.compile(r'(\w+)\*')
+MAX_NESTING = 32 # Most parentheses open at once; the parser recurses once per level
+
+class QuerySyntaxError(ValueError):
+    pass
+
+class Term:
+    def __init__(self, word):
+        self.word = word
+
+class Phrase:
+    def __init__(self, words, offsets=None):
+        self.words = words
+        # Position of each word relative to the first: stopwords left out of a phrase still leave their gap
+        self.offsets = list(range(len(words))) if offsets is None else offsets
+
+class Near:
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+class AndNot:
+    def __init__(self, positive, negative):
+        self.positive = positive
+        self.negative = negative
+
+def _word_node(terms):
+    # A single query word can analyze into several index terms (e.g. "don't"), which must then be adjacent
+    if not terms:
+        return None # Only stopwords
+    if len(terms) == 1:
+        return Term(terms[0][0])
+    first = terms[0][1]
+    return Phrase([term for term, _ in terms], [position - first for _, position in terms])
+
+class _Parser:
+    def __init__(self, query, analyze):
+        self.analyze = analyze
+        self.tokens = []
+        for match in TOKEN_PATTERN.finditer(query):
+            text = match.group(0)
+            if text.startswith('"'):
+                self.tokens.append(('phrase', match.group(1)))
+            elif match.group(2) is not None:
+                self.tokens.append(('near', int(match.group(2))))
+            elif text in ('(', ')', 'AND', 'OR', 'NOT'):
+                self.tokens.append((text, None))
+            else:
+                self.tokens.append(('word', text))
+        self.pos = 0
+        self.depth = 0 # Parentheses open at the current token
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"Unexpected {self.peek()!r}")
+        return node
+
+    def parse_or(self):
+        children = []
+        while self.peek() not in (None, ')'):
+            if self.peek() == 'OR':
+                self.take()
+                continue
+            node = self.parse_and()
+            if node is not None:
+                children.append(node)
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        node = self.parse_near()
+        while self.peek() in ('AND', 'NOT'):
+            operator = self.take()[0]
+            if self.peek() in (None, ')', 'OR', 'AND', 'NOT'):
+                raise QuerySyntaxError(f"{operator} needs something after it")
+            right = self.parse_near()
+            if node is None:
+                if operator == 'NOT':
+                    # Listing every document that lacks a word is never what a search box wants
+                    raise QuerySyntaxError("NOT needs something to exclude from")
+                node = right
+            elif right is not None:
+                node = And([node, right]) if operator == 'AND' else AndNot(node, right)
+        return node
+
+    def parse_near(self):
+        node = self.parse_primary()
+        while self.peek() == 'near':
+            distance = self.take()[1]
+            right = self.parse_primary()
+            if node is None or right is None:
+                node = node or right
+            else:
+                node = Near(node, right, distance)
+        return node
+
+    def parse_primary(self):
+        kind = self.peek()
+        if kind == '(':
+            self.take()
+            if self.depth == MAX_NESTING:
+                raise QuerySyntaxError(f"More than {MAX_NESTING} nested parentheses")
+            self.depth += 1
+            node = self.parse_or()
+            self.depth -= 1
+            if self.peek() == ')':
+                self.take()
+            return node # A missing ')' is forgiven
+        if kind in ('phrase', 'word'):
+            return _word_node(self.analyze(self.take()[1]))
+        raise QuerySyntaxError(f"Unexpected {kind!r}")
+
+def _prefix_tokens(query):
+    """(match, prefix) for each word of query ending in * (not inside a phrase)."""
+    for match in TOKEN_PATTERN.finditer(query):
+        prefix = PREFIX_PATTERN.fullmatch(match.group(0))
+        if prefix is not None:
+            yield match, prefix.group(1).lower()
+
+def query_prefixes(query):
+    """The prefixes of the prefix words (pyth*) in query."""
+    return [prefix for _, prefix in _prefix_tokens(query)]
+
+def expand_prefixes(query, complete):
+    """
+    query with each prefix word (pyth*) replaced by an OR of complete(prefix), the terms it stands for (those
+    starting with the prefix, see SearchEngine.prefix_terms()), so that it parses into ordinary terms:
+    pyth* AND web becomes (python OR pythonic) AND web. A prefix without completions is searched as a plain word.
+    """
+    parts = []
+    end = 0
+    for match, prefix in _prefix_tokens(query):
+        terms = complete(prefix)
+        parts.append(query[end:match.start()])
+        parts.append('(' + ' OR '.join(terms) + ')' if terms else prefix)
+        end = match.end()
+    parts.append(query[end:])
+    return ''.join(parts)
+
+def parse_query(query, analyze):
+    """
+    Parses query into a tree of Term/Phrase/Near/And/Or/AndNot nodes (None if it has no words). analyze(text)
+    turns text into [(term, position), ...], like Analyzer.positions().
+    """
+    return _Parser(query, analyze).parse()
+
+def plain_words(node):
+    """The words of a query that is just words (to be OR-ed and ranked), or None if it uses any operator."""
+    if isinstance(node, Term):
+        return [node.word]
+    if isinstance(node, Or):
+        words = []
+        for child in node.children:
+            child_words = plain_words(child)
+            if child_words is None:
+                return None
+            words.extend(child_words)
+        return words
+    return None
+
+def query_words(node):
+    """Every word a parsed query looks up, negated ones included."""
+    if isinstance(node, Term):
+        return [node.word]
+    if isinstance(node, Phrase):
+        return list(node.words)
+    if isinstance(node, Near):
+        return query_words(node.left) + query_words(node.right)
+    if isinstance(node, (And, Or)):
+        return [word for child in node.children for word in query_words(child)]
+    if isinstance(node, AndNot):
+        return query_words(node.positive) + query_words(node.negative)
+    return []
+
+def query_key(node):
+    """A hashable form of a parsed query: queries that differ only in spacing, case of words or redundant parentheses get the same key."""
+    if isinstance(node, Term):
+        return node.word
+    if isinstance(node, Phrase):
+        return ('"', tuple(node.words), tuple(node.offsets))
+    if isinstance(node, Near):
+        return ('NEAR', node.distance, query_key(node.left), query_key(node.right))
+    if isinstance(node, And):
+        return ('AND',) + tuple(query_key(child) for child in node.children)
+    if isinstance(node, Or):
+        return ('OR',) + tuple(query_key(child) for child in node.children)
+    if isinstance(node, AndNot):
+        return ('NOT', query_key(node.positive), query_key(node.negative))
+    raise TypeError(f"Unknown query node {node!r}")
+
+# Matchers walk sorted postings document-at-a-time. Like PostingsCursor, each has a current doc (END when
+# exhausted), next() and next_geq(target); positional ones also have positions() for the current doc.
+
+class EmptyMatcher:
+    doc = END
+    cost = 0
+
+    def next(self):
+        pass
+
+    def next_geq(self, target):
+        pass
+
+class AndMatcher:
+    """Documents matched by every child, found by leapfrogging: each child skips straight to the others' doc."""
+    def __init__(self, children):
+        self.children = sorted(children, key=_cost) # Rarest first, so its doc ids drive the skipping
+        self.cost = _cost(self.children[0])
+        self._align(0)
+
+    def _align(self, target):
+        agreed = 0
+        i = 0
+        while agreed < len(self.children):
+            child = self.children[i]
+            child.next_geq(target)
+            if child.doc == END:
+                self.doc = END
+                return
+            if child.doc == target:
+                agreed += 1
+            else:
+                target = child.doc
+                agreed = 1
+            i = (i + 1) % len(self.children)
+        self.doc = target
+
+    def next(self):
+        if self.doc != END:
+            self.children[0].next()
+            self._align(self.children[0].doc)
+
+    def next_geq(self, target):
+        if self.doc < target:
+            self._align(target)
+
+    def positions(self):
+        return sorted(set().union(*(child.positions() for child in self.children)))
+
+class OrMatcher:
+    def __init__(self, children):
+        self.children = children
+        self.cost = sum(_cost(child) for child in children)
+        self.doc = min(child.doc for child in children)
+
+    def next(self):
+        for child in self.children:
+            if child.doc == self.doc:
+                child.next()
+        self.doc = min(child.doc for child in self.children)
+
+    def next_geq(self, target):
+        if self.doc < target:
+            for child in self.children:
+                child.next_geq(target)
+            self.doc = min(child.doc for child in self.children)
+
+    def positions(self):
+        return sorted(set().union(*(child.positions() for child in self.children if child.doc == self.doc)))
+
+class AndNotMatcher:
+    def __init__(self, positive, negative):
+        self.positive = positive
+        self.negative = negative
+        self.cost = _cost(positive)
+        self._settle()
+
+    def _settle(self):
+        while self.positive.doc != END:
+            self.negative.next_geq(self.positive.doc)
+            if self.negative.doc != self.positive.doc:
+                break
+            self.positive.next()
+        self.doc = self.positive.doc
+
+    def next(self):
+        self.positive.next()
+        self._settle()
+
+    def next_geq(self, target):
+        self.positive.next_geq(target)
+        self._settle()
+
+    def positions(self):
+        return self.positive.positions()
+
+class _PositionalMatcher:
+    """Documents where all parts appear (an AndMatcher) and _matches() accepts their positions."""
+    def __init__(self, parts):
+        self.parts = parts
+        self.all_parts = AndMatcher(parts)
+        self.cost = self.all_parts.cost
+        self._settle()
+
+    def _settle(self):
+        while self.all_parts.doc != END and not self._matches():
+            self.all_parts.next()
+        self.doc = self.all_parts.doc
+
+    def next(self):
+        self.all_parts.next()
+        self._settle()
+
+    def next_geq(self, target):
+        if self.doc < target:
+            self.all_parts.next_geq(target)
+            self._settle()
+
+class PhraseMatcher(_PositionalMatcher):
+    def __init__(self, cursors, offsets):
+        self.offsets = offsets
+        self.length = offsets[-1] + 1
+        super().__init__(cursors)
+
+    def _matches(self):
+        self._starts = self._phrase_starts()
+        return bool(self._starts)
+
+    def _phrase_starts(self):
+        # The phrase starts at p when word i is at p + offsets[i] for every i
+        starts = set(self.parts[0].positions())
+        for offset, cursor in zip(self.offsets[1:], self.parts[1:]):
+            starts.intersection_update(position - offset for position in cursor.positions())
+            if not starts:
+                break
+        return starts
+
+    def positions(self):
+        return sorted(self._starts)
+
+class NearMatcher(_PositionalMatcher):
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+        self.length = 1
+        super().__init__([left, right])
+
+    def _matches(self):
+        # Merge the two sorted position lists, checking the gap between each pair of neighbouring occurrences
+        left_positions = self.left.positions()
+        right_positions = self.right.positions()
+        left_length = getattr(self.left, 'length', 1)
+        right_length = getattr(self.right, 'length', 1)
+        i = j = 0
+        while i < len(left_positions) and j < len(right_positions):
+            left, right = left_positions[i], right_positions[j]
+            if left <= right:
+                if right - (left + left_length) < self.distance:
+                    return True
+                i += 1
+            else:
+                if left - (right + right_length) < self.distance:
+                    return True
+                j += 1
+        return False
+
+    def positions(self):
+        return sorted(set(self.left.positions()) | set(self.right.positions()))
+
+def _cost(matcher):
+    return matcher.df if hasattr(matcher, 'df') else matcher.cost
+
+def build_matcher(node, index):
+    """
+    Turns a parsed query into a matcher over index. Returns (matcher, words) where words are the ones that
+    count towards a document's score (words only under NOT don't), each once. The matcher's own cursors must
+    not score them: a branch that cannot match may have skipped a cursor past a document matched by another.
+    """
+    scoring = []
+
+    def build(node, negated):
+        if isinstance(node, Term):
+            cursor = index.cursor(node.word)
+            if cursor is None:
+                return EmptyMatcher()
+            if not negated and node.word not in scoring:
+                scoring.append(node.word)
+            return cursor
+        if isinstance(node, Phrase):
+            cursors = [build(Term(word), negated) for word in node.words]
+            if any(isinstance(cursor, EmptyMatcher) for cursor in cursors):
+                return EmptyMatcher()
+            if not index.has_positions:
+                return AndMatcher(cursors) # Best effort without positions: all the words, anywhere
+            return PhraseMatcher(cursors, node.offsets)
+        if isinstance(node, Near):
+            left, right = build(node.left, negated), build(node.right, negated)
+            if isinstance(left, EmptyMatcher) or isinstance(right, EmptyMatcher):
+                return EmptyMatcher()
+            if not index.has_positions:
+                return AndMatcher([left, right])
+            return NearMatcher(left, right, node.distance)
+        if isinstance(node, And):
+            children = [build(child, negated) for child in node.children]
+            if any(isinstance(child, EmptyMatcher) for child in children):
+                return EmptyMatcher()
+            return AndMatcher(children)
+        if isinstance(node, Or):
+            children = [child for child in (build(child, negated) for child in node.children)
+                        if not isinstance(child, EmptyMatcher)]
+            if not children:
+                return EmptyMatcher()
+            return children[0] if len(children) == 1 else OrMatcher(children)
+        if isinstance(node, AndNot):
+            positive = build(node.positive, negated)
+            negative = build(node.negative, not negated)
+            if isinstance(positive, EmptyMatcher) or isinstance(negative, EmptyMatcher):
+                return positive
+            return AndNotMatcher(positive, negative)
+        raise TypeError(f"Unknown query node {node!r}")
+
+    return build(node, False), scoring
@@ -0,0 +1,156 @@
+import re
+import time
+from urllib.parse import urljoin, urlparse
+
+DISALLOW_ALL = "User-agent: *\nDisallow: /"
+
+def _parse_groups(robots_txt):
+    """Splits robots.txt into [(user_agents, [(field, value), ...]), ...] groups."""
+    groups = []
+    agents, rules = [], []
+    for line in robots_txt.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        field, value = line.split(':', 1)
+        field, value = field.strip().lower(), value.strip()
+        if field == 'user-agent':
+            if rules: # A user-agent line after rules starts a new group
+                groups.append((agents, rules))
+                agents, rules = [], []
+            agents.append(value.lower())
+        elif field in ('allow', 'disallow', 'crawl-delay') and agents:
+            rules.append((field, value))
+    if agents:
+        groups.append((agents, rules))
+    return groups
+
+class RobotsRules:
+    """
+    The robots.txt rules that apply to one user agent, compiled once so that checking a URL is cheap.
+
+    Follows RFC 9309: the longest matching Allow/Disallow pattern wins, Allow wins a tie, '*' matches any
+    characters and a trailing '$' anchors the end. Plain prefix patterns (the vast majority) live in a
+    character trie, so a check walks the path once instead of re-reading the whole file.
+    """
+    def __init__(self, rules=(), crawl_delay=None):
+        self.crawl_delay = crawl_delay # Seconds between requests the site asks for, or None
+        self._trie = {} # char -> child node; key None holds the (pattern length, allowed) of a pattern ending here
+        self._exact = {} # path -> (pattern length, allowed) for '...$' patterns without '*'
+        self._wildcards = [] # (pattern length, allowed, compiled regex), longest first
+        for allowed, pattern in rules:
+            self._add(pattern, allowed)
+        self._wildcards.sort(key=lambda rule: rule[0], reverse=True)
+
+    @classmethod
+    def parse(cls, robots_txt, user_agent='*'):
+        """Compiles the groups of robots_txt that apply to user_agent (or the '*' groups if none do)."""
+        user_agent = user_agent.lower()
+        groups = _parse_groups(robots_txt)
+        matching = [rules for agents, rules in groups if any(agent != '*' and user_agent in agent for agent in agents)]
+        if not matching:
+            matching = [rules for agents, rules in groups if '*' in agents]
+
+        rules, crawl_delay = [], None
+        for group in matching:
+            for field, value in group:
+                if field == 'crawl-delay':
+                    try:
+                        crawl_delay = float(value)
+                    except ValueError:
+                        pass
+                elif value: # An empty Disallow means "allow everything" and matches nothing
+                    rules.append((field == 'allow', value))
+        return cls(rules, crawl_delay)
+
+    def _add(self, pattern, allowed):
+        verdict = (len(pattern), allowed)
+        if '*' in pattern:
+            regex = '.*'.join(re.escape(part) for part in pattern.rstrip('$').split('*'))
+            if pattern.endswith('$'):
+                regex += r'\Z'
+            self._wildcards.append((len(pattern), allowed, re.compile(regex)))
+        elif pattern.endswith('$'):
+            path = pattern[:-1]
+            self._exact[path] = max(self._exact.get(path, verdict), verdict)
+        else:
+            node = self._trie
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[None] = max(node.get(None, verdict), verdict) # (same length, True) beats (same length, False)
+
+    def can_fetch(self, path):
+        """path is the URL path plus query string, e.g. '/search?q=x'."""
+        if path == '/robots.txt':
+            return True
+
+        best = (0, True) # No matching rule means allowed
+        node = self._trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                best = max(best, node[None])
+        if path in self._exact:
+            best = max(best, self._exact[path])
+        for length, allowed, regex in self._wildcards:
+            if length < best[0]:
+                break # Sorted longest first: nothing left can beat the current match
+            if regex.match(path):
+                best = max(best, (length, allowed))
+        return best[1]
+
+class RobotsCache:
+    """
+    Per-host RobotsRules, fetched on first use and re-fetched after ttl_seconds.
+    fetch(url) must return an object with status_code and text (e.g. a requests.Response).
+    """
+    def __init__(self, fetch, user_agent='*', ttl_seconds=24 * 60 * 60):
+        self.fetch = fetch
+        self.user_agent = user_agent
+        self.ttl_seconds = ttl_seconds
+        self.entries = {} # base_url -> (robots.txt text, fetched_at, RobotsRules)
+
+    def _base_url(self, url):
+        parsed_url = urlparse(url)
+        return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+    def _download(self, base_url):
+        try:
+            response = self.fetch(urljoin(base_url, "/robots.txt"))
+        except Exception as e:
+            print(f"Could not fetch robots.txt for {base_url}: {e}")
+            return "" # Assume allowed, as before
+        if response.status_code >= 500:
+            return DISALLOW_ALL # Server trouble: RFC 9309 says to treat the site as fully disallowed for now
+        if response.status_code >= 400:
+            return "" # No robots.txt
+        return response.text
+
+    def rules_for(self, url):
+        base_url = self._base_url(url)
+        entry = self.entries.get(base_url)
+        if entry is None or time.time() - entry[1] > self.ttl_seconds:
+            self.add(base_url, self._download(base_url), time.time())
+            entry = self.entries[base_url]
+        return entry[2]
+
+    def add(self, base_url, robots_txt, fetched_at):
+        self.entries[base_url] = (robots_txt, fetched_at, RobotsRules.parse(robots_txt, self.user_agent))
+
+    def can_fetch(self, url):
+        parsed_url = urlparse(url)
+        path = parsed_url.path or '/'
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+        return self.rules_for(url).can_fetch(path)
+
+    def crawl_delay(self, url):
+        """Crawl-delay for url's host if it is already known, else None (never triggers a fetch)."""
+        entry = self.entries.get(self._base_url(url))
+        return entry[2].crawl_delay if entry else None
+
+    def export(self):
+        """{base_url: (robots.txt text, fetched_at)}, for checkpoints."""
+        return {base_url: (text, fetched_at) for base_url, (text, fetched_at, _) in self.entries.items()}
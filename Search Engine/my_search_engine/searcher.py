@@ -1,45 +1,626 @@
-import json
+import heapq
 import os
-import re
-from collections import defaultdict
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from analyzer import manifest_analyzer
+from index_format import DOC_HAS_IMAGES, DOC_HAS_VIDEOS, END, MAX_DOC_RANK, bm25_idf
+from completions import TOP_COMPLETIONS
+from query_parser import (QuerySyntaxError, build_matcher, expand_prefixes, parse_query, plain_words, query_key,
+                          query_prefixes, query_words)
+from segments import MANIFEST_FILE, open_segments, read_manifest
+from spelling import choose_corrections, correct_query, max_distance_for, words_to_check
+
+# Doc flags a result must have for each media filter (see index_format.py)
+MEDIA_FLAGS = {None: 0, 'images': DOC_HAS_IMAGES, 'videos': DOC_HAS_VIDEOS}
+# What the highest static score (see pagerank.py) adds to a document's BM25 score
+RANK_WEIGHT = 1.0
+# Most terms a prefix (pyth*) stands for: the most frequent ones starting with it. Beyond that, documents
+# whose only match is a rarer term with the prefix are missed, and truncated_prefixes() names the prefix.
+MAX_PREFIX_TERMS = 200
+PREFIX_CACHE_SIZE = 1024 # Prefix expansions kept per index generation
+
+class CorpusStats:
+    """
+    The corpus-wide statistics BM25 scores with. Normally those of the snapshot being searched; a shard of a
+    sharded index (see shards.py) is searched with the statistics of all shards together instead, so that
+    scores from different shards can be compared.
+    """
+    def __init__(self, doc_count, indexed, total_tokens, dfs=None):
+        self.doc_count = doc_count # Live documents
+        self.indexed = indexed # Documents in the postings, including deleted ones a merge has not dropped yet
+        self.total_tokens = total_tokens
+        self.avg_doc_length = total_tokens / indexed if indexed else 0.0
+        self.dfs = dfs # word -> document frequency over the corpus, or None to use the snapshot's own
+
+    def idf(self, word, df):
+        """idf of word, given its document frequency in the snapshot being searched."""
+        if self.dfs is not None:
+            df = self.dfs.get(word, df)
+        # df can include not yet merged deleted documents, so it may exceed the live document count
+        return bm25_idf(max(self.doc_count, df), df)
+
+    def key(self):
+        """Tells cached results computed with other statistics apart."""
+        return (self.doc_count, self.indexed, self.total_tokens)
+
+class IndexSnapshot:
+    """One committed generation of a segmented index (see segments.py), with the corpus-wide statistics BM25 needs."""
+    def __init__(self, index_dir, manifest, previous=None):
+        self.generation = manifest['generation']
+        self.segments = open_segments(index_dir, manifest, previous.segments if previous is not None else ())
+        self.max_doc_ids = [info['max_doc_id'] for info in manifest['segments']]
+        self.prefix_expansions = {} # prefix -> what SearchEngine.prefix_terms() gives for it on this generation
+        self.analyzer = manifest_analyzer(manifest) # Queries are analyzed the way the index was
+        self.doc_count = sum(segment.live_doc_count for segment in self.segments)
+        # Deleted documents still count towards the average length until a merge drops them
+        self.stats = CorpusStats(self.doc_count,
+                                 sum(segment.index.doc_count for segment in self.segments),
+                                 sum(segment.index.total_tokens for segment in self.segments))
+
+    def document(self, doc_id):
+        """{url, images, videos} of a live document, or None."""
+        i = bisect_left(self.max_doc_ids, doc_id)
+        if i == len(self.segments) or doc_id in self.segments[i].deleted:
+            return None
+        return self.segments[i].document(doc_id)
+
+class TermLookups:
+    """
+    Stands in for a segment's IndexReader while a batch of queries runs (see SearchEngine.search_batch()):
+    each term is looked up in the dictionary once, and every query after the first gets a fresh cursor that
+    shares the first one's decoded skip table.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.has_positions = index.has_positions
+        self.cursors = {} # word -> PostingsCursor left at the start, or None if the segment lacks the word
+
+    def _lookup(self, word):
+        if word not in self.cursors:
+            self.cursors[word] = self.index.cursor(word)
+        return self.cursors[word]
+
+    def cursor(self, word):
+        cursor = self._lookup(word)
+        return cursor.fresh() if cursor is not None else None
+
+    def doc_frequency(self, word):
+        cursor = self._lookup(word)
+        return cursor.df if cursor is not None else 0
 
 class SearchEngine:
-    def __init__(self, inverted_index_file="output/inverted_index.json", document_map_file="output/inverted_index_doc_map.json"):
-        self.inverted_index = self._load_json(inverted_index_file)
-        self.document_map = self._load_json(document_map_file)
-        print("Loaded inverted index from inverted_index.json")
-        print("Loaded document map from inverted_index_doc_map.json")
-
-    def _load_json(self, filepath):
-        if not os.path.exists(filepath):
-            return {} # Return empty if file doesn't exist
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-
-    def _tokenize(self, text):
-        return re.findall(r'\b\w+\b', text.lower())
-
-    def search(self, query):
-        query_words = self._tokenize(query)
-        
-        # Calculate TF-IDF like scores (simplified for demonstration)
-        # This is a very basic scoring, can be improved with actual TF-IDF,
-        # cosine similarity, PageRank, etc.
-        doc_scores = defaultdict(float)
-        
-        for word in query_words:
-            if word in self.inverted_index:
-                doc_ids = self.inverted_index[word]
-                for doc_id in doc_ids:
-                    # Simple scoring: just count word occurrences in documents
-                    # In a real system, you'd calculate actual TF-IDF weights
-                    doc_scores[doc_id] += 1 # Increment score for each word match
-
-        # Sort results by score in descending order
-        # Convert doc_id to int for sorting purposes if needed, but keep string for map lookup
-        sorted_results = sorted(doc_scores.items(), key=lambda item: item[1], reverse=True)
-        
-        # Format for output: (score, doc_id)
-        # Ensure score is a float or int, not a string here.
-        # It should already be a float/int from doc_scores defaultdict.
-        return [(score, doc_id) for doc_id, score in sorted_results]
\ No newline at end of file
+    def __init__(self, index_dir="output", k1=1.2, b=0.75, reload_interval=1.0, cache_size=1024, rank_weight=RANK_WEIGHT):
+        # BM25 parameters: k1 controls how quickly repeated terms stop adding score,
+        # b how strongly long documents are penalised (0 = not at all, 1 = fully length-normalised)
+        self.k1 = k1
+        self.b = b
+        # Every match also scores rank_scale * its doc rank, the static score stored in the index (0 = text only)
+        self.rank_weight = rank_weight
+        self.rank_scale = rank_weight / MAX_DOC_RANK
+        self.index_dir = index_dir
+        # Seconds between checks for a newer index generation (written by Indexer or IndexUpdater)
+        self.reload_interval = reload_interval
+        self.reload_lock = threading.Lock()
+        self.last_reload_check = time.monotonic()
+        self.manifest_mtime = self._manifest_mtime()
+        # Results of recent queries, least recently used first. Only valid for one index generation.
+        self.cache_size = cache_size # Most queries kept; 0 disables the cache
+        self.cache = OrderedDict() # (query key, media) -> (k, [(score, doc_id), ...], total hits)
+        self.cache_generation = None
+        self.cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Segments are memory-mapped: opening one reads little, and processes using the same files share their pages
+        self.snapshot = None
+        self.reload()
+        print(f"Opened index {index_dir}: generation {self.snapshot.generation}, "
+              f"{len(self.snapshot.segments)} segment(s), {self.snapshot.doc_count} documents")
+
+    @property
+    def generation(self):
+        return self.snapshot.generation
+
+    def get_document(self, doc_id):
+        """{url, images, videos} for a doc_id returned by search(), or None if it has since been deleted."""
+        return self.snapshot.document(doc_id)
+
+    def get_documents(self, doc_ids):
+        """get_document() for each of doc_ids, in order."""
+        snapshot = self.snapshot
+        return [snapshot.document(doc_id) for doc_id in doc_ids]
+
+    def correct(self, query):
+        """
+        "Did you mean": query with each word that matches no document replaced by the closest term in the
+        index (by edit distance, then document frequency), or None if there is nothing to correct.
+        """
+        return correct_query(query, choose_corrections(self.spelling_candidates(words_to_check(query))))
+
+    def complete(self, prefix, k=TOP_COMPLETIONS):
+        """
+        [(word, document frequency), ...] for the (up to k, at most TOP_COMPLETIONS) most frequent words in the
+        index starting with prefix, most frequent first. For search-box suggestions: a few binary searches in
+        each segment's completion index (see completions.py).
+        """
+        return self._complete(self._current_snapshot(), prefix.lower(), k)
+
+    def _complete(self, snapshot, prefix, k=TOP_COMPLETIONS):
+        segments = [segment for segment in snapshot.segments if segment.completions is not None]
+        if len(segments) == 1:
+            return segments[0].completions.complete(prefix)[:k]
+        candidates = {word for segment in segments for word, _ in segment.completions.complete(prefix)}
+        # A segment's top words need not be the index's: rank them by their frequency in every segment
+        found = [(word, sum(segment.index.doc_frequency(word) for segment in snapshot.segments)) for word in candidates]
+        found.sort(key=lambda item: (-item[1], item[0]))
+        return found[:k]
+
+    def prefix_terms(self, prefixes):
+        """
+        {prefix: ([(word, document frequency), ...], truncated)}: the (up to MAX_PREFIX_TERMS) most frequent
+        terms in the index starting with each of prefixes, most frequent first, and whether there are more.
+        What a prefix query (pyth*) searches for; read from each segment's term dictionary.
+        """
+        snapshot = self._current_snapshot()
+        return {prefix: self._prefix_terms(snapshot, prefix) for prefix in prefixes}
+
+    def _prefix_terms(self, snapshot, prefix):
+        found = snapshot.prefix_expansions.get(prefix)
+        if found is not None:
+            return found
+        dfs = {}
+        truncated = False
+        for segment in snapshot.segments:
+            terms, count = segment.index.prefix_terms(prefix, MAX_PREFIX_TERMS)
+            truncated = truncated or count > MAX_PREFIX_TERMS
+            for word, df in terms:
+                dfs[word] = dfs.get(word, 0) + df
+        if truncated and len(snapshot.segments) > 1:
+            # A segment's most frequent terms need not be the index's: count them in every segment
+            dfs = {word: sum(segment.index.doc_frequency(word) for segment in snapshot.segments) for word in dfs}
+        terms = sorted(dfs.items(), key=lambda item: (-item[1], item[0]))
+        found = (terms[:MAX_PREFIX_TERMS], truncated or len(terms) > MAX_PREFIX_TERMS)
+        if len(snapshot.prefix_expansions) >= PREFIX_CACHE_SIZE:
+            snapshot.prefix_expansions.clear()
+        snapshot.prefix_expansions[prefix] = found
+        return found
+
+    def truncated_prefixes(self, query):
+        """The prefixes (pyth*) in query that more than MAX_PREFIX_TERMS terms start with, so were searched for only in part."""
+        snapshot = self._current_snapshot()
+        return [prefix for prefix in query_prefixes(query) if self._prefix_terms(snapshot, prefix)[1]]
+
+    def spelling_candidates(self, words):
+        """
+        {word: (document frequency, {candidate: document frequency})} for words; candidates, the terms close
+        enough to be a correction, are only looked up for words the index does not have. Found through each
+        segment's spelling index (see spelling.py) rather than by comparing the word with every term.
+        """
+        snapshot = self._current_snapshot()
+        found = {}
+        for word in words:
+            term = snapshot.analyzer.term(word)
+            if term is None:
+                continue # A stopword, which is never searched for, so never corrected either
+            df = sum(segment.index.doc_frequency(term) for segment in snapshot.segments)
+            candidates = {}
+            if not df:
+                for segment in snapshot.segments:
+                    if segment.spelling is not None:
+                        candidates.update(segment.spelling.candidates(term, max_distance_for(term)))
+                candidates = {candidate: sum(segment.index.doc_frequency(candidate) for segment in snapshot.segments)
+                              for candidate in candidates}
+            found[word] = (df, candidates)
+        return found
+
+    def status(self):
+        """What is being served: the index generation, its number of segments and of live documents."""
+        snapshot = self._current_snapshot()
+        return {'generation': snapshot.generation, 'segments': len(snapshot.segments), 'documents': snapshot.doc_count}
+
+    def _manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.index_dir, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Switches to the latest committed generation of the index if it is newer than the one in use."""
+        with self.reload_lock:
+            for _ in range(3):
+                manifest = read_manifest(self.index_dir)
+                if self.snapshot is not None and manifest['generation'] == self.snapshot.generation:
+                    return False
+                try:
+                    # Searches already running keep the snapshot they started with
+                    self.snapshot = IndexSnapshot(self.index_dir, manifest, self.snapshot)
+                except FileNotFoundError:
+                    continue # A newer commit removed files of the generation just read; read the manifest again
+                return True
+            return False
+
+    def _check_for_updates(self):
+        now = time.monotonic()
+        if now - self.last_reload_check < self.reload_interval:
+            return
+        self.last_reload_check = now
+        # Only a stat per check: the manifest is read when it has been replaced
+        mtime = self._manifest_mtime()
+        if mtime != self.manifest_mtime:
+            self.manifest_mtime = mtime
+            self.reload()
+
+    def cache_stats(self):
+        with self.cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+                'size': len(self.cache),
+                'generation': self.cache_generation,
+            }
+
+    def _cached(self, generation, key, k):
+        """(results, total hits) from the cache if it holds at least the k best results for key, else None."""
+        with self.cache_lock:
+            if self.cache_generation is None or generation > self.cache_generation:
+                # The index changed: every cached result may be stale
+                self.cache.clear()
+                self.cache_generation = generation
+            entry = self.cache.get(key) if generation == self.cache_generation else None
+            # A shorter list than was asked for holds every match, so it answers any k
+            if entry is None or (entry[0] < k and len(entry[1]) == entry[0]):
+                self.cache_misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return entry[1][:k], entry[2]
+
+    def _store(self, generation, key, k, results, total):
+        with self.cache_lock:
+            if generation != self.cache_generation or not self.cache_size:
+                return # Computed on a generation that has been replaced meanwhile, or caching is off
+            self.cache[key] = (k, results, total)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def search(self, query, k=10, media=None):
+        """
+        The k best documents for query by BM25 plus their static score (see pagerank.py), as [(score, doc_id), ...]
+        best first (k=None for every match).
+        Plain words are OR-ed; AND, OR, NOT, "phrases" and NEAR/n narrow the matches (see query_parser.py).
+        A prefix (pyth*) is approximate when many terms start with it: it stands for the MAX_PREFIX_TERMS
+        most frequent, and truncated_prefixes() tells when that happened.
+        media='images' or 'videos' only returns documents with images or videos.
+        """
+        return self._search(self._current_snapshot(), query, k, media)[0]
+
+    def search_page(self, query, page=1, page_size=10, media=None):
+        """
+        One page (numbered from 1) of the results of search(), as ([(score, doc_id), ...], total hits). Only
+        the top page * page_size documents are ranked; total hits is exact when there are fewer matches
+        than that, and an estimate otherwise.
+        """
+        return self._search_page(self._current_snapshot(), query, page, page_size, media)
+
+    def search_batch(self, requests, stats=None):
+        """
+        Runs many searches together against the same generation of the index. requests are dicts with 'query'
+        and optionally 'page', 'page_size' and 'media', as for search_page(); returns one (results, total hits)
+        per request. Terms shared by several queries are looked up in each segment only once.
+
+        stats, a corpus_stats() dict (summed over the shards of a sharded index), replaces the index's own
+        statistics in scoring.
+        """
+        snapshot = self._current_snapshot()
+        lookups = [TermLookups(segment.index) for segment in snapshot.segments]
+        if stats is not None:
+            stats = CorpusStats(**stats)
+        return [self._search_page(snapshot, request['query'], request.get('page', 1), request.get('page_size', 10),
+                                  request.get('media'), lookups, stats)
+                for request in requests]
+
+    def corpus_stats(self, queries):
+        """
+        The statistics BM25 needs to score queries, as a dict: document counts and token total of the index,
+        and the document frequency of every word in queries.
+        """
+        snapshot = self._current_snapshot()
+        words = set()
+        for query in queries:
+            node, plain = self._parse(snapshot, query)
+            words.update(plain if plain is not None else query_words(node))
+        stats = snapshot.stats
+        return {
+            'doc_count': stats.doc_count,
+            'indexed': stats.indexed,
+            'total_tokens': stats.total_tokens,
+            'dfs': {word: sum(segment.index.doc_frequency(word) for segment in snapshot.segments) for word in words},
+        }
+
+    def _current_snapshot(self):
+        self._check_for_updates()
+        return self.snapshot
+
+    def _search_page(self, snapshot, query, page, page_size, media, lookups=None, stats=None):
+        if page_size is None:
+            return self._search(snapshot, query, None, media, lookups, stats) # Every match, on one page
+        page = max(page, 1)
+        results, total = self._search(snapshot, query, page * page_size, media, lookups, stats)
+        return results[(page - 1) * page_size:page * page_size], total
+
+    def _parse(self, snapshot, query):
+        """(parsed query, its plain words): words is None if the query uses operators, and node None if it has no words or is not valid syntax."""
+        if '*' in query:
+            # A prefix (pyth*) stands for the terms starting with it, up to MAX_PREFIX_TERMS of the most frequent
+            query = expand_prefixes(query, lambda prefix: [word for word, _ in self._prefix_terms(snapshot, prefix)[0]])
+        try:
+            node = parse_query(query, snapshot.analyzer.positions)
+        except QuerySyntaxError:
+            # Not valid query syntax (e.g. "NOT" on its own): search for the words as typed
+            return None, snapshot.analyzer.analyze(query)
+        return node, (plain_words(node) if node is not None else [])
+
+    def _search(self, snapshot, query, k, media, lookups=None, stats=None):
+        """
+        (top k results, total hits) for query on snapshot. lookups, one per segment, replace the segments'
+        IndexReaders for finding terms; stats, a CorpusStats, replaces the snapshot's statistics.
+        """
+        if not snapshot.segments:
+            return [], 0
+        if k is None:
+            k = max(sum(segment.index.doc_count for segment in snapshot.segments), 1)
+        mask = MEDIA_FLAGS[media]
+        node, words = self._parse(snapshot, query)
+        if node is None and not words:
+            return [], 0
+
+        # Plain words are scored as a bag, so their order does not matter either
+        key = (tuple(sorted(words)) if words is not None else query_key(node), media)
+        if stats is None:
+            stats = snapshot.stats
+        else:
+            key += stats.key()
+        cached = self._cached(snapshot.generation, key, k)
+        if cached is not None:
+            return list(cached[0]), cached[1]
+        if lookups is None:
+            lookups = [segment.index for segment in snapshot.segments]
+        if words is not None:
+            results, total = self._ranked_search(snapshot, stats, lookups, words, k, mask)
+        else:
+            results, total = self._boolean_search(snapshot, stats, lookups, node, k, mask)
+        self._store(snapshot.generation, key, k, results, total)
+        return list(results), total
+
+    def _bm25_weights(self, stats, idf, count=1):
+        """(weight, length_norm) such that a posting scores weight * tf / (tf + k1 * (1 - b) + length_norm * doc_length)."""
+        k1, b = self.k1, self.b
+        return count * idf * (k1 + 1), k1 * b / (stats.avg_doc_length or 1.0)
+
+    def _boolean_search(self, snapshot, stats, lookups, node, k, mask=0):
+        """
+        Walks the matching documents of a query with operators, which come out of intersections and unions of
+        sorted postings (see query_parser.py), and ranks them by BM25 over the query's non-negated words.
+        Every match is visited, so the number of hits returned with the results is exact.
+        """
+        k1_1_b = self.k1 * (1 - self.b)
+        rank_scale = self.rank_scale
+        weights = {} # word -> (weight, length_norm), from statistics over all segments
+        heap = [] # Min-heap of (score, -doc_id) holding the best k so far, across segments
+        hits = 0
+        for segment, lookup in zip(snapshot.segments, lookups):
+            matcher, scoring_words = build_matcher(node, lookup)
+            doc_lengths, doc_flags, doc_ranks = segment.index.doc_lengths, segment.index.doc_flags, segment.index.doc_ranks
+            doc_base, deleted = segment.doc_base, segment.deleted
+            scorers = []
+            for word in scoring_words:
+                if word not in weights:
+                    df = sum(other.doc_frequency(word) for other in lookups)
+                    weights[word] = self._bm25_weights(stats, stats.idf(word, df))
+                # A cursor of its own, only ever moved forward to the matched documents
+                scorers.append((lookup.cursor(word),) + weights[word])
+
+            while matcher.doc != END:
+                doc_id = matcher.doc
+                if doc_base + doc_id in deleted or (doc_flags[doc_id] & mask) != mask:
+                    matcher.next()
+                    continue
+                hits += 1
+                score = rank_scale * doc_ranks[doc_id]
+                for cursor, weight, length_norm in scorers:
+                    cursor.next_geq(doc_id)
+                    if cursor.doc == doc_id:
+                        tf = cursor.tf
+                        score += weight * tf / (tf + k1_1_b + length_norm * doc_lengths[doc_id])
+                entry = (score, -(doc_base + doc_id))
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                matcher.next()
+
+        return [(score, -negated_doc_id) for score, negated_doc_id in sorted(heap, reverse=True)], hits
+
+    def _ranked_search(self, snapshot, stats, lookups, words, k, mask=0):
+        """
+        The k best documents containing any of words (and having the doc flags in mask), with the number of
+        such documents: exact if there are fewer than k, estimated otherwise.
+
+        Uses MaxScore: query terms are ordered by the most any single document could score from them, and once
+        the k-th best score exceeds what the lowest-scoring terms could add up to, documents containing only
+        those terms are never visited. The postings of those terms are only probed, via their skip tables,
+        for documents found through the other terms. Per-block upper bounds additionally let whole blocks of
+        postings that cannot reach the top k be skipped without decoding them, so broad queries cost roughly
+        in proportion to k rather than to the length of their postings lists.
+
+        Segments are searched one after another into the same top k, so the threshold reached in one segment
+        lets the next skip from the start.
+        """
+        segment_cursors = [[] for _ in snapshot.segments] # Per segment: [(word, cursor), ...]
+        weights = {} # word -> (weight, length_norm)
+        for word, count in Counter(words).items():
+            cursors = [lookup.cursor(word) for lookup in lookups]
+            df = sum(cursor.df for cursor in cursors if cursor is not None)
+            if not df:
+                continue
+            # A repeated query word counts once per occurrence
+            weights[word] = self._bm25_weights(stats, stats.idf(word, df), count)
+            for i, cursor in enumerate(cursors):
+                if cursor is not None:
+                    segment_cursors[i].append((word, cursor))
+
+        heap = [] # Min-heap of (score, -doc_id) holding the best k so far, across segments
+        for segment, cursors in zip(snapshot.segments, segment_cursors):
+            if cursors:
+                self._ranked_search_segment(segment, cursors, weights, heap, k, mask)
+        results = [(score, -negated_doc_id) for score, negated_doc_id in sorted(heap, reverse=True)]
+        if len(results) < k:
+            return results, len(results) # Every match was scored
+        estimate = sum(self._estimate_hits(segment, cursors, mask)
+                       for segment, cursors in zip(snapshot.segments, segment_cursors) if cursors)
+        return results, max(round(estimate), len(results))
+
+    def _estimate_hits(self, segment, cursors, mask):
+        """
+        How many of segment's live documents contain any of the cursors' terms and have the doc flags in mask,
+        assuming terms and media occur independently of each other.
+        """
+        index = segment.index
+        indexed = max(index.doc_count, 1)
+        none_match = 1.0
+        for _, cursor in cursors:
+            none_match *= 1 - min(cursor.df / indexed, 1.0)
+        estimate = indexed * (1 - none_match)
+        estimate *= segment.live_doc_count / max(segment.live_doc_count + len(segment.deleted), 1)
+        if mask & DOC_HAS_IMAGES:
+            estimate *= min(index.image_doc_count / indexed, 1.0)
+        if mask & DOC_HAS_VIDEOS:
+            estimate *= min(index.video_doc_count / indexed, 1.0)
+        return estimate
+
+    def _ranked_search_segment(self, segment, cursors, weights, heap, k, mask):
+        """MaxScore over one segment's cursors, adding its documents to heap."""
+        doc_lengths, doc_flags, doc_ranks = segment.index.doc_lengths, segment.index.doc_flags, segment.index.doc_ranks
+        doc_base, deleted = segment.doc_base, segment.deleted
+        k1_1_b = self.k1 * (1 - self.b)
+        rank_scale = self.rank_scale
+        rank_bound = rank_scale * segment.index.max_doc_rank # The most a static score adds to any document here
+        terms = [] # (upper bound, cursor, weight, length_norm, per-block upper bounds)
+        for word, cursor in cursors:
+            weight, length_norm = weights[word]
+            # Term score grows with tf and shrinks with document length, so these bound every posting
+            upper_bound = weight * cursor.max_tf / (cursor.max_tf + k1_1_b + length_norm * cursor.min_doc_length)
+            block_bounds = [weight * max_tf / (max_tf + k1_1_b + length_norm * min_doc_length)
+                            for max_tf, min_doc_length in zip(cursor.block_max_tf, cursor.block_min_doc_length)]
+            terms.append((upper_bound, cursor, weight, length_norm, block_bounds))
+        terms.sort(key=lambda term: term[0])
+
+        # cumulative_bounds[i]: the most terms[0..i] can add to a document together (its static score aside)
+        cumulative_bounds = []
+        total = 0.0
+        for upper_bound, _, _, _, _ in terms:
+            total += upper_bound
+            cumulative_bounds.append(total)
+
+        threshold = heap[0][0] if len(heap) == k else 0.0 # Score to beat once the heap is full
+        first_essential = 0 # terms[:first_essential] cannot reach the threshold on their own
+        if len(heap) == k:
+            while first_essential < len(terms) and cumulative_bounds[first_essential] + rank_bound <= threshold:
+                first_essential += 1
+        window_end = 0 # Doc ids below window_end share the block-max bound window_bound
+        window_bound = 0.0
+        while first_essential < len(terms):
+            doc_id = min(term[1].doc for term in terms[first_essential:])
+            if doc_id == END:
+                break
+
+            if len(heap) == k:
+                # Block-max check: bound doc_id's score by the blocks it falls in. The same bound holds for every
+                # doc id up to the end of the shortest of those blocks, so it is computed once per such window
+                # and a failing check skips the rest of the window.
+                if doc_id >= window_end:
+                    window_bound = rank_bound
+                    window_end = END
+                    for _, cursor, _, _, block_bounds in terms:
+                        block = cursor.block_at(doc_id)
+                        if block is None:
+                            continue
+                        if cursor.block_first[block] > doc_id:
+                            window_end = min(window_end, cursor.block_first[block]) # No posting for this term before there
+                            continue
+                        window_bound += block_bounds[block]
+                        window_end = min(window_end, cursor.block_last[block] + 1)
+                if window_bound <= threshold:
+                    for term in terms[first_essential:]:
+                        term[1].next_geq(window_end)
+                    continue
+
+            score = 0.0
+            for _, cursor, weight, length_norm, _ in terms[first_essential:]:
+                if cursor.doc == doc_id:
+                    tf = cursor.tf
+                    score += weight * tf / (tf + k1_1_b + length_norm * doc_lengths[doc_id])
+                    cursor.next()
+            if doc_base + doc_id in deleted:
+                continue # Replaced or removed since this segment was written
+            if (doc_flags[doc_id] & mask) != mask:
+                continue # Filtered out by media
+            score += rank_scale * doc_ranks[doc_id]
+            for i in range(first_essential - 1, -1, -1):
+                if score + cumulative_bounds[i] <= threshold:
+                    break # Even a perfect match on the remaining terms would not make the top k
+                _, cursor, weight, length_norm, _ = terms[i]
+                cursor.next_geq(doc_id)
+                if cursor.doc == doc_id:
+                    tf = cursor.tf
+                    score += weight * tf / (tf + k1_1_b + length_norm * doc_lengths[doc_id])
+
+            entry = (score, -(doc_base + doc_id))
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif score > threshold:
+                heapq.heapreplace(heap, entry)
+            else:
+                continue
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and cumulative_bounds[first_essential] + rank_bound <= threshold:
+                    first_essential += 1
+
+def check_boolean_scores():
+    """Every document a query with operators matches scores what the ranked search gives it for the same words."""
+    import random
+    import tempfile
+    from index_updater import IndexUpdater
+    queries = {
+        '(rust AND cargo) OR rust': 'rust cargo',
+        '"borrow checker" OR borrow': 'borrow checker',
+        '(rust OR cargo) AND borrow NOT java': 'rust cargo borrow',
+        'checker NEAR/2 borrow OR (cargo AND java)': 'checker borrow cargo java',
+    }
+    random.seed(12)
+    vocabulary = ['rust', 'cargo', 'borrow', 'checker', 'java', 'memory', 'safety', 'crate', 'trait', 'lifetime']
+    with tempfile.TemporaryDirectory() as index_dir:
+        updater = IndexUpdater(index_dir, background_merge=False)
+        for batch in range(3): # Several segments
+            updater.add_documents([{'url': f'https://example.com/{batch}/{i}',
+                                    'text_content': ' '.join(random.choices(vocabulary, k=random.randint(3, 30)))}
+                                   for i in range(1000)])
+        updater.close()
+        engine = SearchEngine(index_dir)
+        for query, words in queries.items():
+            ranked = dict((doc_id, score) for score, doc_id in engine.search(words, None))
+            matches = engine.search(query, None)
+            wrong = [doc_id for score, doc_id in matches if abs(score - ranked[doc_id]) > 1e-9]
+            assert matches and not wrong, (query, len(wrong), len(matches))
+            print(f"{query}: {len(matches)} matches, all scored as by ranked search")
+
+if __name__ == "__main__":
+    # python searcher.py check
+    if sys.argv[1:] == ['check']:
+        check_boolean_scores()
@@ -0,0 +1,160 @@
+import json
+import os
+from docstore import DocStore, DocStoreWriter
+from index_format import IndexReader, positions_path
+from completions import CompletionIndex
+from spelling import SpellingIndex
+
+# The index is a directory of segments. Each segment is an ordinary index file (see index_format.py) plus a
+# store of its documents (see docstore.py), and covers a contiguous range of global doc ids: doc_base + the file's own ids.
+# Segments are never modified once written. Deleting a document writes a new tombstone file for its segment,
+# and merging replaces several segments with one.
+#
+# manifest.json lists the live segments and is replaced atomically on every change, so it is the single
+# commit point: a reader that loads a manifest sees exactly one consistent generation of the index.
+MANIFEST_FILE = "manifest.json"
+
+def empty_manifest():
+    return {
+        'generation': 0, # Increases with every commit
+        'next_doc_id': 1,
+        'next_segment': 1,
+        'segments': [], # In doc id order; see new_segment_info()
+        'sources': {}, # documents file path -> {'offset', 'head'}: how far IndexUpdater.follow() has indexed it
+        # Once the index is built, also 'analyzer': the configuration of the Analyzer that turned its documents
+        # into terms (see analyzer.py), which queries and later segments must use too
+    }
+
+def read_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(index_dir, manifest, previous=None):
+    """
+    Commits manifest, then deletes the files of previous (the manifest it replaces) that it no longer uses.
+    Processes that still have those segments open keep working: their files stay mapped until closed.
+    """
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    if previous is not None:
+        for filename in _segment_files(previous) - _segment_files(manifest):
+            try:
+                os.remove(os.path.join(index_dir, filename))
+            except FileNotFoundError:
+                pass
+
+def _segment_files(manifest):
+    filenames = set()
+    for info in manifest['segments']:
+        name = info['name']
+        filenames.update((name + '.bin', name + '.pos', name + '.spell', name + '.cmp', name + '.docs'))
+        if info['deleted_file']:
+            filenames.add(info['deleted_file'])
+    return filenames
+
+def segment_file(index_dir, name, suffix):
+    """
+    Path of one of a segment's files: suffix is '.bin' (the index), '.spell' (its spelling index), '.cmp' (its
+    completion index) or '.docs' (its documents).
+    """
+    return os.path.join(index_dir, name + suffix)
+
+def new_segment_name(manifest):
+    name = f"seg_{manifest['next_segment']:06d}"
+    manifest['next_segment'] += 1
+    return name
+
+def new_segment_info(name, doc_base, max_doc_id, doc_count):
+    return {
+        'name': name,
+        'doc_base': doc_base, # Global doc id = doc_base + the id inside the segment's index file
+        'max_doc_id': max_doc_id, # Highest global doc id in the segment
+        'doc_count': doc_count,
+        'deleted_file': None, # JSON list of deleted global doc ids, replaced (under a new name) on every change
+        'deleted_count': 0,
+    }
+
+def load_deleted(index_dir, info):
+    if not info['deleted_file']:
+        return frozenset()
+    with open(os.path.join(index_dir, info['deleted_file']), 'r', encoding='utf-8') as f:
+        return frozenset(json.load(f))
+
+def write_deleted(index_dir, info, deleted, generation):
+    """Records deleted (global doc ids) as info's tombstones, in a new file so readers of older generations are unaffected."""
+    filename = f"{info['name']}.{generation}.del"
+    with open(os.path.join(index_dir, filename), 'w', encoding='utf-8') as f:
+        json.dump(sorted(deleted), f)
+    info['deleted_file'] = filename
+    info['deleted_count'] = len(deleted)
+
+def open_documents(index_dir, name):
+    """The segment's DocStore. Its doc ids are those of the segment's index file: global doc id - doc_base."""
+    return DocStore(segment_file(index_dir, name, '.docs'))
+
+def documents_writer(index_dir, name):
+    return DocStoreWriter(segment_file(index_dir, name, '.docs'))
+
+def remove_segment_files(index_dir, name):
+    """Cleans up a segment that was written but never committed, including files left half-written."""
+    for path in (segment_file(index_dir, name, '.bin'), positions_path(segment_file(index_dir, name, '.bin')),
+                 segment_file(index_dir, name, '.spell'), segment_file(index_dir, name, '.cmp'),
+                 segment_file(index_dir, name, '.docs')):
+        for leftover in (path, path + '.tmp'):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+class Segment:
+    """A segment opened for searching: its index reader, spelling and completion indexes, document store and tombstones."""
+    def __init__(self, index_dir, info, previous=None):
+        self.name = info['name']
+        self.doc_base = info['doc_base']
+        self.deleted_file = info['deleted_file']
+        if previous is not None:
+            # Same segment in a newer generation: the index and documents never change, only the tombstones
+            self.index = previous.index
+            self.spelling = previous.spelling
+            self.completions = previous.completions
+            self.documents = previous.documents
+        else:
+            self.index = IndexReader(segment_file(index_dir, self.name, '.bin'))
+            spelling_file = segment_file(index_dir, self.name, '.spell')
+            # Segments written before spelling and completion indexes existed just make no suggestions
+            self.spelling = SpellingIndex(spelling_file) if os.path.exists(spelling_file) else None
+            completions_file = segment_file(index_dir, self.name, '.cmp')
+            self.completions = CompletionIndex(completions_file) if os.path.exists(completions_file) else None
+            self.documents = open_documents(index_dir, self.name)
+        if previous is not None and previous.deleted_file == self.deleted_file:
+            self.deleted = previous.deleted
+        else:
+            self.deleted = load_deleted(index_dir, info)
+        self.live_doc_count = info['doc_count'] - info['deleted_count']
+
+    def document(self, doc_id):
+        """{url, images, videos} of a global doc_id in this segment (deleted or not), read from disk on demand."""
+        return self.documents.get(doc_id - self.doc_base)
+
+def open_segments(index_dir, manifest, previous=()):
+    """Segment objects for manifest, reusing the readers of any of previous that are still part of the index."""
+    previous_by_name = {segment.name: segment for segment in previous}
+    return [Segment(index_dir, info, previous_by_name.get(info['name'])) for info in manifest['segments']]
+
+def source_state(path, offset):
+    """
+    What IndexUpdater.follow() keeps about a documents file: how far it has been indexed, and its first bytes,
+    which tell a file that was rewritten from scratch apart from one that only grew.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(256)
+    return {'offset': offset, 'head': head.hex()}
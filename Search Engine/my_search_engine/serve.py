@@ -0,0 +1,96 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# Production entry point: python serve.py [--host 0.0.0.0] [--port 8000] [--workers N] [--access-log]
+#
+# The app, and with it the index, is loaded once in this process, and then the worker processes are forked
+# from it. Index segments are memory-mapped read-only, so all workers read the same pages of the page cache;
+# what SearchEngine loads besides (the document maps) is shared copy-on-write. Each worker serves requests
+# on threads, all workers accept connections from the one listening socket, and this process only restarts
+# workers that die. Needs os.fork(), so Unix only; app.py's own app.run() remains the development server.
+#
+# Workers pick up new index generations by themselves (see SearchEngine.reload_interval).
+# With a sharded index (see shards.py), each worker starts its own shard worker processes on its first search.
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass # A line per request on stderr costs more than serving a cached result
+
+def open_listening_socket(host, port, backlog=128):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def start_worker(app, sock, host, port, access_log):
+    pid = os.fork()
+    if pid:
+        return pid
+    # In the worker: run until the master sends SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the whole process group; the master handles it
+    try:
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno(),
+                             request_handler=WSGIRequestHandler if access_log else QuietRequestHandler)
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+def serve(host="127.0.0.1", port=8000, workers=None, access_log=False):
+    workers = workers or os.cpu_count() or 1
+    sock = open_listening_socket(host, port)
+
+    from app import app, search_engine_instance # Loads the index, once, before forking
+    # Objects that exist now are never collected, so the workers' garbage collector leaves their pages shared
+    gc.freeze()
+
+    pids = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        pids.add(start_worker(app, sock, host, port, access_log))
+    print(f"Serving index generation {search_engine_instance.generation} on http://{host}:{port} with {workers} worker(s)")
+
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        pids.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; starting a new one")
+            time.sleep(1) # Don't spin if workers die as soon as they start
+            pids.add(start_worker(app, sock, host, port, access_log))
+    sock.close()
+    print("All workers stopped.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the search engine with several worker processes.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--access-log', action='store_true', help="log every request")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.access_log)
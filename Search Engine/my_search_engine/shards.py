@@ -0,0 +1,407 @@
+import argparse
+import heapq
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import zlib
+from itertools import islice
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from completions import TOP_COMPLETIONS
+from query_parser import expand_prefixes, query_prefixes
+from searcher import MAX_PREFIX_TERMS, SearchEngine
+from segments import empty_manifest, read_manifest, write_manifest
+from spelling import choose_corrections, correct_query, words_to_check
+
+# Sharded index: Indexer(shards=N) partitions the documents by a hash of their URL and writes each part as a
+# complete segmented index of its own (see segments.py) in output/shard_000, output/shard_001, ...
+# output/shards.json lists them, and is written last, so it is what makes an index directory sharded.
+#
+# ShardedSearchEngine fans every query out to one worker per shard, each holding a SearchEngine over its
+# shard, and merges the top k each of them returns. Workers are local processes by default; started with
+# "python shards.py serve <shard dir> --port P" on other machines, they are reached over TCP instead.
+# Each query takes two round trips: the first collects the document counts and document frequencies of
+# every shard, so that the second can score all shards with the same, corpus-wide BM25 statistics.
+#
+# A global doc id is local doc id * shard count + shard, so get_document() knows which shard to ask.
+SHARDS_FILE = 'shards.json'
+AUTHKEY_VARIABLE = 'SEARCH_SHARD_AUTHKEY' # Environment variable with the shared secret of TCP shard servers
+
+class ShardError(RuntimeError):
+    """A shard worker failed to answer a request."""
+
+def shard_of(url, shard_count):
+    """The shard a document belongs to. Stable across runs and processes, unlike hash()."""
+    return zlib.crc32(url.encode('utf-8')) % shard_count
+
+def shard_name(shard):
+    return 'shard_%03d' % shard
+
+def read_shards(index_dir):
+    """Directories of the shards of the index in index_dir, or None if it is not sharded."""
+    path = os.path.join(index_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return [os.path.join(index_dir, name) for name in json.load(f)['shards']]
+
+def write_shards(index_dir, names):
+    """Commits a sharded index: switches index_dir over to the shards names, and drops whatever was there before."""
+    previous = read_shards(index_dir) or []
+    path = os.path.join(index_dir, SHARDS_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'shards': names}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # An unsharded index in the same directory: commit it empty, which deletes its segments
+    manifest = read_manifest(index_dir)
+    if manifest['segments']:
+        write_manifest(index_dir, dict(empty_manifest(), generation=manifest['generation'] + 1), manifest)
+    for shard_dir in previous:
+        if os.path.basename(shard_dir) not in names:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+def remove_shards(index_dir):
+    """Makes index_dir unsharded again (after an unsharded rebuild), deleting its shards."""
+    shard_dirs = read_shards(index_dir)
+    if shard_dirs is None:
+        return
+    os.remove(os.path.join(index_dir, SHARDS_FILE))
+    for shard_dir in shard_dirs:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+def serve_connection(engine, conn):
+    """Answers a ShardedSearchEngine's requests on conn with engine until the connection closes."""
+    handlers = {
+        'stats': engine.corpus_stats,
+        'search': engine.search_batch,
+        'documents': engine.get_documents,
+        'status': engine.status,
+        'spelling': engine.spelling_candidates,
+        'complete': lambda prefixes: {prefix: engine.complete(prefix) for prefix in prefixes},
+        'prefix_terms': engine.prefix_terms,
+    }
+    while True:
+        try:
+            method, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            reply = (True, handlers[method](*args))
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        conn.send(reply)
+    conn.close()
+
+def start_local_worker(shard_dir, engine_options):
+    """
+    Starts a worker process for shard_dir, connected to this one by a socket pair. A fresh interpreter
+    rather than a fork: the worker needs none of this process's state, and forking a process that serves
+    requests on threads is unsafe.
+    """
+    sock, worker_sock = socket.socketpair()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', shard_dir,
+                                '--fd', str(worker_sock.fileno()), '--options', json.dumps(engine_options)],
+                               pass_fds=(worker_sock.fileno(),))
+    worker_sock.close()
+    return Connection(sock.detach()), process
+
+def serve_shard(shard_dir, host, port, authkey):
+    """Serves one shard over TCP, a thread per connected ShardedSearchEngine."""
+    engine = SearchEngine(shard_dir)
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"Serving shard {shard_dir} on {host}:{port}")
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                print("Refused a connection with the wrong authkey")
+                continue
+            threading.Thread(target=serve_connection, args=(engine, conn), daemon=True).start()
+
+class _Shard:
+    def __init__(self, conn, process=None):
+        self.conn = conn
+        self.process = process # None for a shard served over TCP
+        self.lock = threading.Lock() # A connection carries one request at a time
+
+class ShardedSearchEngine:
+    """
+    Searches a sharded index with the same interface as SearchEngine. Each shard is searched in its own
+    worker process, all at the same time, so a query's latency is that of the slowest shard rather than of
+    the whole index.
+
+    With addresses ([(host, port), ...], one per shard, in shard order) the workers are shard servers on
+    other machines and authkey is their shared secret; otherwise one local worker process is started per
+    shard of index_dir, with engine_options passed on to its SearchEngine. Local workers are started on first
+    use in each process, so an engine created before serve.py forks gets separate workers in every server
+    process.
+    """
+    def __init__(self, index_dir="output", addresses=None, authkey=None, **engine_options):
+        self.index_dir = index_dir
+        self.addresses = addresses
+        self.authkey = authkey if authkey is not None else os.environ.get(AUTHKEY_VARIABLE, '').encode() or None
+        self.engine_options = engine_options
+        if addresses is None:
+            self.shard_dirs = read_shards(index_dir)
+            if self.shard_dirs is None:
+                raise ValueError(f"{index_dir} is not a sharded index; build one with Indexer(shards=N)")
+            self.shard_count = len(self.shard_dirs)
+        else:
+            self.shard_dirs = None
+            self.shard_count = len(addresses)
+        self.shards = None
+        self.pid = None # Process the current workers were started for
+        self.start_lock = threading.Lock()
+        if addresses is None:
+            # Counted from the manifests: starting workers here would leave a set idle in serve.py's master,
+            # which forks before serving and whose server processes each start their own
+            manifests = [read_manifest(shard_dir) for shard_dir in self.shard_dirs]
+            documents = sum(info['doc_count'] - info['deleted_count'] for manifest in manifests for info in manifest['segments'])
+        else:
+            documents = self.status()['documents']
+            self._stop() # Connections are not shared across serve.py's fork either
+        print(f"Opened sharded index {index_dir}: {self.shard_count} shard(s), {documents} documents")
+
+    @property
+    def generation(self):
+        return tuple(self.status()['generation'])
+
+    def _workers(self):
+        if self.pid != os.getpid():
+            with self.start_lock:
+                if self.pid != os.getpid():
+                    self._start()
+        return self.shards
+
+    def _start(self):
+        self.shards = []
+        if self.addresses is not None:
+            for address in self.addresses:
+                self.shards.append(_Shard(Client(tuple(address), authkey=self.authkey)))
+        else:
+            for shard_dir in self.shard_dirs:
+                self.shards.append(_Shard(*start_local_worker(shard_dir, self.engine_options)))
+        self.pid = os.getpid()
+
+    def _stop(self):
+        """Drops the workers of this process after a failure; the next request starts new ones."""
+        with self.start_lock:
+            if self.pid == os.getpid():
+                for shard in self.shards:
+                    shard.conn.close()
+                    if shard.process is not None:
+                        shard.process.terminate()
+                        shard.process.wait()
+                self.pid = None
+
+    def _scatter(self, method, args_per_shard):
+        """
+        Sends method(*args) to each shard (skipping those whose args are None), then gathers the replies in the
+        same order, so all the shards work at once. Returns {shard: result}.
+        """
+        shards = self._workers()
+        asked = [(i, shards[i]) for i, args in enumerate(args_per_shard) if args is not None]
+        locked = []
+        failure = None
+        try:
+            for i, shard in asked:
+                shard.lock.acquire()
+                locked.append(shard)
+                shard.conn.send((method, args_per_shard[i]))
+            replies = {i: shard.conn.recv() for i, shard in asked}
+        except (EOFError, OSError) as e:
+            failure = e
+        finally:
+            for shard in locked:
+                shard.lock.release()
+        if failure is not None:
+            self._stop()
+            raise ShardError(f"Lost a shard worker: {failure!r}") from failure
+        for i, (ok, result) in replies.items():
+            if not ok:
+                raise ShardError(f"Shard {i}: {result}")
+        return {i: result for i, (ok, result) in replies.items()}
+
+    def _corpus_stats(self, queries):
+        """corpus_stats() of every shard, added up."""
+        totals = {'doc_count': 0, 'indexed': 0, 'total_tokens': 0, 'dfs': {}}
+        for stats in self._scatter('stats', [(queries,)] * self.shard_count).values():
+            for field in ('doc_count', 'indexed', 'total_tokens'):
+                totals[field] += stats[field]
+            for word, df in stats['dfs'].items():
+                totals['dfs'][word] = totals['dfs'].get(word, 0) + df
+        return totals
+
+    def search(self, query, k=10, media=None):
+        """As SearchEngine.search(); doc ids are global (see get_document())."""
+        return self.search_batch([{'query': query, 'page': 1, 'page_size': k, 'media': media}])[0][0]
+
+    def search_page(self, query, page=1, page_size=10, media=None):
+        """As SearchEngine.search_page(): total hits is the sum over the shards, each exact or estimated."""
+        return self.search_batch([{'query': query, 'page': page, 'page_size': page_size, 'media': media}])[0]
+
+    def search_batch(self, requests):
+        """As SearchEngine.search_batch(): the whole batch goes to every shard in one request."""
+        if not requests:
+            return []
+        # Prefixes (pyth*) are expanded here, so that every shard searches for the same words
+        queries = [request['query'] for request in requests]
+        prefixes = {prefix for query in queries for prefix in query_prefixes(query)}
+        if prefixes:
+            expansions = self._prefix_terms(prefixes)
+            queries = [expand_prefixes(query, lambda prefix: [word for word, _ in expansions[prefix][0]]) for query in queries]
+        stats = self._corpus_stats(queries)
+        # Any of a shard's top page * page_size documents can be on the requested page of the merged results
+        shard_requests = []
+        for query, request in zip(queries, requests):
+            page, page_size = max(request.get('page', 1), 1), request.get('page_size', 10)
+            shard_requests.append({'query': query, 'page': 1, 'media': request.get('media'),
+                                   'page_size': page * page_size if page_size is not None else None})
+        replies = self._scatter('search', [(shard_requests, stats)] * self.shard_count)
+
+        pages = []
+        for n, request in enumerate(requests):
+            page, page_size = max(request.get('page', 1), 1), request.get('page_size', 10)
+            total = 0
+            shard_results = []
+            for shard, shard_pages in replies.items():
+                results, hits = shard_pages[n]
+                total += hits
+                shard_results.append([(score, doc_id * self.shard_count + shard) for score, doc_id in results])
+            # Each shard's results are best first; ties go to the lower doc id, as within a shard
+            merged = heapq.merge(*shard_results, key=lambda result: (-result[0], result[1]))
+            if page_size is None:
+                pages.append((list(merged), total))
+            else:
+                start = (page - 1) * page_size
+                pages.append((list(islice(merged, start, start + page_size)), total))
+        return pages
+
+    def get_document(self, doc_id):
+        """{url, images, videos} for a doc_id returned by search(), or None if it has since been deleted."""
+        return self.get_documents([doc_id])[0]
+
+    def get_documents(self, doc_ids):
+        """get_document() for each of doc_ids, in order, asking each shard once."""
+        by_shard = [[] for _ in range(self.shard_count)]
+        for doc_id in doc_ids:
+            by_shard[doc_id % self.shard_count].append(doc_id // self.shard_count)
+        replies = self._scatter('documents', [(local_ids,) if local_ids else None for local_ids in by_shard])
+        found = {shard: iter(documents) for shard, documents in replies.items()}
+        return [next(found[doc_id % self.shard_count]) for doc_id in doc_ids]
+
+    def complete(self, prefix, k=TOP_COMPLETIONS):
+        """As SearchEngine.complete(), ranking each shard's most frequent words by their frequency in all shards together."""
+        prefix = prefix.lower()
+        return self._complete([prefix], k)[prefix]
+
+    def _complete(self, prefixes, k):
+        prefixes = list(prefixes)
+        candidates = {prefix: set() for prefix in prefixes}
+        for shard_completions in self._scatter('complete', [(prefixes,)] * self.shard_count).values():
+            for prefix, words in shard_completions.items():
+                candidates[prefix].update(word for word, _ in words)
+        # A shard's most frequent words need not be the whole index's: count them in every shard
+        dfs = self._corpus_stats([' '.join(words) for words in candidates.values()])['dfs']
+        return {prefix: sorted(((word, dfs[word]) for word in words), key=lambda item: (-item[1], item[0]))[:k]
+                for prefix, words in candidates.items()}
+
+    def prefix_terms(self, prefixes):
+        """As SearchEngine.prefix_terms(), over all shards together."""
+        return self._prefix_terms(prefixes)
+
+    def _prefix_terms(self, prefixes):
+        prefixes = list(prefixes)
+        dfs = {prefix: {} for prefix in prefixes}
+        truncated = set()
+        for shard_terms in self._scatter('prefix_terms', [(prefixes,)] * self.shard_count).values():
+            for prefix, (words, shard_truncated) in shard_terms.items():
+                for word, df in words:
+                    dfs[prefix][word] = dfs[prefix].get(word, 0) + df
+                if shard_truncated:
+                    truncated.add(prefix)
+        if truncated:
+            # A shard's most frequent terms need not be the whole index's: count them in every shard
+            counted = self._corpus_stats([' '.join(dfs[prefix]) for prefix in truncated])['dfs']
+            for prefix in truncated:
+                dfs[prefix] = {word: counted.get(word, df) for word, df in dfs[prefix].items()}
+        expansions = {}
+        for prefix, words in dfs.items():
+            terms = sorted(words.items(), key=lambda item: (-item[1], item[0]))
+            expansions[prefix] = (terms[:MAX_PREFIX_TERMS], prefix in truncated or len(terms) > MAX_PREFIX_TERMS)
+        return expansions
+
+    def truncated_prefixes(self, query):
+        """As SearchEngine.truncated_prefixes()."""
+        prefixes = query_prefixes(query)
+        if not prefixes:
+            return []
+        expansions = self._prefix_terms(set(prefixes))
+        return [prefix for prefix in prefixes if expansions[prefix][1]]
+
+    def correct(self, query):
+        """As SearchEngine.correct(), with document frequencies added up over the shards."""
+        words = words_to_check(query)
+        if not words:
+            return None
+        found = {word: (0, {}) for word in words}
+        for shard_found in self._scatter('spelling', [(words,)] * self.shard_count).values():
+            for word, (df, candidates) in shard_found.items():
+                total_df, total_candidates = found[word]
+                for candidate, candidate_df in candidates.items():
+                    total_candidates[candidate] = total_candidates.get(candidate, 0) + candidate_df
+                found[word] = (total_df + df, total_candidates)
+        return correct_query(query, choose_corrections(found))
+
+    def status(self):
+        """As SearchEngine.status(), added up over the shards; generation lists each shard's."""
+        shard_status = self._scatter('status', [()] * self.shard_count)
+        shard_status = [shard_status[i] for i in range(self.shard_count)]
+        return {
+            'generation': [status['generation'] for status in shard_status],
+            'segments': sum(status['segments'] for status in shard_status),
+            'documents': sum(status['documents'] for status in shard_status),
+            'shards': self.shard_count,
+        }
+
+    def close(self):
+        """Stops this process's workers, or disconnects from the shard servers."""
+        if self.pid == os.getpid():
+            self._stop()
+
+def open_search_engine(index_dir="output"):
+    """A ShardedSearchEngine if index_dir holds a sharded index, else a SearchEngine."""
+    if read_shards(index_dir) is not None:
+        return ShardedSearchEngine(index_dir)
+    return SearchEngine(index_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a shard of a sharded index to ShardedSearchEngines.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="serve a shard over TCP, e.g. to search servers on other machines")
+    serve_parser.add_argument('shard_dir', help="a shard directory, e.g. output/shard_000")
+    serve_parser.add_argument('--host', default="127.0.0.1")
+    serve_parser.add_argument('--port', type=int, required=True)
+    # Used by ShardedSearchEngine for its local workers
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('shard_dir')
+    worker_parser.add_argument('--fd', type=int, required=True)
+    worker_parser.add_argument('--options', default='{}')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the whole process group; exit when the parent does
+        serve_connection(SearchEngine(args.shard_dir, **json.loads(args.options)), Connection(args.fd))
+    else:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+        if not authkey:
+            parser.error(f"set {AUTHKEY_VARIABLE} to the secret shared with the search servers")
+        serve_shard(args.shard_dir, args.host, args.port, authkey.encode())
@@ -0,0 +1,187 @@
+import mmap
+import os
+import re
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+
+# Spelling index: a SymSpell deletion index over one segment's term dictionary, written next to its index
+# file (spelling_path()) by IndexWriter, for "did you mean" suggestions.
+#
+# Every term is indexed under each string obtained by deleting up to MAX_EDIT_DISTANCE characters from its
+# first PREFIX_LENGTH characters. A word within that edit distance of a term shares at least one such
+# deletion with it, so finding the candidate corrections of a word takes only a few dozen lookups of the
+# word's own deletions, however large the vocabulary; each candidate is then checked with the real edit
+# distance. Deletions are stored as 64-bit hashes: a collision only adds a candidate that fails the check.
+#
+# Layout (all integers little-endian):
+#   header        HEADER
+#   terms         the indexed terms as UTF-8, back to back, then uint32 offsets of each term and of the end
+#   keys          uint64 hash per (deletion, term) pair, sorted
+#   term ids      uint32 per key: the term it belongs to
+MAGIC = b'MSESPL\x00\x01'
+VERSION = 1
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_WORD_LENGTH = 3 # Shorter query words are never corrected: too many terms are within one edit of them
+MAX_TERM_LENGTH = 30 # Longer terms are rarely words anyone types (hashes, identifiers, run-together text)
+# magic, version, max edit distance, prefix length, term count, term offsets offset, keys offset, key count
+HEADER = struct.Struct('<8sIIIIQQQ')
+
+WORD_PATTERN = re.compile(r'\b\w+\b(?!\*)') # The default analyzer's words (see analyzer.py), minus prefixes (pyth*)
+OPERATORS = {'AND', 'OR', 'NOT', 'NEAR'}
+
+def spelling_path(index_path):
+    """The spelling index that goes with index_path, e.g. output/index.spell for output/index.bin."""
+    return os.path.splitext(index_path)[0] + '.spell'
+
+def is_correctable(term):
+    """Whether term is kept in the spelling index: words, not numbers or identifiers with digits."""
+    return 2 <= len(term) <= MAX_TERM_LENGTH and term.isalpha()
+
+def max_distance_for(word):
+    """How many edits a correction of word may be away: one for short words, which look alike more easily."""
+    return 1 if len(word) <= 4 else MAX_EDIT_DISTANCE
+
+def deletions(word, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+    """word's prefix and every string obtained by deleting up to max_distance of its characters."""
+    found = {word[:prefix_length]}
+    frontier = found
+    for _ in range(max_distance):
+        frontier = {text[:i] + text[i + 1:] for text in frontier for i in range(len(text))} - found
+        found |= frontier
+    return found
+
+def _key(text):
+    # Two fast 32-bit checksums side by side make a 64-bit hash that, unlike hash(), is the same in every process
+    text_bytes = text.encode('utf-8')
+    return zlib.crc32(text_bytes) << 32 | zlib.adler32(text_bytes)
+
+def edit_distance(a, b, max_distance):
+    """
+    Damerau-Levenshtein distance between a and b (an adjacent transposition is one edit), or max_distance + 1
+    once it is certain to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous_row, row = previous_row, row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return min(row[len(b)], max_distance + 1)
+
+def write_spelling_index(path, terms):
+    """Writes the spelling index of terms (the correctable terms of an index, see is_correctable())."""
+    terms = list(terms)
+    # (key, term id) pairs packed into one int each, which sort much faster than tuples
+    pairs = [_key(deletion) << 32 | term_id for term_id, term in enumerate(terms) for deletion in deletions(term)]
+    pairs.sort()
+    encoded_terms = [term.encode('utf-8') for term in terms]
+    term_offsets = array('I', [0])
+    for term_bytes in encoded_terms:
+        term_offsets.append(term_offsets[-1] + len(term_bytes))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size) # Filled in at the end
+        f.write(b''.join(encoded_terms))
+        f.write(b'\0' * (-f.tell() % 8)) # Keep the arrays aligned for memoryview.cast()
+        term_offsets_offset = f.tell()
+        f.write(struct.pack(f'<{len(term_offsets)}I', *term_offsets))
+        f.write(b'\0' * (-f.tell() % 8))
+        keys_offset = f.tell()
+        f.write(struct.pack(f'<{len(pairs)}Q', *(pair >> 32 for pair in pairs)))
+        f.write(struct.pack(f'<{len(pairs)}I', *(pair & 0xFFFFFFFF for pair in pairs)))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, MAX_EDIT_DISTANCE, PREFIX_LENGTH, len(terms), term_offsets_offset,
+                            keys_offset, len(pairs)))
+    os.replace(tmp_path, path)
+
+class SpellingIndex:
+    """Read-only view of a spelling index file."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.max_distance, self.prefix_length, self.term_count, term_offsets_offset,
+         keys_offset, key_count) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} spelling index; rebuild the index with indexer.py")
+        view = memoryview(self.buf)
+        self.term_offsets = view[term_offsets_offset:term_offsets_offset + 4 * (self.term_count + 1)].cast('I')
+        self.keys = view[keys_offset:keys_offset + 8 * key_count].cast('Q')
+        term_ids_offset = keys_offset + 8 * key_count
+        self.term_ids = view[term_ids_offset:term_ids_offset + 4 * key_count].cast('I')
+        view.release()
+
+    def term(self, term_id):
+        return self.buf[HEADER.size + self.term_offsets[term_id]:HEADER.size + self.term_offsets[term_id + 1]].decode('utf-8')
+
+    def candidates(self, word, max_distance):
+        """{term: edit distance} for the indexed terms within max_distance edits of word (other than word itself)."""
+        max_distance = min(max_distance, self.max_distance)
+        term_ids = set()
+        for deletion in deletions(word, max_distance, self.prefix_length):
+            key = _key(deletion)
+            i = bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                term_ids.add(self.term_ids[i])
+                i += 1
+        found = {}
+        for term_id in term_ids:
+            term = self.term(term_id)
+            if term != word:
+                distance = edit_distance(word, term, max_distance)
+                if distance <= max_distance:
+                    found[term] = distance
+        return found
+
+    def close(self):
+        self.term_offsets.release()
+        self.keys.release()
+        self.term_ids.release()
+        self.buf.close()
+
+def words_to_check(query):
+    """The distinct words of query (lower case, operators left out) that a correction could replace."""
+    words = []
+    for match in WORD_PATTERN.finditer(query):
+        word = match.group(0)
+        if word not in OPERATORS:
+            word = word.lower()
+            if len(word) >= MIN_WORD_LENGTH and word.isalpha() and word not in words:
+                words.append(word)
+    return words
+
+def choose_corrections(found):
+    """
+    found: {word: (document frequency, {candidate: document frequency})}. Returns {word: correction} for the
+    words that match no document: the closest candidate by edit distance, then the most common.
+    """
+    corrections = {}
+    for word, (df, candidates) in found.items():
+        if df or not candidates:
+            continue
+        max_distance = max_distance_for(word)
+        ranked = sorted((edit_distance(word, candidate, max_distance), -candidate_df, candidate)
+                        for candidate, candidate_df in candidates.items() if candidate_df)
+        if ranked and ranked[0][0] <= max_distance:
+            corrections[word] = ranked[0][2]
+    return corrections
+
+def correct_query(query, corrections):
+    """query with the words in corrections replaced, operators and everything else as typed; None if nothing changes."""
+    if not corrections:
+        return None
+    def replace(match):
+        word = match.group(0)
+        return word if word in OPERATORS else corrections.get(word.lower(), word)
+    return WORD_PATTERN.sub(replace, query)